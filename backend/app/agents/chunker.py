@@ -1,13 +1,60 @@
 """
 Text chunking utilities for StudyBuddy
 """
-from typing import List, Dict, Any
+from typing import List, Dict, Any, BinaryIO, Iterator, Tuple
+import bisect
+import codecs
 import re
+import zlib
+import numpy as np
+from ..core.config import settings
+from ..core.tokenizer import token_offsets
+
+# How far from the target end a boundary may be
+_BOUNDARY_WINDOW = 200
+
+def find_boundaries(text: str) -> List[int]:
+    """
+    Offsets just after every sentence end and paragraph break, in one pass
+    
+    A sentence ends at . ! or ? followed by whitespace (or the end of the
+    text); a paragraph break is a newline followed by another line break.
+    The scan is vectorized over the code points, so it runs at memory speed
+    instead of one Python iteration per character.
+    
+    Args:
+        text: Text to scan
+    
+    Returns:
+        Sorted list of break positions
+    """
+    if not text:
+        return []
+    
+    # One element per character, so array offsets are string offsets
+    if text.isascii():
+        codes = np.frombuffer(text.encode("ascii"), dtype=np.uint8)
+    else:
+        codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+    
+    current, following = codes[:-1], codes[1:]
+    whitespace_follows = (following == 32) | ((following >= 9) & (following <= 13))
+    is_break = ((current == 46) | (current == 33) | (current == 63)) & whitespace_follows
+    is_break |= (current == 10) & ((following == 10) | (following == 13))
+    
+    boundaries = (np.flatnonzero(is_break) + 1).tolist()
+    if codes[-1] in (46, 33, 63):
+        boundaries.append(len(text))
+    return boundaries
 
 def chunk_text(text: str, chunk_size: int = 1000, chunk_overlap: int = 100) -> List[str]:
     """
     Split text into overlapping chunks for better context preservation
     
+    Chunks end at the sentence or paragraph boundary closest to
+    start + chunk_size (within 200 characters either way, and never before
+    half a chunk), found by bisecting a boundary index built once per text.
+    
     Args:
         text: Text to chunk
         chunk_size: Maximum characters per chunk
@@ -19,36 +66,319 @@ def chunk_text(text: str, chunk_size: int = 1000, chunk_overlap: int = 100) -> L
     if not text or len(text) <= chunk_size:
         return [text] if text else []
     
-    chunks = []
+    spans, _ = _char_spans(text, chunk_size, chunk_overlap, complete=True)
+    return _span_texts(text, spans)
+
+def _char_spans(text: str, chunk_size: int, chunk_overlap: int,
+                complete: bool) -> Tuple[List[Tuple[int, int]], int]:
+    """
+    (start, end) offsets of the character chunks of text
+    
+    With complete=False the text is the head of a longer stream: chunks are
+    only cut where the text read so far covers the whole boundary window,
+    so they match what chunk_text returns for the full text.
+    
+    Returns:
+        (chunk spans, offset the next chunk starts at)
+    """
+    boundaries = find_boundaries(text)
+    text_length = len(text)
+    spans = []
     start = 0
     
-    while start < len(text):
+    while start < text_length:
         end = start + chunk_size
         
         # If we're not at the end of the text, try to break at a sentence boundary
-        if end < len(text):
-            # Look for sentence endings near the chunk boundary
-            sentence_end = -1
-            for i in range(max(0, end - 200), min(len(text), end + 200)):
-                if text[i] in '.!?':
-                    sentence_end = i + 1
-                    break
-            
-            # If we found a sentence boundary, use it
-            if sentence_end > start + chunk_size // 2:  # Don't make chunks too small
-                end = sentence_end
+        if end < text_length and (complete or end + _BOUNDARY_WINDOW < text_length):
+            end = _closest_boundary(boundaries, end, start + chunk_size // 2)
+        elif not complete:
+            break
+        
+        spans.append((start, end))
         
+        if end >= text_length:
+            return spans, text_length
+    
+        # Move start position, accounting for overlap (always make progress)
+        start = max(end - chunk_overlap, start + 1)
+    
+    return spans, start
+
+def _span_texts(text: str, spans: List[Tuple[int, int]]) -> List[str]:
+    """Stripped, non-empty chunk texts"""
+    chunks = []
+    for start, end in spans:
         chunk = text[start:end].strip()
         if chunk:
             chunks.append(chunk)
+    return chunks
+
+def _closest_boundary(boundaries: List[int], target: int, minimum: int) -> int:
+    """Boundary nearest to target within the window and after minimum (else target)"""
+    index = bisect.bisect_left(boundaries, target)
+    best = target
+    best_distance = _BOUNDARY_WINDOW + 1
+    for candidate_index in (index - 1, index):
+        if 0 <= candidate_index < len(boundaries):
+            candidate = boundaries[candidate_index]
+            distance = abs(candidate - target)
+            if candidate > minimum and distance <= _BOUNDARY_WINDOW and distance < best_distance:
+                best, best_distance = candidate, distance
+    return best
+
+def chunk_text_by_tokens(text: str, chunk_tokens: int = 300, overlap_tokens: int = 30) -> List[str]:
+    """
+    Split text into overlapping chunks of at most chunk_tokens tokens
+    
+    Tokens follow the embedding tokenizer, so every chunk has a predictable
+    token count whatever the content (prose, code, spreadsheet rows). Chunks
+    end at the last sentence or paragraph boundary within the token window
+    (never before half a chunk).
+    
+    Args:
+        text: Text to chunk
+        chunk_tokens: Maximum tokens per chunk
+        overlap_tokens: Tokens shared by consecutive chunks
+    
+    Returns:
+        List of text chunks
+    """
+    if not text:
+        return []
+    
+    starts = token_offsets(text)
+    if len(starts) <= chunk_tokens:
+        return [text]
+    
+    spans, _ = _token_spans(text, starts, chunk_tokens, overlap_tokens, complete=True)
+    return _span_texts(text, spans)
+
+def _token_spans(text: str, starts: List[int], chunk_tokens: int, overlap_tokens: int,
+                 complete: bool) -> Tuple[List[Tuple[int, int]], int]:
+    """
+    (start, end) character offsets of the token chunks of text
+    
+    Args:
+        text: Text to chunk
+        starts: Character offset of each token (token_offsets)
+        chunk_tokens: Maximum tokens per chunk
+        overlap_tokens: Tokens shared by consecutive chunks
+        complete: False if more text follows (see _char_spans)
+    
+    Returns:
+        (chunk spans, character offset the next chunk starts at)
+    """
+    boundaries = find_boundaries(text)
+    token_total = len(starts)
+    spans = []
+    start = 0
+    
+    while start < token_total:
+        end = start + chunk_tokens
         
-        # Move start position, accounting for overlap
-        start = end - chunk_overlap
-        if start >= len(text):
+        if end < token_total:
+            end_char = starts[end]
+            if not complete and end_char + _BOUNDARY_WINDOW >= len(text):
+                break
+            boundary = _last_boundary(boundaries, end_char, starts[start + chunk_tokens // 2])
+            if boundary is not None:
+                end_char = boundary
+                end = bisect.bisect_left(starts, end_char)
+        elif complete:
+            end_char = len(text)
+        else:
             break
+        
+        spans.append((starts[start], end_char))
+        
+        if end >= token_total:
+            return spans, len(text)
+        
+        start = max(end - overlap_tokens, start + 1)
+    
+    return spans, starts[start] if start < token_total else len(text)
+
+def _last_boundary(boundaries: List[int], target: int, minimum: int):
+    """Last boundary at or before target and after minimum (None if there is none)"""
+    index = bisect.bisect_right(boundaries, target) - 1
+    if index >= 0 and boundaries[index] > minimum:
+        return boundaries[index]
+    return None
+
+def split_text(text: str) -> List[str]:
+    """Chunk text with the configured mode (settings.chunking_mode)"""
+    if settings.chunking_mode == "tokens":
+        return chunk_text_by_tokens(
+            text,
+            chunk_tokens=settings.chunk_size_tokens,
+            overlap_tokens=settings.chunk_overlap_tokens
+        )
+    return chunk_text(text, chunk_size=settings.chunk_size, chunk_overlap=settings.chunk_overlap)
+
+def _configured_spans(text: str, complete: bool) -> Tuple[List[Tuple[int, int]], int]:
+    """Chunk spans of text with the configured mode (see _char_spans)"""
+    if settings.chunking_mode == "tokens":
+        return _token_spans(
+            text,
+            token_offsets(text),
+            settings.chunk_size_tokens,
+            settings.chunk_overlap_tokens,
+            complete
+        )
+    return _char_spans(text, settings.chunk_size, settings.chunk_overlap, complete)
+
+def iter_split_text(stream: BinaryIO, encoding: str = "utf-8",
+                    read_size: int = 1024 * 1024) -> Iterator[str]:
+    """
+    Lazily chunk a binary file object with the configured mode
+    
+    The stream is decoded incrementally and only the unchunked tail of the
+    text read so far is buffered (about read_size characters), so memory
+    stays flat however large the file is. Character-mode chunks are the same
+    as split_text would return for the whole text.
+    
+    Args:
+        stream: Binary file object to read
+        encoding: Text encoding of the stream
+        read_size: Bytes read per block
+    
+    Yields:
+        Text chunks, in order
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    buffer = ""
+    
+    while True:
+        block = stream.read(read_size)
+        complete = not block
+        buffer += decoder.decode(block, final=complete)
+        
+        spans, next_start = _configured_spans(buffer, complete)
+        yield from _span_texts(buffer, spans)
+        buffer = buffer[next_start:]
+        
+        if complete:
+            return
+
+# Joins pages in packed mode; a paragraph break, so chunks prefer to end at page ends
+_PAGE_SEPARATOR = "\n\n"
+
+# Packed segments span at least / at most this many chunks; about one page in
+# _SEGMENT_CUT_ODDS past the minimum ends a segment
+_SEGMENT_MIN_CHUNKS = 4
+_SEGMENT_MAX_CHUNKS = 16
+_SEGMENT_CUT_ODDS = 4
+
+def _segment_pages(pages: List[str]) -> List[Tuple[int, int]]:
+    """
+    Split pages into (start, end) index ranges that are packed separately
+    
+    Cuts are chosen by page content (a hash of the page text) once a segment
+    is long enough, not by position, so an edited page only changes the
+    segments around it: the cuts after it fall on the same pages as before
+    and every later chunk keeps its text.
+    """
+    # Characters per chunk (about 4 characters per token in token mode)
+    chunk_chars = settings.chunk_size_tokens * 4 if settings.chunking_mode == "tokens" else settings.chunk_size
+    segments = []
+    start = 0
+    length = 0
+    for index, page in enumerate(pages):
+        length += len(page) + len(_PAGE_SEPARATOR)
+        content_cut = zlib.crc32(page.encode("utf-8")) % _SEGMENT_CUT_ODDS == 0
+        if (length >= chunk_chars * _SEGMENT_MIN_CHUNKS and content_cut) or length >= chunk_chars * _SEGMENT_MAX_CHUNKS:
+            segments.append((start, index + 1))
+            start = index + 1
+            length = 0
+    if start < len(pages):
+        segments.append((start, len(pages)))
+    return segments
+
+def pack_pages(pages: List[str], first_page: int = 1) -> List[Dict[str, Any]]:
+    """
+    Chunk a paged document across page boundaries with the configured mode
+    
+    Short pages (slides, title pages) share chunks instead of each becoming
+    a tiny chunk of its own. Every chunk records the pages it spans and the
+    character offsets of its start and end within those pages. Pages are
+    packed in content-defined segments (see _segment_pages), so editing a
+    page leaves the chunks of unchanged regions as they were.
+    
+    Args:
+        pages: Text of each page, in order
+        first_page: Number of the first page
     
+    Returns:
+        List of {"text", "page_start", "page_end", "start_offset", "end_offset"}
+    """
+    chunks = []
+    for start, end in _segment_pages(pages):
+        chunks.extend(_pack_segment(pages[start:end], first_page + start))
     return chunks
 
+def _pack_segment(pages: List[str], first_page: int) -> List[Dict[str, Any]]:
+    """Chunk consecutive pages as one text (see pack_pages)"""
+    page_starts = []
+    position = 0
+    for page in pages:
+        page_starts.append(position)
+        position += len(page) + len(_PAGE_SEPARATOR)
+    text = _PAGE_SEPARATOR.join(pages)
+    
+    def locate(offset: int, end: bool = False) -> Tuple[int, int]:
+        """(page index, offset within the page) of a document offset"""
+        index = bisect.bisect_right(page_starts, offset - 1 if end else offset) - 1
+        return index, min(offset - page_starts[index], len(pages[index]))
+    
+    spans, _ = _configured_spans(text, complete=True)
+    chunks = []
+    for start, end in spans:
+        segment = text[start:end]
+        stripped = segment.strip()
+        if not stripped:
+            continue
+        start += len(segment) - len(segment.lstrip())
+        end = start + len(stripped)
+        
+        start_index, start_offset = locate(start)
+        end_index, end_offset = locate(end, end=True)
+        chunks.append({
+            "text": stripped,
+            "page_start": first_page + start_index,
+            "page_end": first_page + end_index,
+            "start_offset": start_offset,
+            "end_offset": end_offset
+        })
+    return chunks
+
+def should_pack_pages(pages: List[str]) -> bool:
+    """Whether a PDF is chunked across pages (settings.pdf_chunking)"""
+    if settings.pdf_chunking == "page":
+        return False
+    if settings.pdf_chunking == "packed":
+        return True
+    
+    # auto: pack slide-like documents, whose typical page fills less than half a chunk
+    lengths = sorted(len(page) for page in pages if page.strip())
+    if not lengths:
+        return False
+    median = lengths[len(lengths) // 2]
+    
+    # Half a chunk in characters (about 4 characters per token in token mode)
+    if settings.chunking_mode == "tokens":
+        return median < settings.chunk_size_tokens * 2
+    return median < settings.chunk_size // 2
+
+def page_label(chunk: Dict[str, Any]) -> str:
+    """Citation label of a chunk: "3" or "3-5" for chunks spanning pages"""
+    metadata = chunk.get("metadata") or {}
+    page_start = metadata.get("page_start", chunk.get("page", "N/A"))
+    page_end = metadata.get("page_end", page_start)
+    if page_end != page_start:
+        return f"{page_start}-{page_end}"
+    return f"{page_start}"
+
 class ChunkerAgent:
     """Legacy chunker for backward compatibility"""
     
@@ -143,21 +143,21 @@ Respond with only the intent category."""
         try:
             user_query = state.get("user_query", "")
             doc_id = state.get("doc_id")  # Get doc_id filter from state
+            intent = state.get("intent", "chat")
             
             logger.info(f"Conductor retrieving context for query: '{user_query}' with doc_id: {doc_id}")
             
-            # Use RAG to get relevant chunks with document filtering
-            result = await self.rag.process_query(user_query, session_id="conductor", doc_id=doc_id)
+            # Multi-query retrieval with document filtering (plan intents expand into subtopics)
+            result = await self.rag.retrieve(user_query, doc_id=doc_id, intent=intent)
             
-            logger.info(f"RAG pipeline returned: {len(result.get('context_chunks', []))} chunks")
+            logger.info(f"RAG retrieval returned: {len(result.get('context_chunks', []))} chunks")
             
-            # The simple RAG pipeline returns the response directly, not wrapped in a success dict
             if result.get("context_chunks"):
                 state["context_chunks"] = result["context_chunks"]
                 state["step_log"].append({
                     "step": "retrieve_context",
                     "result": f"Retrieved {len(result['context_chunks'])} relevant chunks",
-                    "details": {"num_chunks": len(result["context_chunks"])}
+                    "details": {"num_chunks": len(result["context_chunks"]), "queries": result["queries"]}
                 })
             else:
                 state["context_chunks"] = []
@@ -6,6 +6,8 @@ from typing import List, Dict, Any, Optional
 from langchain_openai import ChatOpenAI
 from langchain.schema import HumanMessage, SystemMessage
 from ..core.config import settings
+from ..core.tokenizer import pack_chunks
+from .chunker import page_label
 from ..services.simple_rag import SimpleRAGPipeline
 
 logger = logging.getLogger(__name__)
@@ -45,17 +47,26 @@ class TutorAgent:
             context_with_sources = []
             sources = []
             
-            for i, chunk in enumerate(context_chunks[:5]):  # Use top 5 chunks
+            # Use the top chunks that fit the context token budget
+            source_count = len(context_chunks)
+            context_chunks = pack_chunks(
+                context_chunks,
+                settings.max_context_tokens,
+                header=lambda chunk: f"[Source {source_count}: {chunk.get('filename', 'Unknown')}, Page {page_label(chunk)}]"
+            )
+            
+            for i, chunk in enumerate(context_chunks):
                 source_info = {
                     "id": i + 1,
                     "filename": chunk.get('filename', 'Unknown'),
                     "page": chunk.get('page', 'N/A'),
+                    "pages": page_label(chunk),  # "3-5" for chunks spanning pages
                     "section": chunk.get('section_title', ''),
                     "score": chunk.get('score', 0.0)
                 }
                 sources.append(source_info)
                 
-                context_text = f"[Source {i+1}: {source_info['filename']}, Page {source_info['page']}]\n{chunk.get('text', '')}"
+                context_text = f"[Source {i+1}: {source_info['filename']}, Page {source_info['pages']}]\n{chunk.get('text', '')}"
                 context_with_sources.append(context_text)
             
             combined_context = "\n\n".join(context_with_sources)
@@ -85,7 +96,7 @@ Response:"""
             ])
             
             # Calculate confidence based on relevance scores
-            avg_score = sum(chunk.get('score', 0.0) for chunk in context_chunks[:5]) / min(5, len(context_chunks))
+            avg_score = sum(chunk.get('score', 0.0) for chunk in context_chunks) / max(1, len(context_chunks))
             confidence = min(avg_score * 100, 95.0)  # Cap at 95%
             
             return {
@@ -0,0 +1,74 @@
+"""
+Admin API routes: snapshot export/import
+"""
+from fastapi import APIRouter, HTTPException, Depends, Header
+from typing import Dict, Any, Optional
+from pydantic import BaseModel
+import hmac
+import logging
+
+from ..core.config import settings
+from ..services.snapshot_service import snapshot_path, list_snapshots, export_snapshot, import_snapshot
+
+logger = logging.getLogger(__name__)
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Allow the request only with the configured X-Admin-Token"""
+    if not settings.admin_token:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled (ADMIN_TOKEN is not set)")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, settings.admin_token):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+router = APIRouter(prefix="/admin", dependencies=[Depends(require_admin)])
+
+class SnapshotExportRequest(BaseModel):
+    name: str
+
+class SnapshotImportRequest(BaseModel):
+    force: bool = False
+
+def _resolve(name: str) -> str:
+    try:
+        return snapshot_path(name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/snapshots")
+async def get_snapshots() -> Dict[str, Any]:
+    """
+    List available snapshots
+    """
+    snapshots = list_snapshots()
+    return {"snapshots": snapshots, "total": len(snapshots)}
+
+@router.post("/snapshots")
+async def create_snapshot(request: SnapshotExportRequest) -> Dict[str, Any]:
+    """
+    Export all vectors, payloads and the document registry to a named snapshot
+    """
+    path = _resolve(request.name)
+    try:
+        manifest = await export_snapshot(path)
+        return {"name": request.name, "manifest": manifest}
+    except FileExistsError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error exporting snapshot {request.name}: {e}")
+        raise HTTPException(status_code=500, detail=f"Error exporting snapshot: {str(e)}")
+
+@router.post("/snapshots/{name}/import")
+async def restore_snapshot(name: str, request: SnapshotImportRequest = SnapshotImportRequest()) -> Dict[str, Any]:
+    """
+    Bulk load a snapshot into the vector store (empty unless force is set)
+    """
+    path = _resolve(name)
+    try:
+        stats = await import_snapshot(path, force=request.force)
+        return {"name": name, **stats}
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail=f"Snapshot {name} not found")
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error importing snapshot {name}: {e}")
+        raise HTTPException(status_code=500, detail=f"Error importing snapshot: {str(e)}")
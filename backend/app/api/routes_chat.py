@@ -176,20 +176,22 @@ async def chat_health():
         try:
             embeddings_service = get_embeddings_service()
             test_embedding = embeddings_service.embed_text("test")
-            if test_embedding and len(test_embedding) == 1536:
+            if test_embedding is not None and len(test_embedding) == embeddings_service.dimension:
                 health_status["components"]["embeddings"] = "ok"
             else:
                 health_status["components"]["embeddings"] = "error"
                 health_status["status"] = "degraded"
+            health_status["embedding_cache"] = embeddings_service.cache_stats()
+            health_status["embedding_coalescer"] = embeddings_service.coalescer_stats()
         except Exception as e:
             health_status["components"]["embeddings"] = f"error: {str(e)}"
             health_status["status"] = "degraded"
         
         # Test vector store connection
         try:
-            from ..core.db import qdrant_db
+            from ..core.db import vector_store
             # Try a simple operation
-            collections = qdrant_db.client.get_collections()
+            await vector_store.ping()
             health_status["components"]["vector_store"] = "ok"
         except Exception as e:
             health_status["components"]["vector_store"] = f"error: {str(e)}"
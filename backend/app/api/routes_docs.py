@@ -1,17 +1,19 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, BackgroundTasks
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException
 import os
-import shutil
-from typing import List, Dict, Any
-import pdfplumber
-import fitz  # PyMuPDF
-import pandas as pd
-from pathlib import Path
+from typing import Dict, Any, Optional
+import asyncio
+import contextlib
 import uuid
+import hashlib
+import json
 import logging
 
-from ..core.db import qdrant_db
-from ..core.embeddings import get_embeddings_service
-from ..agents.chunker import chunk_text
+from ..core.db import vector_store
+from ..core.document_registry import get_document_registry
+from ..core.dedupe import get_dedupe_index
+from ..core.embedding_backends import get_vector_space
+from ..core.job_queue import get_job_queue
+from ..services.ingestion_service import enqueue_ingestion
 from ..core.config import settings
 
 logger = logging.getLogger(__name__)
@@ -21,267 +23,274 @@ router = APIRouter()
 STORAGE_DIR = settings.upload_dir
 os.makedirs(STORAGE_DIR, exist_ok=True)
 
-def process_and_store_chunks(chunks: List[Dict[str, Any]], doc_id: str, filename: str):
-    """Background task to process and store document chunks"""
+def resolve_doc_id(doc_id: Optional[str]) -> str:
+    """Document ID for an upload: the given one (re-ingest) or a new one"""
+    if not doc_id:
+        return str(uuid.uuid4())
     try:
-        # Extract text from chunks for embedding
-        texts = [chunk["text"] for chunk in chunks if chunk.get("text")]
-        
-        if not texts:
-            logger.warning(f"No text found in chunks for document {doc_id}")
-            return
-        
-        # Generate embeddings
-        logger.info(f"Generating embeddings for {len(texts)} chunks")
-        embeddings_service = get_embeddings_service()
-        embeddings = embeddings_service.embed_texts(texts)
-        
-        # Add metadata to chunks
-        for chunk in chunks:
-            chunk["doc_id"] = doc_id
-            chunk["filename"] = filename
-        
-        # Store in vector database
-        qdrant_db.add_chunks(chunks=chunks, embeddings=embeddings, doc_id=doc_id)
-        
-        logger.info(f"Successfully stored {len(chunks)} chunks for document {doc_id}")
-        
-    except Exception as e:
-        logger.error(f"Error processing chunks for document {doc_id}: {e}")
+        return str(uuid.UUID(doc_id))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="doc_id must be a UUID")
 
-@router.post("/upload/text")
-async def upload_text(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
-    """
-    Upload and process text file with chunking and vector storage
+def file_too_large() -> HTTPException:
+    """413 error for uploads over settings.max_file_size"""
+    return HTTPException(
+        status_code=413,
+        detail=f"File exceeds the maximum upload size of {settings.max_file_size // (1024 * 1024)} MB"
+    )
+
+async def save_upload(file: UploadFile, doc_id: str) -> Dict[str, Any]:
     """
-    if not file.filename.endswith(('.txt', '.md')):
-        raise HTTPException(status_code=400, detail="File must be a text file (.txt or .md)")
+    Stream an upload to disk in fixed-size blocks
     
-    # Generate document ID
-    doc_id = str(uuid.uuid4())
+    The content hash, size and whether the file has any non-whitespace
+    content are computed in the same pass, so the stored file never has to
+    be re-read. The upload is aborted with 413 (and the partial file
+    removed) as soon as it crosses settings.max_file_size.
     
-    # Save file
-    file_path = os.path.join(STORAGE_DIR, f"{doc_id}_{file.filename}")
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    The upload is written to a temporary file next to its final path and
+    only moved into place by commit_upload, so a re-upload that fails or is
+    rejected never touches the document's current file.
+    
+    Args:
+        file: Uploaded file
+        doc_id: Document the upload belongs to
     
+    Returns:
+        Dict with path, temp_path, size_bytes, content_hash and has_text
+    """
+    if file.size is not None and file.size > settings.max_file_size:
+        raise file_too_large()
+    
+    file_path = os.path.join(STORAGE_DIR, f"{doc_id}_{file.filename}")
+    temp_path = f"{file_path}.{uuid.uuid4().hex}.part"
+    digest = hashlib.sha256()
+    size = 0
+    has_text = False
     try:
-        # Read text file
-        with open(file_path, "r", encoding="utf-8") as f:
-            text = f.read()
-        
-        if not text.strip():
-            raise HTTPException(status_code=400, detail="File appears to be empty")
-        
-        # Chunk the text
-        chunks = chunk_text(
-            text=text,
-            chunk_size=settings.chunk_size,
-            chunk_overlap=settings.chunk_overlap
-        )
-        
-        # Prepare chunks for storage
-        all_chunks = []
-        for i, chunk in enumerate(chunks):
-            chunk_data = {
-                "chunk_id": f"{doc_id}_chunk_{i}",
-                "text": chunk,
-                "type": "text",
-                "metadata": {
-                    "source_file": file.filename,
-                    "chunk_index": i
-                }
-            }
-            all_chunks.append(chunk_data)
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing text file: {str(e)}")
+        with open(temp_path, "wb") as buffer:
+            while block := await file.read(settings.upload_block_size):
+                size += len(block)
+                if size > settings.max_file_size:
+                    raise file_too_large()
+                digest.update(block)
+                has_text = has_text or bool(block.strip())
+                buffer.write(block)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(temp_path)
+        raise
+
+    return {
+        "path": file_path,
+        "temp_path": temp_path,
+        "size_bytes": size,
+        "content_hash": digest.hexdigest(),
+        "has_text": has_text
+    }
+
+def commit_upload(upload: Dict[str, Any]):
+    """Atomically move a saved upload to its final path"""
+    os.replace(upload["temp_path"], upload["path"])
+
+def discard_upload(upload: Dict[str, Any]):
+    """Remove a saved upload that won't be ingested"""
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(upload["temp_path"])
+
+def ingest_fingerprint(file_type: str) -> str:
+    """Hash of the settings that determine the chunks and vectors stored for an upload"""
+    fingerprint = {
+        "file_type": file_type,
+        "chunking_mode": settings.chunking_mode,
+        "chunk_size": settings.chunk_size,
+        "chunk_overlap": settings.chunk_overlap,
+        "chunk_size_tokens": settings.chunk_size_tokens,
+        "chunk_overlap_tokens": settings.chunk_overlap_tokens,
+        # Vectors of another embedding space or in another store can't be reused
+        "embedding_backend": settings.embedding_backend.lower(),
+        "vector_space": get_vector_space(),
+        "vector_store": settings.vector_store_backend.lower(),
+        "collection": (
+            settings.local_vector_store_path if settings.vector_store_backend.lower() == "local"
+            else settings.qdrant_collection
+        ),
+        "dedupe_scope": settings.dedupe_scope
+    }
+    if file_type == "pdf":
+        fingerprint.update({
+            "pdf_extractor": settings.pdf_extractor,
+            "pdf_chunking": settings.pdf_chunking,
+            "pdf_strip_boilerplate": settings.pdf_strip_boilerplate,
+            "pdf_boilerplate_edge_lines": settings.pdf_boilerplate_edge_lines,
+            "pdf_boilerplate_min_fraction": settings.pdf_boilerplate_min_fraction
+        })
+    return hashlib.sha256(json.dumps(fingerprint, sort_keys=True).encode("utf-8")).hexdigest()
+
+def find_duplicate_upload(upload: Dict[str, Any], file_type: str, filename: str, doc_id: str,
+                          reingest: bool) -> Optional[Dict[str, Any]]:
+    """
+    Response for an upload whose content is already ingested with the current settings
+    
+    The saved copy is removed and the existing document is returned, so the
+    upload is never parsed, embedded or upserted. A re-ingest (explicit
+    doc_id) is only skipped when that same document already has this content.
+    
+    Returns:
+        Upload response pointing at the existing document, or None to ingest
+    """
+    existing = get_document_registry().find_by_content(upload["content_hash"], ingest_fingerprint(file_type))
+    if existing is None or (reingest and existing["doc_id"] != doc_id):
+        return None
     
-    # Process chunks in background
-    background_tasks.add_task(
-        process_and_store_chunks,
-        chunks=all_chunks,
+    discard_upload(upload)
+    logger.info(f"Upload {filename} has the same content as document {existing['doc_id']}; skipping ingestion")
+    return {
+        "doc_id": existing["doc_id"],
+        "filename": filename,
+        "size_bytes": upload["size_bytes"],
+        "total_chunks": existing["chunk_count"],
+        "duplicate_of": existing["filename"],
+        "status": existing["status"]
+    }
+
+def register_upload(doc_id: str, filename: str, file_type: str, upload: Dict[str, Any],
+                    chunk_count: int, metadata: Dict[str, Any]):
+    """Record an upload in the document registry as processing"""
+    get_document_registry().register(
         doc_id=doc_id,
-        filename=file.filename
+        filename=filename,
+        file_type=file_type,
+        file_path=upload["path"],
+        size_bytes=upload["size_bytes"],
+        content_hash=upload["content_hash"],
+        chunk_count=chunk_count,
+        metadata={**metadata, "ingest_fingerprint": ingest_fingerprint(file_type)}
     )
+
+    
+def queue_upload(upload: Dict[str, Any], doc_id: str, filename: str, file_type: str) -> Dict[str, Any]:
+    """Register a stored upload and queue its ingestion job"""
+    commit_upload(upload)
+    register_upload(doc_id, filename, file_type, upload, 0, {})
+    job = enqueue_ingestion(doc_id, file_type, upload["path"], filename)
     
     return {
         "doc_id": doc_id,
-        "filename": file.filename,
-        "total_chunks": len(all_chunks),
-        "char_count": len(text),
-        "status": "processing"  # Indicates background processing
+        "job_id": job["job_id"],
+        "filename": filename,
+        "size_bytes": upload["size_bytes"],
+        "total_chunks": None,  # known when the job completes (see /jobs/{job_id})
+        "status": job["state"]
     }
 
-@router.post("/upload/pdf")
-async def upload_pdf(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
+@router.post("/upload/text")
+async def upload_text(file: UploadFile = File(...), doc_id: Optional[str] = Form(None)):
     """
-    Upload and process PDF file with chunking and vector storage
+    Upload a text file and queue it for chunking and vector storage
+    
+    Pass doc_id to re-upload an existing document; only chunks that
+    changed are re-embedded.
     """
-    if not file.filename.endswith('.pdf'):
-        raise HTTPException(status_code=400, detail="File must be a PDF")
+    if not file.filename.endswith(('.txt', '.md')):
+        raise HTTPException(status_code=400, detail="File must be a text file (.txt or .md)")
     
-    # Generate document ID
-    doc_id = str(uuid.uuid4())
+    # Generate document ID (or re-ingest an existing document)
+    reingest = bool(doc_id)
+    doc_id = resolve_doc_id(doc_id)
     
-    # Save file
-    file_path = os.path.join(STORAGE_DIR, f"{doc_id}_{file.filename}")
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    # Save file (streamed, hashed and size-checked in one pass)
+    upload = await save_upload(file, doc_id)
     
-    # Extract text page by page
-    pages_data = []
-    all_chunks = []
+    if not upload["has_text"]:
+        discard_upload(upload)
+        raise HTTPException(status_code=400, detail="File appears to be empty")
     
-    try:
-        # Using pdfplumber for text extraction
-        with pdfplumber.open(file_path) as pdf:
-            for page_num, page in enumerate(pdf.pages, 1):
-                text = page.extract_text() or ""
-                
-                if text.strip():  # Only process pages with text
-                    # Chunk the page text
-                    page_chunks = chunk_text(
-                        text=text,
-                        chunk_size=settings.chunk_size,
-                        chunk_overlap=settings.chunk_overlap
-                    )
-                    
-                    # Add page metadata to chunks
-                    for i, chunk in enumerate(page_chunks):
-                        chunk_data = {
-                            "chunk_id": f"{doc_id}_page_{page_num}_chunk_{i}",
-                            "text": chunk,
-                            "page": page_num,
-                            "type": "pdf_text",
-                            "metadata": {
-                                "source_file": file.filename,
-                                "page_number": page_num,
-                                "chunk_index": i
-                            }
-                        }
-                        all_chunks.append(chunk_data)
-                
-                # Create page summary for response
-                sample_text = text[:200] + "..." if len(text) > 200 else text
-                pages_data.append({
-                    "page": page_num,
-                    "sample_text": sample_text,
-                    "char_count": len(text),
-                    "chunks_count": len(page_chunks) if text.strip() else 0
-                })
+    # Same content already ingested with the current settings
+    duplicate = await asyncio.to_thread(find_duplicate_upload, upload, "text", file.filename, doc_id, reingest)
+    if duplicate:
+        return duplicate
+        
+    # Read, chunk, embed and store in an ingestion job, streaming the file in bounded batches
+    return await asyncio.to_thread(queue_upload, upload, doc_id, file.filename, "text")
+
+@router.post("/upload/pdf")
+async def upload_pdf(file: UploadFile = File(...), doc_id: Optional[str] = Form(None)):
+    """
+    Upload a PDF file and queue it for extraction, chunking and vector storage
     
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing PDF: {str(e)}")
+    Pass doc_id to re-upload an existing document; only chunks that
+    changed are re-embedded. Page summaries and extraction stats are in
+    the job result.
+    """
+    if not file.filename.endswith('.pdf'):
+        raise HTTPException(status_code=400, detail="File must be a PDF")
     
-    # Process chunks in background
-    background_tasks.add_task(
-        process_and_store_chunks,
-        chunks=all_chunks,
-        doc_id=doc_id,
-        filename=file.filename
-    )
+    # Generate document ID (or re-ingest an existing document)
+    reingest = bool(doc_id)
+    doc_id = resolve_doc_id(doc_id)
     
-    return {
-        "doc_id": doc_id,
-        "filename": file.filename,
-        "total_pages": len(pages_data),
-        "total_chunks": len(all_chunks),
-        "pages": pages_data,
-        "status": "processing"  # Indicates background processing
-    }
+    # Save file (streamed, hashed and size-checked in one pass)
+    upload = await save_upload(file, doc_id)
+    
+    # Same content already ingested with the current settings
+    duplicate = await asyncio.to_thread(find_duplicate_upload, upload, "pdf", file.filename, doc_id, reingest)
+    if duplicate:
+        return duplicate
+    
+    return await asyncio.to_thread(queue_upload, upload, doc_id, file.filename, "pdf")
 
 @router.post("/upload/excel")
-async def upload_excel(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
+async def upload_excel(file: UploadFile = File(...), doc_id: Optional[str] = Form(None)):
     """
-    Upload and process Excel file with chunking and vector storage
+    Upload an Excel file and queue it for chunking and vector storage
+    
+    Pass doc_id to re-upload an existing document; only chunks that
+    changed are re-embedded. Sheet summaries are in the job result.
     """
     if not file.filename.endswith(('.xlsx', '.xls')):
         raise HTTPException(status_code=400, detail="File must be an Excel file (.xlsx or .xls)")
     
-    # Generate document ID
-    doc_id = str(uuid.uuid4())
+    # Generate document ID (or re-ingest an existing document)
+    reingest = bool(doc_id)
+    doc_id = resolve_doc_id(doc_id)
     
-    # Save file
-    file_path = os.path.join(STORAGE_DIR, f"{doc_id}_{file.filename}")
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    # Save file (streamed, hashed and size-checked in one pass)
+    upload = await save_upload(file, doc_id)
     
-    try:
-        # Read Excel file
-        excel_file = pd.ExcelFile(file_path)
-        sheets_data = []
-        all_chunks = []
+    # Same content already ingested with the current settings
+    duplicate = await asyncio.to_thread(find_duplicate_upload, upload, "excel", file.filename, doc_id, reingest)
+    if duplicate:
+        return duplicate
+    
+    return await asyncio.to_thread(queue_upload, upload, doc_id, file.filename, "excel")
         
-        for sheet_name in excel_file.sheet_names:
-            df = pd.read_excel(file_path, sheet_name=sheet_name)
-            
-            # Convert sheet to text for chunking
-            sheet_text = f"Sheet: {sheet_name}\n\n"
-            
-            # Add headers
-            headers = df.columns.tolist()
-            sheet_text += "Headers: " + ", ".join(headers) + "\n\n"
-            
-            # Add data rows
-            for idx, row in df.iterrows():
-                row_text = " | ".join([f"{col}: {val}" for col, val in row.items() if pd.notna(val)])
-                sheet_text += f"Row {idx + 1}: {row_text}\n"
-            
-            # Chunk the sheet text
-            sheet_chunks = chunk_text(
-                text=sheet_text,
-                chunk_size=settings.chunk_size,
-                chunk_overlap=settings.chunk_overlap
-            )
-            
-            # Add sheet metadata to chunks
-            for i, chunk in enumerate(sheet_chunks):
-                chunk_data = {
-                    "chunk_id": f"{doc_id}_sheet_{sheet_name}_chunk_{i}",
-                    "text": chunk,
-                    "page": sheet_name,  # Use sheet name as "page"
-                    "type": "excel_data",
-                    "metadata": {
-                        "source_file": file.filename,
-                        "sheet_name": sheet_name,
-                        "chunk_index": i,
-                        "headers": headers,
-                        "total_rows": len(df)
-                    }
-                }
-                all_chunks.append(chunk_data)
-            
-            # Get sample data for response
-            sample_rows = df.head(5).to_dict('records')
+@router.get("/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    """
+    Get the state of an ingestion job
             
-            sheets_data.append({
-                "sheet_name": sheet_name,
-                "headers": headers,
-                "sample_rows": sample_rows,
-                "total_rows": len(df),
-                "total_columns": len(df.columns),
-                "chunks_count": len(sheet_chunks)
-            })
-    
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing Excel file: {str(e)}")
-    
-    # Process chunks in background
-    background_tasks.add_task(
-        process_and_store_chunks,
-        chunks=all_chunks,
-        doc_id=doc_id,
-        filename=file.filename
-    )
+    State is queued, extracting, embedding, upserting, done or failed;
+    a failed attempt with retries left is queued again (run_after).
+    """
+    job = await asyncio.to_thread(get_job_queue().get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
     
     return {
-        "doc_id": doc_id,
-        "filename": file.filename,
-        "total_sheets": len(sheets_data),
-        "total_chunks": len(all_chunks),
-        "sheets": sheets_data,
-        "status": "processing"  # Indicates background processing
+        "job_id": job_id,
+        "doc_id": job["doc_id"],
+        "kind": job["kind"],
+        "filename": job["payload"].get("filename"),
+        "state": job["state"],
+        "attempts": job["attempts"],
+        "max_attempts": job["max_attempts"],
+        "error": job["error"],
+        "result": job["result"],
+        "run_after": job["run_after"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+        "finished_at": job["finished_at"]
     }
 
 @router.delete("/documents/{doc_id}")
@@ -290,12 +299,19 @@ async def delete_document(doc_id: str):
     Delete a document and all its chunks
     """
     try:
+        # Stop its ingestion; a running job removes anything it stores after this
+        await asyncio.to_thread(get_job_queue().cancel_document, doc_id)
+        
         # Delete from vector store
-        qdrant_db.delete_document(doc_id)
+        await vector_store.delete_document(doc_id)
+        dedupe = get_dedupe_index()
+        if dedupe is not None:
+            await asyncio.to_thread(dedupe.delete_document, doc_id)
         
-        # Delete physical file (if it exists)
-        # Note: We'd need to store file paths to delete them properly
-        # For now, just delete from vector store
+        # Delete registry entry and the stored upload
+        document = await asyncio.to_thread(get_document_registry().delete, doc_id)
+        if document and document.get("file_path") and os.path.exists(document["file_path"]):
+            os.remove(document["file_path"])
         
         return {"message": f"Document {doc_id} deleted successfully"}
         
@@ -311,38 +327,20 @@ async def get_document_status(doc_id: str):
     """
     Get processing status of a document
     """
-    try:
-        # Query vector store to check if chunks exist
-        # Use a dummy embedding to check if document exists
-        dummy_embedding = [0.0] * 1536  # OpenAI ada-002 size
-        chunks = qdrant_db.query_chunks(
-            query_embedding=dummy_embedding,
-            doc_id=doc_id,
-            top_k=1
-        )
+    document = await asyncio.to_thread(get_document_registry().get, doc_id)
+    if document is None:
+        raise HTTPException(status_code=404, detail=f"Document {doc_id} not found")
         
-        if chunks:
-            return {
-                "doc_id": doc_id,
-                "status": "completed",
-                "chunks_count": "unknown"  # Would need separate endpoint to count
-            }
-        else:
-            return {
-                "doc_id": doc_id,
-                "status": "processing",
-                "chunks_count": 0
-            }
-            
-    except Exception as e:
-        logger.error(f"Error checking document status {doc_id}: {e}")
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error checking document status: {str(e)}"
-        )
+    return {
+        "doc_id": doc_id,
+        "status": document["status"],
+        "chunks_count": document["chunk_count"],
+        "error": document["error"],
+        "timings": document["timings"]
+    }
 
 @router.get("/documents")
-async def list_documents():
+async def list_documents(limit: int = 100, offset: int = 0):
     """
     Get list of all available documents
     
@@ -350,36 +348,29 @@ async def list_documents():
         List of documents with their IDs and metadata
     """
     try:
-        # Query Qdrant to get unique document IDs
-        # We'll get a sample of points and extract unique doc_ids
-        from qdrant_client.http import models
-        
-        result = qdrant_db.client.scroll(
-            collection_name=qdrant_db.collection_name,
-            limit=1000,  # Get up to 1000 points to find unique docs
-            with_payload=True,
-            with_vectors=False
-        )
-        
-        # Extract unique documents
-        documents = {}
-        for point in result[0]:  # result is (points, next_page_offset)
-            doc_id = point.payload.get("doc_id")
-            if doc_id and doc_id not in documents:
-                # Get filename from payload (added by background task) or metadata or use doc_id
-                filename = point.payload.get("filename") or point.payload.get("metadata", {}).get("source_file") or doc_id
-                metadata = point.payload.get("metadata", {})
-                
-                documents[doc_id] = {
-                    "doc_id": doc_id,
-                    "filename": filename,
-                    "metadata": metadata
-                }
+        registry = get_document_registry()
+        documents = [
+            {
+                "doc_id": document["doc_id"],
+                "filename": document["filename"],
+                "file_type": document["file_type"],
+                "size_bytes": document["size_bytes"],
+                "content_hash": document["content_hash"],
+                "chunk_count": document["chunk_count"],
+                "status": document["status"],
+                "error": document["error"],
+                "timings": document["timings"],
+                "metadata": document["metadata"],
+                "created_at": document["created_at"],
+                "updated_at": document["updated_at"]
+            }
+            for document in await asyncio.to_thread(registry.list_documents, limit=limit, offset=offset)
+        ]
         
         return {
             "success": True,
-            "documents": list(documents.values()),
-            "total": len(documents)
+            "documents": documents,
+            "total": await asyncio.to_thread(registry.count)
         }
         
     except Exception as e:
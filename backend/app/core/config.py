@@ -23,6 +23,27 @@ class Settings(BaseSettings):
     qdrant_host: str = os.getenv("QDRANT_HOST", "localhost")
     qdrant_port: int = int(os.getenv("QDRANT_PORT", "6333"))
     qdrant_collection: str = os.getenv("QDRANT_COLLECTION", "studybuddy_docs")
+    vector_store_backend: str = os.getenv("VECTOR_STORE", "qdrant")  # qdrant or local (in-process)
+    local_vector_store_path: str = os.getenv("LOCAL_VECTOR_STORE_PATH", "storage/vector_store")
+    qdrant_prefer_grpc: bool = os.getenv("QDRANT_PREFER_GRPC", "false").lower() == "true"
+    qdrant_grpc_port: int = int(os.getenv("QDRANT_GRPC_PORT", "6334"))
+    
+    # Qdrant index and storage tuning (applied when the collection is created)
+    qdrant_hnsw_m: int = int(os.getenv("QDRANT_HNSW_M", "16"))
+    qdrant_hnsw_ef_construct: int = int(os.getenv("QDRANT_HNSW_EF_CONSTRUCT", "100"))
+    qdrant_on_disk_vectors: bool = os.getenv("QDRANT_ON_DISK_VECTORS", "false").lower() == "true"
+    qdrant_on_disk_payload: bool = os.getenv("QDRANT_ON_DISK_PAYLOAD", "false").lower() == "true"
+    qdrant_on_disk_hnsw: bool = os.getenv("QDRANT_ON_DISK_HNSW", "false").lower() == "true"
+    qdrant_quantization: str = os.getenv("QDRANT_QUANTIZATION", "none")  # none, scalar or binary
+    qdrant_quantization_always_ram: bool = os.getenv("QDRANT_QUANTIZATION_ALWAYS_RAM", "true").lower() == "true"
+    
+    # Qdrant search-time tuning
+    qdrant_search_hnsw_ef: int = int(os.getenv("QDRANT_SEARCH_HNSW_EF", "0"))  # 0 = server default
+    qdrant_search_rescore: bool = os.getenv("QDRANT_SEARCH_RESCORE", "true").lower() == "true"
+    qdrant_search_oversampling: float = float(os.getenv("QDRANT_SEARCH_OVERSAMPLING", "2.0"))
+    qdrant_upsert_batch_size: int = int(os.getenv("QDRANT_UPSERT_BATCH_SIZE", "256"))
+    qdrant_upsert_parallel: int = int(os.getenv("QDRANT_UPSERT_PARALLEL", "4"))
+    qdrant_upsert_wait: bool = os.getenv("QDRANT_UPSERT_WAIT", "true").lower() == "true"
     
     # App settings
     app_name: str = "StudyBuddy AI"
@@ -32,11 +53,71 @@ class Settings(BaseSettings):
     # Upload settings
     max_file_size: int = 50 * 1024 * 1024  # 50MB
     upload_dir: str = "storage/uploads"
+    upload_block_size: int = int(os.getenv("UPLOAD_BLOCK_SIZE", str(1024 * 1024)))  # bytes written per block
+    ingest_batch_size: int = 512  # chunks embedded and upserted per batch
+    pdf_extractor: str = os.getenv("PDF_EXTRACTOR", "pymupdf")  # pymupdf (pdfplumber fallback per page) or pdfplumber
+    pdf_extract_workers: int = int(os.getenv("PDF_EXTRACT_WORKERS", "0"))  # extraction processes (0 = one per CPU)
+    pdf_pages_per_task: int = int(os.getenv("PDF_PAGES_PER_TASK", "16"))  # pages extracted per pool task
+    pdf_chunking: str = os.getenv("PDF_CHUNKING", "auto")  # page, packed (across pages) or auto (packed for slide decks)
+    pdf_strip_boilerplate: bool = os.getenv("PDF_STRIP_BOILERPLATE", "true").lower() == "true"
+    pdf_boilerplate_edge_lines: int = int(os.getenv("PDF_BOILERPLATE_EDGE_LINES", "3"))  # lines checked at top/bottom
+    pdf_boilerplate_min_fraction: float = float(os.getenv("PDF_BOILERPLATE_MIN_FRACTION", "0.5"))  # of pages
+    
+    # Near-duplicate chunk suppression (MinHash/LSH)
+    dedupe_scope: str = os.getenv("DEDUPE_SCOPE", "document")  # off, document or corpus
+    dedupe_threshold: float = float(os.getenv("DEDUPE_THRESHOLD", "0.85"))  # estimated Jaccard similarity
+    dedupe_num_perm: int = int(os.getenv("DEDUPE_NUM_PERM", "128"))
+    dedupe_bands: int = int(os.getenv("DEDUPE_BANDS", "16"))
+    dedupe_index_path: str = os.getenv("DEDUPE_INDEX_PATH", "storage/dedupe.sqlite3")
+    
+    # Ingestion job queue
+    job_queue_path: str = os.getenv("JOB_QUEUE_PATH", "storage/jobs.sqlite3")
+    ingest_workers: int = int(os.getenv("INGEST_WORKERS", "2"))  # concurrent ingestion jobs per app process
+    ingest_max_attempts: int = int(os.getenv("INGEST_MAX_ATTEMPTS", "3"))
+    ingest_retry_backoff_seconds: float = float(os.getenv("INGEST_RETRY_BACKOFF_SECONDS", "5"))  # doubles per attempt
+    ingest_retry_backoff_max_seconds: float = float(os.getenv("INGEST_RETRY_BACKOFF_MAX_SECONDS", "300"))
+    ingest_job_lease_seconds: float = float(os.getenv("INGEST_JOB_LEASE_SECONDS", "120"))  # requeued after a crash
+    ingest_poll_interval: float = float(os.getenv("INGEST_POLL_INTERVAL", "1"))  # seconds between queue checks
     
     # Chat settings
     max_context_chunks: int = 5
     chunk_overlap: int = 100
     chunk_size: int = 1000
+    chunking_mode: str = "chars"  # chars (chunk_size/chunk_overlap) or tokens
+    chunk_size_tokens: int = 300
+    chunk_overlap_tokens: int = 30
+    max_context_tokens: int = 3000  # prompt budget for retrieved context
+    multi_query_count: int = 0  # extra sub-queries per question (0 = single query; each adds an LLM call)
+    multi_query_model: str = "gpt-4o-mini"
+    rrf_k: int = 60  # reciprocal rank fusion constant
+    
+    # Embeddings
+    embedding_backend: str = os.getenv("EMBEDDING_BACKEND", "openai")  # openai or hashing (local CPU)
+    embedding_model: str = os.getenv("EMBEDDING_MODEL", "text-embedding-ada-002")
+    embedding_dimension: int = int(os.getenv("EMBEDDING_DIMENSION", "0"))  # 0 = backend default
+    embedding_max_concurrency: int = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "4"))  # batches in flight
+    embedding_max_batch_tokens: int = int(os.getenv("EMBEDDING_MAX_BATCH_TOKENS", "250000"))  # per request
+    embedding_max_batch_size: int = int(os.getenv("EMBEDDING_MAX_BATCH_SIZE", "2048"))  # inputs per request
+    embedding_max_input_tokens: int = int(os.getenv("EMBEDDING_MAX_INPUT_TOKENS", "8191"))  # model context
+    tokenizer_encoding: str = os.getenv("TOKENIZER_ENCODING", "cl100k_base")
+    tokenizer_cache_size: int = int(os.getenv("TOKENIZER_CACHE_SIZE", "8192"))  # memoized token counts
+    embedding_coalesce_enabled: bool = os.getenv("EMBEDDING_COALESCE_ENABLED", "true").lower() == "true"
+    embedding_coalesce_window_ms: float = float(os.getenv("EMBEDDING_COALESCE_WINDOW_MS", "5"))
+    embedding_coalesce_max_batch: int = int(os.getenv("EMBEDDING_COALESCE_MAX_BATCH", "64"))
+    
+    # Embedding cache
+    embedding_cache_enabled: bool = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+    embedding_cache_path: str = os.getenv("EMBEDDING_CACHE_PATH", "storage/embedding_cache.sqlite3")
+    embedding_cache_max_mb: int = int(os.getenv("EMBEDDING_CACHE_MAX_MB", "512"))
+    embedding_cache_dtype: str = os.getenv("EMBEDDING_CACHE_DTYPE", "float32")  # float32 or int8
+    embedding_cache_flush_seconds: float = float(os.getenv("EMBEDDING_CACHE_FLUSH_SECONDS", "30"))  # LRU/counter writes
+    
+    # Document registry
+    document_registry_path: str = os.getenv("DOCUMENT_REGISTRY_PATH", "storage/documents.sqlite3")
+    
+    # Admin / snapshots
+    admin_token: str = os.getenv("ADMIN_TOKEN", "")  # admin endpoints are disabled when empty
+    snapshot_dir: str = os.getenv("SNAPSHOT_DIR", "storage/snapshots")
     
     class Config:
         env_file = ".env"
@@ -1,23 +1,171 @@
 """
 Database layer - Qdrant vector store integration
 """
-from qdrant_client import QdrantClient
+from qdrant_client import QdrantClient, AsyncQdrantClient
 from qdrant_client.models import Distance, VectorParams, PointStruct
 from qdrant_client.http import models
 from typing import List, Dict, Any, Optional
-import uuid
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait as wait_futures
+import asyncio
 import os
 import logging
+import numpy as np
+from .embedding_backends import get_embedding_dimension
+from .vector_store import VectorStore, LocalVectorStore, SCORE_THRESHOLD, chunk_payload, payload_to_chunk
+from .config import settings
 
 logger = logging.getLogger(__name__)
 
-class QdrantDB:
-    def __init__(self, host: str = "localhost", port: int = 6333, collection_name: str = "studybuddy_docs"):
-        self.client = QdrantClient(host=host, port=port)
+class QdrantBase:
+    """Collection settings and payload handling shared by the sync and async stores"""
+    
+    # Payload fields used in filters; indexed so filtering doesn't scan the collection
+    PAYLOAD_INDEXES = {
+        "doc_id": models.PayloadSchemaType.KEYWORD,
+        "type": models.PayloadSchemaType.KEYWORD,
+        "filename": models.PayloadSchemaType.KEYWORD,
+        "metadata.page_number": models.PayloadSchemaType.INTEGER,
+        "metadata.page_start": models.PayloadSchemaType.INTEGER,
+        "metadata.page_end": models.PayloadSchemaType.INTEGER,
+        "metadata.sheet_name": models.PayloadSchemaType.KEYWORD
+    }
+    
+    def __init__(self, collection_name: str = "studybuddy_docs", vector_size: Optional[int] = None):
         self.collection_name = collection_name
-        self.vector_size = 1536  # OpenAI ada-002 embedding size
+        # Collection dimension follows the active embedding backend
+        self.vector_size = vector_size or get_embedding_dimension()
         self._collection_initialized = False
     
+    def _vectors_config(self) -> VectorParams:
+        """Vector size, distance and storage for new collections"""
+        return VectorParams(
+            size=self.vector_size,
+            distance=Distance.COSINE,
+            on_disk=settings.qdrant_on_disk_vectors
+        )
+    
+    def _hnsw_config(self) -> models.HnswConfigDiff:
+        """HNSW graph parameters for new collections"""
+        return models.HnswConfigDiff(
+            m=settings.qdrant_hnsw_m,
+            ef_construct=settings.qdrant_hnsw_ef_construct,
+            on_disk=settings.qdrant_on_disk_hnsw
+        )
+    
+    def _quantization_config(self):
+        """Scalar (int8) or binary quantization for new collections, or None"""
+        mode = settings.qdrant_quantization.lower()
+        if mode == "scalar":
+            return models.ScalarQuantization(
+                scalar=models.ScalarQuantizationConfig(
+                    type=models.ScalarType.INT8,
+                    quantile=0.99,
+                    always_ram=settings.qdrant_quantization_always_ram
+                )
+            )
+        if mode == "binary":
+            return models.BinaryQuantization(
+                binary=models.BinaryQuantizationConfig(
+                    always_ram=settings.qdrant_quantization_always_ram
+                )
+            )
+        if mode != "none":
+            logger.warning(f"Unknown QDRANT_QUANTIZATION '{settings.qdrant_quantization}', using none")
+        return None
+    
+    def _search_params(self) -> models.SearchParams:
+        """Search-time HNSW ef and quantized search with oversampling and rescoring"""
+        quantization = None
+        if settings.qdrant_quantization.lower() in ("scalar", "binary"):
+            quantization = models.QuantizationSearchParams(
+                ignore=False,
+                rescore=settings.qdrant_search_rescore,
+                oversampling=settings.qdrant_search_oversampling
+            )
+        return models.SearchParams(
+            hnsw_ef=settings.qdrant_search_hnsw_ef or None,
+            quantization=quantization
+        )
+    
+    def _log_created(self):
+        logger.info(
+            f"Created collection: {self.collection_name} "
+            f"(quantization: {settings.qdrant_quantization}, on-disk vectors: {settings.qdrant_on_disk_vectors})"
+        )
+    
+    def _check_vector_size(self, collection_info):
+        """Warn when an existing collection doesn't match the embedding backend"""
+        existing_size = collection_info.config.params.vectors.size
+        if existing_size != self.vector_size:
+            logger.error(
+                f"Collection {self.collection_name} has vector size {existing_size} but the "
+                f"embedding backend produces {self.vector_size}; use another QDRANT_COLLECTION"
+            )
+    
+    def _missing_payload_indexes(self, collection_info=None) -> Dict[str, models.PayloadSchemaType]:
+        """Payload indexes not yet present (all of them for a new collection)"""
+        existing = (collection_info.payload_schema or {}) if collection_info is not None else {}
+        return {
+            field: schema for field, schema in self.PAYLOAD_INDEXES.items()
+            if field not in existing
+        }
+    
+    @staticmethod
+    def _doc_filter(doc_id: Optional[str]) -> Optional[models.Filter]:
+        """Filter matching all points of a document (None for no filter)"""
+        if not doc_id:
+            return None
+        return models.Filter(
+            must=[
+                models.FieldCondition(
+                    key="doc_id",
+                    match=models.MatchValue(value=doc_id)
+                )
+            ]
+        )
+    
+    @staticmethod
+    def _build_points(chunks: List[Dict[str, Any]], embeddings: np.ndarray, doc_id: str,
+                      offset: int = 0) -> List[PointStruct]:
+        """Build Qdrant points from chunks and their embedding rows"""
+        points = []
+        # One tolist() per batch; the HTTP API needs plain floats
+        vectors = np.asarray(embeddings, dtype=np.float32).tolist()
+        for i, (chunk, vector) in enumerate(zip(chunks, vectors), start=offset):
+            chunk_point_id, payload = chunk_payload(chunk, doc_id, i)
+            points.append(PointStruct(id=chunk_point_id, vector=vector, payload=payload))
+        return points
+    
+    def _point_batches(self, chunks: List[Dict[str, Any]], embeddings: np.ndarray, doc_id: str):
+        """
+        Lazily build points in batches of settings.qdrant_upsert_batch_size
+        
+        Only the batches currently being sent are held in memory.
+        """
+        if len(chunks) != len(embeddings):
+            raise ValueError(f"Got {len(embeddings)} embeddings for {len(chunks)} chunks")
+        batch_size = max(1, settings.qdrant_upsert_batch_size)
+        for start in range(0, len(chunks), batch_size):
+            yield self._build_points(
+                chunks[start:start + batch_size], embeddings[start:start + batch_size], doc_id, offset=start
+            )
+    
+    @staticmethod
+    def _to_chunk(result) -> Dict[str, Any]:
+        """Convert a scored point into the chunk dict used by the agents"""
+        return payload_to_chunk(result.id, result.score, result.payload)
+
+class QdrantDB(QdrantBase):
+    def __init__(self, host: str = "localhost", port: int = 6333, collection_name: str = "studybuddy_docs",
+                 vector_size: Optional[int] = None, prefer_grpc: bool = False, grpc_port: int = 6334,
+                 location: Optional[str] = None):
+        super().__init__(collection_name=collection_name, vector_size=vector_size)
+        if location:
+            # e.g. ":memory:" for an in-process store
+            self.client = QdrantClient(location=location)
+        else:
+            self.client = QdrantClient(host=host, port=port, grpc_port=grpc_port, prefer_grpc=prefer_grpc)
+    
     def _ensure_collection(self):
         """Create collection if it doesn't exist"""
         try:
@@ -27,34 +175,49 @@ class QdrantDB:
             if self.collection_name not in collection_names:
                 self.client.create_collection(
                     collection_name=self.collection_name,
-                    vectors_config=VectorParams(
-                        size=self.vector_size,
-                        distance=Distance.COSINE
-                    )
+                    vectors_config=self._vectors_config(),
+                    hnsw_config=self._hnsw_config(),
+                    quantization_config=self._quantization_config(),
+                    on_disk_payload=settings.qdrant_on_disk_payload
                 )
-                logger.info(f"Created collection: {self.collection_name}")
+                self._log_created()
+                collection_info = None
             else:
                 logger.info(f"Collection {self.collection_name} already exists")
+                collection_info = self.client.get_collection(self.collection_name)
+                self._check_vector_size(collection_info)
             
+            self._ensure_payload_indexes(collection_info)
             self._collection_initialized = True
         except Exception as e:
             logger.error(f"Error ensuring collection: {e}")
             self._collection_initialized = False
             # Don't raise here to allow the app to start
     
+    def _ensure_payload_indexes(self, collection_info=None):
+        """Create missing payload indexes (also migrates collections created without them)"""
+        for field, schema in self._missing_payload_indexes(collection_info).items():
+            self.client.create_payload_index(
+                collection_name=self.collection_name,
+                field_name=field,
+                field_schema=schema,
+                wait=True
+            )
+            logger.info(f"Created payload index {field} ({schema.value}) on {self.collection_name}")
+    
     def _check_and_init_collection(self):
         """Check if collection is initialized and try to initialize if not"""
         if not self._collection_initialized:
             self._ensure_collection()
         return self._collection_initialized
     
-    def add_chunks(self, chunks: List[Dict[str, Any]], embeddings: List[List[float]], doc_id: str):
+    def add_chunks(self, chunks: List[Dict[str, Any]], embeddings: np.ndarray, doc_id: str):
         """
         Add document chunks with embeddings to Qdrant
         
         Args:
             chunks: List of chunk dictionaries with metadata
-            embeddings: List of embedding vectors
+            embeddings: float32 matrix with one row per chunk
             doc_id: Document identifier
         """
         if not self._check_and_init_collection():
@@ -62,37 +225,52 @@ class QdrantDB:
             return False
             
         try:
-            points = []
-            for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
-                point_id = str(uuid.uuid4())
-                payload = {
-                    "doc_id": doc_id,
-                    "chunk_id": chunk.get("chunk_id", f"{doc_id}_chunk_{i}"),
-                    "text": chunk.get("text", ""),
-                    "page": chunk.get("page", None),
-                    "metadata": chunk.get("metadata", {}),
-                    "type": chunk.get("type", "text")
-                }
-                
-                points.append(PointStruct(
-                    id=point_id,
-                    vector=embedding,
-                    payload=payload
-                ))
-            
-            self.client.upsert(
-                collection_name=self.collection_name,
-                points=points
-            )
+            total = self._upsert_batches(self._point_batches(chunks, embeddings, doc_id))
             
-            logger.info(f"Added {len(points)} chunks for document {doc_id}")
+            logger.info(f"Added {total} chunks for document {doc_id}")
             return True
             
         except Exception as e:
             logger.error(f"Error adding chunks: {e}")
             raise
     
-    def query_chunks(self, query_embedding: List[float], doc_id: Optional[str] = None, 
+    def _upsert_batches(self, batches) -> int:
+        """
+        Upsert point batches with up to settings.qdrant_upsert_parallel requests in flight
+        
+        With QDRANT_UPSERT_WAIT=false batches are only queued by Qdrant; the last
+        batch is then sent with wait=True once all others are acknowledged, which
+        acts as a consistency barrier (updates are applied in order).
+        """
+        parallel = max(1, settings.qdrant_upsert_parallel)
+        wait = settings.qdrant_upsert_wait
+        total = 0
+        pending = set()
+        last = None
+        with ThreadPoolExecutor(max_workers=parallel) as executor:
+            for points in batches:
+                if last is not None:
+                    if len(pending) >= parallel:
+                        done, pending = wait_futures(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            future.result()
+                    pending.add(executor.submit(self._upsert, last, wait))
+                last = points
+                total += len(points)
+            for future in wait_futures(pending).done:
+                future.result()
+        if last is not None:
+            self._upsert(last, True)
+        return total
+    
+    def _upsert(self, points: List[PointStruct], wait: bool):
+        self.client.upsert(
+            collection_name=self.collection_name,
+            points=points,
+            wait=wait
+        )
+    
+    def query_chunks(self, query_embedding: np.ndarray, doc_id: Optional[str] = None,
                     top_k: int = 5) -> List[Dict[str, Any]]:
         """
         Query similar chunks from Qdrant
@@ -110,38 +288,17 @@ class QdrantDB:
             return []
             
         try:
-            query_filter = None
-            if doc_id:
-                query_filter = models.Filter(
-                    must=[
-                        models.FieldCondition(
-                            key="doc_id",
-                            match=models.MatchValue(value=doc_id)
-                        )
-                    ]
-                )
-            
-            results = self.client.search(
+            response = self.client.query_points(
                 collection_name=self.collection_name,
-                query_vector=query_embedding,
-                query_filter=query_filter,
+                query=np.asarray(query_embedding, dtype=np.float32).tolist(),
+                query_filter=self._doc_filter(doc_id),
+                search_params=self._search_params(),
                 limit=top_k,
                 with_payload=True,
-                score_threshold=0.1  # Lower similarity threshold for better retrieval
+                score_threshold=SCORE_THRESHOLD  # Lower similarity threshold for better retrieval
             )
             
-            chunks = []
-            for result in results:
-                chunk = {
-                    "id": result.id,
-                    "score": result.score,
-                    "text": result.payload.get("text", ""),
-                    "page": result.payload.get("page"),
-                    "chunk_id": result.payload.get("chunk_id"),
-                    "metadata": result.payload.get("metadata", {}),
-                    "type": result.payload.get("type", "text")
-                }
-                chunks.append(chunk)
+            chunks = [self._to_chunk(result) for result in response.points]
             
             logger.info(f"Retrieved {len(chunks)} chunks for query (doc_id: {doc_id})")
             return chunks
@@ -159,16 +316,246 @@ class QdrantDB:
         try:
             self.client.delete(
                 collection_name=self.collection_name,
-                points_selector=models.FilterSelector(
-                    filter=models.Filter(
-                        must=[
-                            models.FieldCondition(
-                                key="doc_id",
-                                match=models.MatchValue(value=doc_id)
-                            )
-                        ]
-                    )
+                points_selector=models.FilterSelector(filter=self._doc_filter(doc_id))
+            )
+            logger.info(f"Deleted document {doc_id}")
+            return True
+        except Exception as e:
+            logger.error(f"Error deleting document {doc_id}: {e}")
+            raise
+
+    def get_chunk_hashes(self, doc_id: str) -> Dict[str, str]:
+        """
+        Content hashes of a document's stored chunks
+        
+        Returns:
+            Mapping of point ID to content hash (empty for a new document)
+        """
+        if not self._check_and_init_collection():
+            return {}
+        
+        hashes = {}
+        offset = None
+        while True:
+            points, offset = self.client.scroll(
+                collection_name=self.collection_name,
+                scroll_filter=self._doc_filter(doc_id),
+                limit=1000,
+                offset=offset,
+                with_payload=["content_hash"],
+                with_vectors=False
+            )
+            for point in points:
+                hashes[str(point.id)] = point.payload.get("content_hash")
+            if offset is None:
+                return hashes
+    
+    def delete_points(self, point_ids: List[str]):
+        """Delete points by ID"""
+        if not point_ids:
+            return
+        self.client.delete(
+            collection_name=self.collection_name,
+            points_selector=models.PointIdsList(points=list(point_ids))
+        )
+
+class AsyncQdrantDB(QdrantBase, VectorStore):
+    """
+    Non-blocking Qdrant store for use inside async request handlers
+    
+    Wraps a single AsyncQdrantClient whose HTTP connection pool (or gRPC
+    channel, with prefer_grpc) is reused by every request.
+    """
+    
+    def __init__(self, host: str = "localhost", port: int = 6333, collection_name: str = "studybuddy_docs",
+                 vector_size: Optional[int] = None, prefer_grpc: bool = False, grpc_port: int = 6334,
+                 location: Optional[str] = None):
+        super().__init__(collection_name=collection_name, vector_size=vector_size)
+        if location:
+            # e.g. ":memory:" for an in-process store
+            self.client = AsyncQdrantClient(location=location)
+        else:
+            self.client = AsyncQdrantClient(host=host, port=port, grpc_port=grpc_port, prefer_grpc=prefer_grpc)
+        self._init_lock = None
+    
+    async def _ensure_collection(self):
+        """Create collection if it doesn't exist"""
+        try:
+            collections = await self.client.get_collections()
+            collection_names = [col.name for col in collections.collections]
+            
+            if self.collection_name not in collection_names:
+                await self.client.create_collection(
+                    collection_name=self.collection_name,
+                    vectors_config=self._vectors_config(),
+                    hnsw_config=self._hnsw_config(),
+                    quantization_config=self._quantization_config(),
+                    on_disk_payload=settings.qdrant_on_disk_payload
                 )
+                self._log_created()
+                collection_info = None
+            else:
+                logger.info(f"Collection {self.collection_name} already exists")
+                collection_info = await self.client.get_collection(self.collection_name)
+                self._check_vector_size(collection_info)
+            
+            await self._ensure_payload_indexes(collection_info)
+            self._collection_initialized = True
+        except Exception as e:
+            logger.error(f"Error ensuring collection: {e}")
+            self._collection_initialized = False
+    
+    async def _ensure_payload_indexes(self, collection_info=None):
+        """Async version of QdrantDB._ensure_payload_indexes"""
+        for field, schema in self._missing_payload_indexes(collection_info).items():
+            await self.client.create_payload_index(
+                collection_name=self.collection_name,
+                field_name=field,
+                field_schema=schema,
+                wait=True
+            )
+            logger.info(f"Created payload index {field} ({schema.value}) on {self.collection_name}")
+    
+    async def _check_and_init_collection(self):
+        """Check if collection is initialized and try to initialize if not"""
+        if not self._collection_initialized:
+            if self._init_lock is None:
+                self._init_lock = asyncio.Lock()
+            async with self._init_lock:
+                if not self._collection_initialized:
+                    await self._ensure_collection()
+        return self._collection_initialized
+    
+    async def add_chunks(self, chunks: List[Dict[str, Any]], embeddings: np.ndarray, doc_id: str):
+        """Async version of QdrantDB.add_chunks"""
+        if not await self._check_and_init_collection():
+            logger.error("Cannot add chunks: Collection not available")
+            return False
+        
+        try:
+            total = await self._upsert_batches(self._point_batches(chunks, embeddings, doc_id))
+            
+            logger.info(f"Added {total} chunks for document {doc_id}")
+            return True
+        
+        except Exception as e:
+            logger.error(f"Error adding chunks: {e}")
+            raise
+    
+    async def _upsert_batches(self, batches) -> int:
+        """Async version of QdrantDB._upsert_batches"""
+        parallel = max(1, settings.qdrant_upsert_parallel)
+        wait = settings.qdrant_upsert_wait
+        total = 0
+        pending = set()
+        last = None
+        try:
+            for points in batches:
+                if last is not None:
+                    if len(pending) >= parallel:
+                        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                        for task in done:
+                            task.result()
+                    pending.add(asyncio.ensure_future(self._upsert(last, wait)))
+                last = points
+                total += len(points)
+            if pending:
+                await asyncio.gather(*pending)
+        except BaseException:
+            for task in pending:
+                task.cancel()
+            raise
+        if last is not None:
+            await self._upsert(last, True)
+        return total
+    
+    async def _upsert(self, points: List[PointStruct], wait: bool):
+        await self.client.upsert(
+            collection_name=self.collection_name,
+            points=points,
+            wait=wait
+        )
+    
+    async def query_chunks(self, query_embedding: np.ndarray, doc_id: Optional[str] = None,
+                           top_k: int = 5) -> List[Dict[str, Any]]:
+        """Async version of QdrantDB.query_chunks"""
+        if not await self._check_and_init_collection():
+            logger.error("Cannot query chunks: Collection not available")
+            return []
+        
+        try:
+            response = await self.client.query_points(
+                collection_name=self.collection_name,
+                query=np.asarray(query_embedding, dtype=np.float32).tolist(),
+                query_filter=self._doc_filter(doc_id),
+                search_params=self._search_params(),
+                limit=top_k,
+                with_payload=True,
+                score_threshold=SCORE_THRESHOLD  # Lower similarity threshold for better retrieval
+            )
+            
+            chunks = [self._to_chunk(result) for result in response.points]
+            
+            logger.info(f"Retrieved {len(chunks)} chunks for query (doc_id: {doc_id})")
+            return chunks
+        
+        except Exception as e:
+            logger.error(f"Error querying chunks: {e}")
+            raise
+    
+    async def query_chunks_batch(self, query_embeddings: np.ndarray, doc_id: Optional[str] = None,
+                                 top_k: int = 5) -> List[List[Dict[str, Any]]]:
+        """
+        Query similar chunks for several query vectors with one query_batch_points call
+        
+        Args:
+            query_embeddings: float32 matrix with one query vector per row
+            doc_id: Optional document filter (applied to every query)
+            top_k: Number of results per query
+        
+        Returns:
+            One list of matching chunks per query row
+        """
+        if not await self._check_and_init_collection():
+            logger.error("Cannot query chunks: Collection not available")
+            return [[] for _ in range(len(query_embeddings))]
+        
+        try:
+            query_filter = self._doc_filter(doc_id)
+            search_params = self._search_params()
+            requests = [
+                models.QueryRequest(
+                    query=vector,
+                    filter=query_filter,
+                    params=search_params,
+                    limit=top_k,
+                    with_payload=True,
+                    score_threshold=SCORE_THRESHOLD
+                )
+                for vector in np.asarray(query_embeddings, dtype=np.float32).tolist()
+            ]
+            responses = await self.client.query_batch_points(
+                collection_name=self.collection_name,
+                requests=requests
+            )
+            
+            logger.info(f"Retrieved chunks for {len(requests)} queries in one batch (doc_id: {doc_id})")
+            return [[self._to_chunk(result) for result in response.points] for response in responses]
+        
+        except Exception as e:
+            logger.error(f"Error querying chunks: {e}")
+            raise
+    
+    async def delete_document(self, doc_id: str):
+        """Async version of QdrantDB.delete_document"""
+        if not await self._check_and_init_collection():
+            logger.error("Cannot delete document: Collection not available")
+            return False
+        
+        try:
+            await self.client.delete(
+                collection_name=self.collection_name,
+                points_selector=models.FilterSelector(filter=self._doc_filter(doc_id))
             )
             logger.info(f"Deleted document {doc_id}")
             return True
@@ -176,5 +563,130 @@ class QdrantDB:
             logger.error(f"Error deleting document {doc_id}: {e}")
             raise
 
-# Global instance
-qdrant_db = QdrantDB(host="qdrant", port=6333, collection_name="studybuddy_docs")
+    async def get_chunk_hashes(self, doc_id: str) -> Dict[str, str]:
+        """Async version of QdrantDB.get_chunk_hashes"""
+        if not await self._check_and_init_collection():
+            return {}
+        
+        hashes = {}
+        offset = None
+        while True:
+            points, offset = await self.client.scroll(
+                collection_name=self.collection_name,
+                scroll_filter=self._doc_filter(doc_id),
+                limit=1000,
+                offset=offset,
+                with_payload=["content_hash"],
+                with_vectors=False
+            )
+            for point in points:
+                hashes[str(point.id)] = point.payload.get("content_hash")
+            if offset is None:
+                return hashes
+    
+    async def delete_points(self, point_ids: List[str]):
+        """Async version of QdrantDB.delete_points"""
+        if not point_ids:
+            return
+        await self.client.delete(
+            collection_name=self.collection_name,
+            points_selector=models.PointIdsList(points=list(point_ids))
+        )
+
+    async def get_vectors(self, point_ids: List[str]) -> Dict[str, np.ndarray]:
+        """Stored vectors by point ID (missing points are left out)"""
+        if not point_ids:
+            return {}
+        points = await self.client.retrieve(
+            collection_name=self.collection_name,
+            ids=list(point_ids),
+            with_payload=False,
+            with_vectors=True
+        )
+        return {str(point.id): np.asarray(point.vector, dtype=np.float32) for point in points}
+    
+    async def ping(self):
+        """Raise if the Qdrant server is unreachable"""
+        await self.client.get_collections()
+
+    async def count_points(self) -> int:
+        """Exact number of points in the collection"""
+        if not await self._check_and_init_collection():
+            return 0
+        result = await self.client.count(collection_name=self.collection_name, exact=True)
+        return result.count
+    
+    async def scroll_points(self, batch_size: int = 1000):
+        """Iterate over all points as (point IDs, float32 vectors, payloads) batches"""
+        if not await self._check_and_init_collection():
+            return
+        
+        offset = None
+        while True:
+            points, offset = await self.client.scroll(
+                collection_name=self.collection_name,
+                limit=batch_size,
+                offset=offset,
+                with_payload=True,
+                with_vectors=True
+            )
+            if points:
+                yield (
+                    [str(point.id) for point in points],
+                    np.asarray([point.vector for point in points], dtype=np.float32),
+                    [point.payload for point in points]
+                )
+            if offset is None:
+                return
+    
+    async def import_points(self, point_ids: List[str], vectors: np.ndarray, payloads: List[Dict[str, Any]]):
+        """Bulk upsert exported points in parallel upsert batches"""
+        if not await self._check_and_init_collection():
+            raise RuntimeError("Collection not available")
+        
+        batch_size = max(1, settings.qdrant_upsert_batch_size)
+        batches = (
+            [
+                PointStruct(id=pid, vector=vector, payload=payload)
+                for pid, vector, payload in zip(
+                    point_ids[start:start + batch_size],
+                    np.asarray(vectors[start:start + batch_size], dtype=np.float32).tolist(),
+                    payloads[start:start + batch_size]
+                )
+            ]
+            for start in range(0, len(point_ids), batch_size)
+        )
+        await self._upsert_batches(batches)
+
+# Global instance - lazy loaded, so importing this module never contacts Qdrant
+qdrant_db = None
+
+def get_qdrant_db() -> QdrantDB:
+    """Get the global sync Qdrant client"""
+    global qdrant_db
+    if qdrant_db is None:
+        qdrant_db = QdrantDB(
+            host=settings.qdrant_host,
+            port=settings.qdrant_port,
+            collection_name=settings.qdrant_collection
+        )
+    return qdrant_db
+
+def create_vector_store() -> VectorStore:
+    """Build the store selected by settings.vector_store_backend"""
+    name = settings.vector_store_backend.lower()
+    if name == "qdrant":
+        # One pooled async client shared by all request handlers
+        return AsyncQdrantDB(
+            host=settings.qdrant_host,
+            port=settings.qdrant_port,
+            collection_name=settings.qdrant_collection,
+            prefer_grpc=settings.qdrant_prefer_grpc,
+            grpc_port=settings.qdrant_grpc_port
+        )
+    if name == "local":
+        return LocalVectorStore(settings.local_vector_store_path)
+    raise ValueError(f"Unknown vector store backend: {settings.vector_store_backend}")
+
+# Store used by the API
+vector_store = create_vector_store()
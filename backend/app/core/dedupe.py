@@ -0,0 +1,322 @@
+"""
+Near-duplicate chunk detection for StudyBuddy
+
+Chunks are summarized by MinHash signatures over word shingles and indexed
+with locality-sensitive hashing (LSH banding): two chunks land in the same
+bucket of at least one band with high probability when their estimated
+Jaccard similarity is above roughly (1 / bands) ** (1 / rows). Candidates
+are then confirmed against settings.dedupe_threshold.
+
+The index is a SQLite file shared by ingestion workers, so duplicates are
+found within a document and, with DEDUPE_SCOPE=corpus, across documents.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+import hashlib
+import logging
+import re
+import sqlite3
+import zlib
+import numpy as np
+
+from .config import settings
+from .sqlite_util import ThreadLocalConnections
+from .vector_store import point_id
+
+logger = logging.getLogger(__name__)
+
+# SQLite limits the number of bound parameters per statement
+_SQL_BATCH = 500
+
+SCOPE_OFF = "off"
+SCOPE_DOCUMENT = "document"
+SCOPE_CORPUS = "corpus"
+
+_WORD_PATTERN = re.compile(r"\w+")
+
+# Mersenne prime for the universal hash family (a * x + b) mod p
+_PRIME = np.uint64((1 << 31) - 1)
+
+class MinHasher:
+    """MinHash signatures over word shingles, vectorized with numpy"""
+    
+    def __init__(self, num_perm: int = 128, shingle_size: int = 3, seed: int = 1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        # Fixed seed: signatures are persisted and compared across processes
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, int(_PRIME), size=(num_perm, 1)).astype(np.uint64)
+        self._b = rng.randint(0, int(_PRIME), size=(num_perm, 1)).astype(np.uint64)
+    
+    def shingles(self, text: str) -> np.ndarray:
+        """Distinct 32-bit hashes of the normalized word shingles of text"""
+        words = _WORD_PATTERN.findall(text.lower())
+        if not words:
+            return np.array([zlib.crc32(text.encode("utf-8"))], dtype=np.uint64)
+        
+        hashes = np.fromiter((zlib.crc32(word.encode("utf-8")) for word in words),
+                             dtype=np.uint64, count=len(words))
+        size = min(self.shingle_size, len(hashes))
+        combined = np.zeros(len(hashes) - size + 1, dtype=np.uint64)
+        for offset in range(size):
+            # Polynomial combination; uint64 overflow wraps, which is fine for hashing
+            combined = combined * np.uint64(1000003) + hashes[offset:len(hashes) - size + 1 + offset]
+        return np.unique(combined & np.uint64(0xFFFFFFFF))
+    
+    def signature(self, text: str) -> np.ndarray:
+        """num_perm minimum hash values (uint32) of text's shingles"""
+        shingles = self.shingles(text) % _PRIME
+        return ((self._a * shingles + self._b) % _PRIME).min(axis=1).astype(np.uint32)
+
+def similarity(first: np.ndarray, second: np.ndarray) -> float:
+    """Jaccard similarity estimated from two signatures"""
+    return float(np.mean(first == second))
+
+class DedupeIndex:
+    """
+    Persistent LSH index of chunk signatures backed by SQLite
+    
+    WAL mode with per-thread connections, like the document registry.
+    """
+    
+    def __init__(self, path: str, num_perm: int = 128, bands: int = 16, threshold: float = 0.85):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+        self.path = path
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.hasher = MinHasher(num_perm=num_perm)
+        self._connections = ThreadLocalConnections(self.path)
+        self._init_db()
+    
+    def _connect(self) -> sqlite3.Connection:
+        """Get a per-thread connection to the index database"""
+        return self._connections.get()
+    
+    def _init_db(self):
+        """Create index tables if they don't exist"""
+        self._connect().executescript("""
+            CREATE TABLE IF NOT EXISTS signatures (
+                point_id TEXT PRIMARY KEY,
+                doc_id TEXT NOT NULL,
+                signature BLOB NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_signatures_doc_id ON signatures(doc_id);
+            CREATE TABLE IF NOT EXISTS buckets (
+                band INTEGER NOT NULL,
+                bucket INTEGER NOT NULL,
+                point_id TEXT NOT NULL,
+                doc_id TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_buckets_bucket ON buckets(band, bucket);
+            CREATE INDEX IF NOT EXISTS idx_buckets_point_id ON buckets(point_id);
+            CREATE INDEX IF NOT EXISTS idx_buckets_doc_id ON buckets(doc_id);
+        """)
+    
+    def signature(self, text: str) -> np.ndarray:
+        return self.hasher.signature(text)
+    
+    def _band_keys(self, signature: np.ndarray) -> List[int]:
+        """One signed 64-bit bucket key per band"""
+        return [
+            int.from_bytes(
+                hashlib.blake2b(signature[band * self.rows:(band + 1) * self.rows].tobytes(), digest_size=8).digest(),
+                "big",
+                signed=True
+            )
+            for band in range(self.bands)
+        ]
+    
+    def find(self, signature: np.ndarray, doc_id: Optional[str] = None,
+             exclude_doc_id: Optional[str] = None) -> Optional[str]:
+        """
+        Most similar indexed point at or above the threshold
+        
+        Args:
+            signature: Signature of the chunk to look up
+            doc_id: Only match points of this document
+            exclude_doc_id: Don't match points of this document
+        
+        Returns:
+            Point ID of the duplicate, or None
+        """
+        conn = self._connect()
+        query = "SELECT DISTINCT point_id FROM buckets WHERE band = ? AND bucket = ?"
+        params = []
+        if doc_id is not None:
+            query += " AND doc_id = ?"
+            params.append(doc_id)
+        if exclude_doc_id is not None:
+            query += " AND doc_id != ?"
+            params.append(exclude_doc_id)
+        
+        candidates = set()
+        for band, key in enumerate(self._band_keys(signature)):
+            candidates.update(row[0] for row in conn.execute(query, [band, key, *params]))
+        
+        best, best_similarity = None, self.threshold
+        for point_id in candidates:
+            row = conn.execute("SELECT signature FROM signatures WHERE point_id = ?", (point_id,)).fetchone()
+            if row is None:
+                continue
+            score = similarity(signature, np.frombuffer(row[0], dtype=np.uint32))
+            if score >= best_similarity:
+                best, best_similarity = point_id, score
+        return best
+    
+    def add(self, point_id: str, doc_id: str, signature: np.ndarray):
+        """Index a stored point (replacing its previous signature)"""
+        self.add_many(doc_id, [(point_id, signature, self._band_keys(signature))])
+    
+    def add_many(self, doc_id: str, points: List[Tuple[str, np.ndarray, List[int]]], replace: bool = True):
+        """
+        Index a document's points in one transaction
+        
+        Args:
+            doc_id: Document the points belong to
+            points: (point_id, signature, band keys) per point
+            replace: Remove existing buckets of the points first (not needed
+                after delete_document)
+        """
+        if not points:
+            return
+        conn = self._connect()
+        conn.execute("BEGIN")
+        try:
+            if replace:
+                conn.executemany("DELETE FROM buckets WHERE point_id = ?", [(point_id,) for point_id, _, _ in points])
+            conn.executemany(
+                "INSERT OR REPLACE INTO signatures (point_id, doc_id, signature) VALUES (?, ?, ?)",
+                [(point_id, doc_id, signature.astype(np.uint32).tobytes()) for point_id, signature, _ in points]
+            )
+            conn.executemany(
+                "INSERT INTO buckets (band, bucket, point_id, doc_id) VALUES (?, ?, ?, ?)",
+                [
+                    (band, key, point_id, doc_id)
+                    for point_id, _, keys in points
+                    for band, key in enumerate(keys)
+                ]
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    
+    def delete_document(self, doc_id: str):
+        """Forget all points of a document"""
+        conn = self._connect()
+        conn.execute("BEGIN")
+        try:
+            conn.execute("DELETE FROM buckets WHERE doc_id = ?", (doc_id,))
+            conn.execute("DELETE FROM signatures WHERE doc_id = ?", (doc_id,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    
+    def document_deduper(self, doc_id: str) -> "DocumentDeduper":
+        """Within-document duplicate filter for one ingestion of doc_id"""
+        return DocumentDeduper(self, doc_id)
+    
+    def link_duplicates(self, chunks: List[Dict[str, Any]], signatures: Dict[str, np.ndarray],
+                        doc_id: str) -> Dict[str, str]:
+        """Map chunk_id to the point of another document each chunk near-duplicates"""
+        links = {}
+        for chunk in chunks:
+            canonical = self.find(signatures[chunk["chunk_id"]], exclude_doc_id=doc_id)
+            if canonical is not None:
+                links[chunk["chunk_id"]] = canonical
+        return links
+    
+    def count(self) -> int:
+        """Number of indexed points"""
+        return self._connect().execute("SELECT COUNT(*) FROM signatures").fetchone()[0]
+
+class DocumentDeduper:
+    """
+    Drops chunks that near-duplicate an earlier chunk of the same document
+    
+    Memory stays bounded by the batch size: chunks of earlier batches are
+    looked up in the SQLite buckets with one query per band for the whole
+    batch, and only the current batch's buckets are kept in memory. Each
+    batch's kept signatures are written to the index in one transaction.
+    """
+    
+    def __init__(self, index: DedupeIndex, doc_id: str):
+        self.index = index
+        self.doc_id = doc_id
+    
+    def _stored_candidates(self, batch_keys: List[List[int]]) -> Dict[Tuple[int, int], List[np.ndarray]]:
+        """Signatures of the document's indexed points sharing a bucket with the batch, by (band, key)"""
+        conn = self.index._connect()
+        members: Dict[Tuple[int, int], List[str]] = {}
+        for band in range(self.index.bands):
+            keys = list({keys[band] for keys in batch_keys})
+            for i in range(0, len(keys), _SQL_BATCH):
+                batch = keys[i:i + _SQL_BATCH]
+                rows = conn.execute(
+                    f"SELECT bucket, point_id FROM buckets WHERE band = ? AND bucket IN ({','.join('?' * len(batch))}) "
+                    f"AND doc_id = ?",
+                    [band, *batch, self.doc_id]
+                )
+                for key, member in rows:
+                    members.setdefault((band, key), []).append(member)
+        
+        point_ids = list({member for bucket in members.values() for member in bucket})
+        signatures = {}
+        for i in range(0, len(point_ids), _SQL_BATCH):
+            batch = point_ids[i:i + _SQL_BATCH]
+            rows = conn.execute(
+                f"SELECT point_id, signature FROM signatures WHERE point_id IN ({','.join('?' * len(batch))})",
+                batch
+            )
+            signatures.update((member, np.frombuffer(blob, dtype=np.uint32)) for member, blob in rows)
+        return {
+            bucket: [signatures[member] for member in bucket_members if member in signatures]
+            for bucket, bucket_members in members.items()
+        }
+    
+    def filter(self, chunks: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[np.ndarray]]:
+        """
+        Drop duplicates of chunks seen earlier in this ingestion
+        
+        Args:
+            chunks: Next batch of chunks with chunk_id and text, in document order
+        
+        Returns:
+            (kept chunks, their signatures)
+        """
+        batch_signatures = [self.index.signature(chunk["text"]) for chunk in chunks]
+        batch_keys = [self.index._band_keys(signature) for signature in batch_signatures]
+        # Earlier batches from SQLite; kept chunks of this batch are added as they go
+        buckets = self._stored_candidates(batch_keys) if chunks else {}
+        
+        kept, signatures, points = [], [], []
+        for chunk, signature, keys in zip(chunks, batch_signatures, batch_keys):
+            candidates = [other for band, key in enumerate(keys) for other in buckets.get((band, key), ())]
+            if any(similarity(signature, other) >= self.index.threshold for other in candidates):
+                continue
+            for band, key in enumerate(keys):
+                buckets.setdefault((band, key), []).append(signature)
+            points.append((point_id(self.doc_id, chunk["chunk_id"]), signature, keys))
+            kept.append(chunk)
+            signatures.append(signature)
+        
+        self.index.add_many(self.doc_id, points, replace=False)
+        return kept, signatures
+
+dedupe_index: Optional[DedupeIndex] = None
+
+def get_dedupe_index() -> Optional[DedupeIndex]:
+    """Get the global dedupe index (None when DEDUPE_SCOPE=off)"""
+    global dedupe_index
+    if settings.dedupe_scope == SCOPE_OFF:
+        return None
+    if dedupe_index is None:
+        dedupe_index = DedupeIndex(
+            settings.dedupe_index_path,
+            num_perm=settings.dedupe_num_perm,
+            bands=settings.dedupe_bands,
+            threshold=settings.dedupe_threshold
+        )
+    return dedupe_index
@@ -0,0 +1,232 @@
+"""
+Local document registry for StudyBuddy
+
+Keeps one row per uploaded document so listing documents and checking
+processing status are single SQLite lookups instead of vector store scans.
+"""
+import json
+import logging
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional
+
+from .config import settings
+from .sqlite_util import ThreadLocalConnections
+
+logger = logging.getLogger(__name__)
+
+STATUS_PROCESSING = "processing"
+STATUS_COMPLETED = "completed"
+STATUS_FAILED = "failed"
+
+class DocumentRegistry:
+    """
+    Document metadata and ingestion status backed by SQLite.
+    
+    Every update is a single transaction, and WAL mode with per-thread
+    connections makes the registry safe to share between uvicorn workers.
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._connections = ThreadLocalConnections(self.path, row_factory=sqlite3.Row)
+        self._init_db()
+    
+    def _connect(self) -> sqlite3.Connection:
+        """Get a per-thread connection to the registry database"""
+        return self._connections.get()
+    
+    def _init_db(self):
+        """Create registry tables if they don't exist"""
+        conn = self._connect()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS documents (
+                doc_id TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                file_type TEXT NOT NULL,
+                file_path TEXT,
+                size_bytes INTEGER NOT NULL DEFAULT 0,
+                content_hash TEXT,
+                chunk_count INTEGER NOT NULL DEFAULT 0,
+                status TEXT NOT NULL,
+                error TEXT,
+                timings TEXT NOT NULL DEFAULT '{}',
+                metadata TEXT NOT NULL DEFAULT '{}',
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_documents_created_at
+                ON documents(created_at);
+            CREATE INDEX IF NOT EXISTS idx_documents_content_hash
+                ON documents(content_hash);
+            CREATE TABLE IF NOT EXISTS migrations (
+                name TEXT PRIMARY KEY,
+                applied_at REAL NOT NULL
+            );
+        """)
+    
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+        document = dict(row)
+        document["timings"] = json.loads(document["timings"])
+        document["metadata"] = json.loads(document["metadata"])
+        return document
+    
+    def register(self, doc_id: str, filename: str, file_type: str, file_path: Optional[str] = None,
+                 size_bytes: int = 0, content_hash: Optional[str] = None, chunk_count: int = 0,
+                 metadata: Optional[Dict[str, Any]] = None):
+        """
+        Add a document (or reset an existing one for re-ingestion) as processing
+        
+        Args:
+            doc_id: Document identifier
+            filename: Original upload filename
+            file_type: text, pdf or excel
+            file_path: Where the upload is stored
+            size_bytes: Upload size
+            content_hash: sha256 of the upload
+            chunk_count: Number of chunks extracted
+            metadata: Extra fields returned with the document (e.g. page count)
+        """
+        now = time.time()
+        self._connect().execute(
+            "INSERT INTO documents "
+            "(doc_id, filename, file_type, file_path, size_bytes, content_hash, chunk_count, "
+            "status, error, timings, metadata, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, NULL, '{}', ?, ?, ?) "
+            "ON CONFLICT(doc_id) DO UPDATE SET "
+            "filename = excluded.filename, file_type = excluded.file_type, "
+            "file_path = excluded.file_path, size_bytes = excluded.size_bytes, "
+            "content_hash = excluded.content_hash, chunk_count = excluded.chunk_count, "
+            "status = excluded.status, error = NULL, timings = '{}', "
+            "metadata = excluded.metadata, updated_at = excluded.updated_at",
+            (doc_id, filename, file_type, file_path, size_bytes, content_hash, chunk_count,
+             STATUS_PROCESSING, json.dumps(metadata or {}), now, now)
+        )
+    
+    def mark_completed(self, doc_id: str, chunk_count: int, timings: Optional[Dict[str, float]] = None,
+                       metadata: Optional[Dict[str, Any]] = None):
+        """Record a successful ingestion with its chunk count, stage timings and extra metadata"""
+        self._connect().execute(
+            "UPDATE documents SET status = ?, chunk_count = ?, error = NULL, timings = ?, "
+            "metadata = json_patch(metadata, ?), updated_at = ? WHERE doc_id = ?",
+            (STATUS_COMPLETED, chunk_count, json.dumps(timings or {}), json.dumps(metadata or {}),
+             time.time(), doc_id)
+        )
+    
+    def mark_failed(self, doc_id: str, error: str, timings: Optional[Dict[str, float]] = None):
+        """Record a failed ingestion"""
+        self._connect().execute(
+            "UPDATE documents SET status = ?, error = ?, timings = ?, updated_at = ? WHERE doc_id = ?",
+            (STATUS_FAILED, error, json.dumps(timings or {}), time.time(), doc_id)
+        )
+    
+    def get(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        """Get a document by ID (None if unknown)"""
+        row = self._connect().execute(
+            "SELECT * FROM documents WHERE doc_id = ?", (doc_id,)
+        ).fetchone()
+        return self._to_dict(row) if row else None
+    
+    def find_by_content(self, content_hash: str, fingerprint: str) -> Optional[Dict[str, Any]]:
+        """
+        A processing or completed document with the same content and ingestion settings
+        
+        Args:
+            content_hash: sha256 of the upload
+            fingerprint: Ingestion settings fingerprint stored in the document's metadata
+        
+        Returns:
+            The document (completed ones preferred, newest first), or None
+        """
+        row = self._connect().execute(
+            "SELECT * FROM documents WHERE content_hash = ? AND status != ? "
+            "AND json_extract(metadata, '$.ingest_fingerprint') = ? "
+            "ORDER BY status = ? DESC, updated_at DESC LIMIT 1",
+            (content_hash, STATUS_FAILED, fingerprint, STATUS_COMPLETED)
+        ).fetchone()
+        return self._to_dict(row) if row else None
+    
+    def list_documents(self, limit: int = 100, offset: int = 0) -> List[Dict[str, Any]]:
+        """Documents, newest first"""
+        rows = self._connect().execute(
+            "SELECT * FROM documents ORDER BY created_at DESC, rowid DESC LIMIT ? OFFSET ?", (limit, offset)
+        ).fetchall()
+        return [self._to_dict(row) for row in rows]
+    
+    def restore(self, documents: List[Dict[str, Any]]):
+        """Insert or replace full document records (e.g. from a snapshot)"""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT OR REPLACE INTO documents "
+                "(doc_id, filename, file_type, file_path, size_bytes, content_hash, chunk_count, "
+                "status, error, timings, metadata, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (doc["doc_id"], doc["filename"], doc["file_type"], doc.get("file_path"),
+                     doc.get("size_bytes", 0), doc.get("content_hash"), doc.get("chunk_count", 0),
+                     doc["status"], doc.get("error"), json.dumps(doc.get("timings") or {}),
+                     json.dumps(doc.get("metadata") or {}), doc["created_at"], doc["updated_at"])
+                    for doc in documents
+                ]
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    
+    def backfill(self, documents: List[Dict[str, Any]]) -> int:
+        """
+        Register documents that are not in the registry yet (existing rows are kept)
+        
+        Returns:
+            Number of documents added
+        """
+        conn = self._connect()
+        before = self.count()
+        now = time.time()
+        conn.executemany(
+            "INSERT OR IGNORE INTO documents "
+            "(doc_id, filename, file_type, file_path, size_bytes, chunk_count, status, metadata, "
+            "created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (doc["doc_id"], doc["filename"], doc["file_type"], doc.get("file_path"), doc.get("size_bytes", 0),
+                 doc.get("chunk_count", 0), STATUS_COMPLETED, json.dumps(doc.get("metadata") or {}),
+                 doc.get("created_at", now), now)
+                for doc in documents
+            ]
+        )
+        return self.count() - before
+    
+    def has_migration(self, name: str) -> bool:
+        """Whether a one-time migration already ran"""
+        return self._connect().execute("SELECT 1 FROM migrations WHERE name = ?", (name,)).fetchone() is not None
+    
+    def record_migration(self, name: str):
+        """Remember that a one-time migration ran"""
+        self._connect().execute(
+            "INSERT OR IGNORE INTO migrations (name, applied_at) VALUES (?, ?)", (name, time.time())
+        )
+    
+    def count(self) -> int:
+        """Number of registered documents"""
+        return self._connect().execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+    
+    def delete(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        """Remove a document and return its last record (None if unknown)"""
+        document = self.get(doc_id)
+        if document:
+            self._connect().execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,))
+        return document
+
+# Global instance - lazy loaded
+document_registry = None
+
+def get_document_registry() -> DocumentRegistry:
+    """Get the global document registry"""
+    global document_registry
+    if document_registry is None:
+        document_registry = DocumentRegistry(settings.document_registry_path)
+    return document_registry
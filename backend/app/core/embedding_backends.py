@@ -0,0 +1,157 @@
+"""
+Embedding backends for StudyBuddy
+
+EmbeddingsService delegates the actual vector computation to a backend:
+the OpenAI API, or a fully local CPU backend for air-gapped deployments
+and load tests.
+"""
+from openai import OpenAI, AsyncOpenAI
+from typing import List, Optional
+import asyncio
+import base64
+import logging
+import re
+import zlib
+import numpy as np
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingBackend:
+    """Base class for embedding providers"""
+    
+    # Model name sent to the provider
+    model: str = ""
+    dimension: int = 0
+    # Identity of the vector space (model and output size), used in cache keys
+    vector_space: str = ""
+    # Inputs longer than this are split and pooled (None = no limit)
+    max_input_tokens: Optional[int] = None
+    
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """Embed one request's worth of texts into a float32 (n, dimension) matrix"""
+        raise NotImplementedError
+    
+    async def aembed(self, texts: List[str]) -> np.ndarray:
+        """Async version of embed (runs in a worker thread by default)"""
+        return await asyncio.to_thread(self.embed, texts)
+
+class OpenAIEmbeddingBackend(EmbeddingBackend):
+    """Embeddings from the OpenAI API"""
+    
+    # Native output size of known models
+    DIMENSIONS = {
+        "text-embedding-ada-002": 1536,
+        "text-embedding-3-small": 1536,
+        "text-embedding-3-large": 3072
+    }
+    
+    def __init__(self, api_key: str = None, model: str = None, dimension: int = None):
+        self.api_key = api_key or settings.openai_api_key
+        if not self.api_key:
+            raise ValueError("OpenAI API key is required")
+        
+        self.client = OpenAI(api_key=self.api_key)
+        self.async_client = AsyncOpenAI(api_key=self.api_key)
+        self.model = model or settings.embedding_model
+        self.max_input_tokens = settings.embedding_max_input_tokens
+        
+        native = self.DIMENSIONS.get(self.model, 1536)
+        self.dimension = dimension or native
+        # text-embedding-3 models can return shortened vectors
+        self._extra = {"dimensions": self.dimension} if self.dimension != native else {}
+        self.vector_space = f"{self.model}-{self.dimension}"
+    
+    @staticmethod
+    def _to_matrix(response) -> np.ndarray:
+        """Decode a response straight into float32 without boxing each value"""
+        rows = []
+        for data in response.data:
+            if isinstance(data.embedding, str):
+                rows.append(np.frombuffer(base64.b64decode(data.embedding), dtype=np.float32))
+            else:
+                rows.append(np.asarray(data.embedding, dtype=np.float32))
+        return np.vstack(rows)
+    
+    def embed(self, texts: List[str]) -> np.ndarray:
+        response = self.client.embeddings.create(
+            input=texts, model=self.model, encoding_format="base64", **self._extra
+        )
+        return self._to_matrix(response)
+    
+    async def aembed(self, texts: List[str]) -> np.ndarray:
+        response = await self.async_client.embeddings.create(
+            input=texts, model=self.model, encoding_format="base64", **self._extra
+        )
+        return self._to_matrix(response)
+
+class HashingEmbeddingBackend(EmbeddingBackend):
+    """
+    Local CPU embeddings from signed feature hashing
+    
+    Words and character n-grams are hashed (crc32, stable across processes)
+    into a fixed number of buckets with a random sign, log-scaled and
+    L2-normalized. No network access, no model files and no per-token cost.
+    """
+    
+    WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+    
+    def __init__(self, dimension: int = 512, ngram_sizes=(3, 4, 5)):
+        self.dimension = dimension
+        self.ngram_sizes = ngram_sizes
+        self.model = f"hashing-{dimension}"
+        self.vector_space = self.model
+    
+    def _features(self, text: str) -> List[str]:
+        """Word and boundary-marked character n-gram features"""
+        features = []
+        for word in self.WORD_PATTERN.findall(text.lower()):
+            features.append(word)
+            marked = f"<{word}>"
+            for n in self.ngram_sizes:
+                features.extend(marked[i:i + n] for i in range(len(marked) - n + 1))
+        return features
+    
+    def _embed_one(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        hashes = np.fromiter(
+            (zlib.crc32(feature.encode("utf-8")) for feature in self._features(text)),
+            dtype=np.uint32
+        )
+        if hashes.size:
+            signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+            np.add.at(vector, hashes % self.dimension, signs)
+            vector = np.sign(vector) * np.log1p(np.abs(vector))
+            norm = np.linalg.norm(vector)
+            if norm > 0:
+                vector /= norm
+        return vector
+    
+    def embed(self, texts: List[str]) -> np.ndarray:
+        matrix = np.empty((len(texts), self.dimension), dtype=np.float32)
+        for i, text in enumerate(texts):
+            matrix[i] = self._embed_one(text)
+        return matrix
+
+def create_embedding_backend(api_key: str = None) -> EmbeddingBackend:
+    """Build the backend selected by settings.embedding_backend"""
+    name = settings.embedding_backend.lower()
+    if name == "openai":
+        return OpenAIEmbeddingBackend(api_key=api_key, dimension=settings.embedding_dimension or None)
+    if name == "hashing":
+        return HashingEmbeddingBackend(dimension=settings.embedding_dimension or 512)
+    raise ValueError(f"Unknown embedding backend: {settings.embedding_backend}")
+
+def get_embedding_dimension() -> int:
+    """Vector size of the configured backend (without creating API clients)"""
+    if settings.embedding_dimension:
+        return settings.embedding_dimension
+    if settings.embedding_backend.lower() == "hashing":
+        return 512
+    return OpenAIEmbeddingBackend.DIMENSIONS.get(settings.embedding_model, 1536)
+
+def get_vector_space() -> str:
+    """Vector space identity of the configured backend, as used in cache keys (without creating API clients)"""
+    if settings.embedding_backend.lower() == "hashing":
+        return f"hashing-{get_embedding_dimension()}"
+    return f"{settings.embedding_model}-{get_embedding_dimension()}"
@@ -0,0 +1,320 @@
+"""
+Persistent content-addressed embedding cache for StudyBuddy
+"""
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from .config import settings
+from .sqlite_util import ThreadLocalConnections
+
+logger = logging.getLogger(__name__)
+
+# SQLite limits the number of bound parameters per statement
+_SQL_BATCH = 500
+
+def cache_key(model: str, text: str) -> str:
+    """Content address for a (model, text) pair"""
+    return hashlib.sha256(f"{model}\x00{text}".encode("utf-8")).hexdigest()
+
+class EmbeddingCache:
+    """
+    On-disk embedding cache backed by SQLite.
+    
+    Vectors are keyed by model name plus a hash of the text and stored as
+    packed float32 (or int8 with a per-vector scale). SQLite file locking
+    makes the cache safe to share between uvicorn workers, and entries are
+    evicted least-recently-used first once the stored bytes exceed max_bytes.
+    
+    Lookups only read. Access times and hit/miss counters are buffered in
+    the process and written every flush_seconds or with the next put_many,
+    so the LRU order and the shared counters may lag slightly behind.
+    """
+    
+    def __init__(self, path: str, max_bytes: int, dtype: str = "float32", flush_seconds: float = 30.0):
+        if dtype not in ("float32", "int8"):
+            raise ValueError(f"Unsupported embedding cache dtype: {dtype}")
+        
+        self.path = path
+        self.max_bytes = max_bytes
+        self.dtype = dtype
+        self.flush_seconds = flush_seconds
+        self.hits = 0
+        self.misses = 0
+        self._counter_lock = threading.Lock()
+        # Not yet written: last access time per key and hit/miss counts
+        self._pending_access: Dict[str, float] = {}
+        self._pending_hits = 0
+        self._pending_misses = 0
+        self._last_flush = time.monotonic()
+        self._connections = ThreadLocalConnections(self.path)
+        self._init_db()
+    
+    def _connect(self) -> sqlite3.Connection:
+        """Get a per-thread connection to the cache database"""
+        return self._connections.get()
+    
+    def _init_db(self):
+        """Create cache tables if they don't exist"""
+        conn = self._connect()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                dim INTEGER NOT NULL,
+                dtype TEXT NOT NULL,
+                scale REAL NOT NULL,
+                vector BLOB NOT NULL,
+                nbytes INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_embeddings_last_access
+                ON embeddings(last_access);
+            CREATE TABLE IF NOT EXISTS stats (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+            INSERT OR IGNORE INTO stats(name, value) VALUES ('hits', 0), ('misses', 0), ('bytes', 0);
+        """)
+    
+    def _encode(self, vector: Sequence[float]):
+        """Pack a vector into (dtype, scale, blob)"""
+        array = np.asarray(vector, dtype=np.float32)
+        if self.dtype == "int8":
+            peak = float(np.max(np.abs(array))) if array.size else 0.0
+            scale = peak / 127.0 if peak > 0 else 1.0
+            packed = np.clip(np.rint(array / scale), -127, 127).astype(np.int8)
+            return "int8", scale, packed.tobytes()
+        return "float32", 1.0, array.tobytes()
+    
+    @staticmethod
+    def _decode(dtype: str, scale: float, blob: bytes) -> np.ndarray:
+        """Unpack a stored vector back to float32"""
+        if dtype == "int8":
+            return np.frombuffer(blob, dtype=np.int8).astype(np.float32) * np.float32(scale)
+        return np.frombuffer(blob, dtype=np.float32).copy()
+    
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """
+        Look up cached vectors for a list of texts
+        
+        Args:
+            model: Embedding model name
+            texts: Texts to look up
+        
+        Returns:
+            List aligned with texts holding a float32 vector or None on miss
+        """
+        keys = [cache_key(model, text) for text in texts]
+        found: Dict[str, np.ndarray] = {}
+        unique_keys = list(dict.fromkeys(keys))
+        
+        try:
+            conn = self._connect()
+            for i in range(0, len(unique_keys), _SQL_BATCH):
+                batch = unique_keys[i:i + _SQL_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = conn.execute(
+                    f"SELECT key, dtype, scale, vector FROM embeddings WHERE key IN ({placeholders})",
+                    batch
+                ).fetchall()
+                for key, dtype, scale, blob in rows:
+                    found[key] = self._decode(dtype, scale, blob)
+            
+        except Exception as e:
+            # A broken cache must never break embedding
+            logger.error(f"Error reading embedding cache: {e}")
+            return [None] * len(texts)
+        
+        hits = sum(1 for key in keys if key in found)
+        misses = len(keys) - hits
+        now = time.time()
+        with self._counter_lock:
+            self.hits += hits
+            self.misses += misses
+            self._pending_hits += hits
+            self._pending_misses += misses
+            for key in found:
+                self._pending_access[key] = now
+            due = time.monotonic() - self._last_flush >= self.flush_seconds
+        
+        if due:
+            self.flush()
+        return [found.get(key) for key in keys]
+    
+    def _take_pending(self):
+        """Hand over the buffered access times and counters (reset in the process)"""
+        with self._counter_lock:
+            pending = (self._pending_access, self._pending_hits, self._pending_misses)
+            self._pending_access = {}
+            self._pending_hits = 0
+            self._pending_misses = 0
+            self._last_flush = time.monotonic()
+        return pending
+    
+    def _restore_pending(self, pending):
+        """Put back buffered updates that could not be written"""
+        access, hits, misses = pending
+        with self._counter_lock:
+            for key, accessed in access.items():
+                self._pending_access[key] = max(accessed, self._pending_access.get(key, 0.0))
+            self._pending_hits += hits
+            self._pending_misses += misses
+    
+    @staticmethod
+    def _write_pending(conn: sqlite3.Connection, pending):
+        """Apply buffered access times and counters inside an open transaction"""
+        access, hits, misses = pending
+        if access:
+            conn.executemany(
+                "UPDATE embeddings SET last_access = MAX(last_access, ?) WHERE key = ?",
+                [(accessed, key) for key, accessed in access.items()]
+            )
+        if hits:
+            conn.execute("UPDATE stats SET value = value + ? WHERE name = 'hits'", (hits,))
+        if misses:
+            conn.execute("UPDATE stats SET value = value + ? WHERE name = 'misses'", (misses,))
+    
+    def flush(self):
+        """Write buffered access times and hit/miss counters to the database"""
+        pending = self._take_pending()
+        if not any(pending):
+            return
+        try:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._write_pending(conn, pending)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        except Exception as e:
+            self._restore_pending(pending)
+            logger.error(f"Error flushing embedding cache access times: {e}")
+    
+    def put_many(self, model: str, texts: List[str], vectors: Sequence[Sequence[float]]):
+        """
+        Store vectors for a list of texts and evict old entries if needed
+        
+        Args:
+            model: Embedding model name
+            texts: Texts that were embedded
+            vectors: Embedding vectors aligned with texts
+        """
+        now = time.time()
+        # Buffered access times go in first, so eviction sees recent lookups
+        pending = self._take_pending()
+        try:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._write_pending(conn, pending)
+                added_bytes = 0
+                for text, vector in zip(texts, vectors):
+                    dtype, scale, blob = self._encode(vector)
+                    cursor = conn.execute(
+                        "INSERT OR IGNORE INTO embeddings "
+                        "(key, model, dim, dtype, scale, vector, nbytes, last_access) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (cache_key(model, text), model, len(vector), dtype, scale, blob, len(blob), now)
+                    )
+                    if cursor.rowcount == 1:
+                        added_bytes += len(blob)
+                
+                conn.execute("UPDATE stats SET value = value + ? WHERE name = 'bytes'", (added_bytes,))
+                self._evict(conn)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        except Exception as e:
+            self._restore_pending(pending)
+            logger.error(f"Error writing embedding cache: {e}")
+    
+    def _evict(self, conn: sqlite3.Connection):
+        """Drop least recently used entries until the cache is under 90% of max_bytes"""
+        total = conn.execute("SELECT value FROM stats WHERE name = 'bytes'").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        
+        target = int(self.max_bytes * 0.9)
+        freed = 0
+        evicted = 0
+        while total - freed > target:
+            rows = conn.execute(
+                "SELECT key, nbytes FROM embeddings ORDER BY last_access ASC LIMIT ?",
+                (_SQL_BATCH,)
+            ).fetchall()
+            if not rows:
+                break
+            
+            batch = []
+            for key, nbytes in rows:
+                batch.append((key,))
+                freed += nbytes
+                if total - freed <= target:
+                    break
+            
+            conn.executemany("DELETE FROM embeddings WHERE key = ?", batch)
+            evicted += len(batch)
+        
+        conn.execute("UPDATE stats SET value = value - ? WHERE name = 'bytes'", (freed,))
+        logger.info(f"Evicted {evicted} embeddings ({freed} bytes) from cache")
+    
+    def stats(self) -> Dict[str, object]:
+        """Hit/miss counters and size of the cache (shared across workers)"""
+        self.flush()
+        conn = self._connect()
+        counters = dict(conn.execute("SELECT name, value FROM stats").fetchall())
+        entries = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        lookups = counters.get("hits", 0) + counters.get("misses", 0)
+        return {
+            "path": self.path,
+            "dtype": self.dtype,
+            "entries": entries,
+            "bytes": counters.get("bytes", 0),
+            "max_bytes": self.max_bytes,
+            "hits": counters.get("hits", 0),
+            "misses": counters.get("misses", 0),
+            "hit_rate": round(counters.get("hits", 0) / lookups, 4) if lookups else 0.0,
+            "process_hits": self.hits,
+            "process_misses": self.misses
+        }
+    
+    def clear(self):
+        """Remove all cached vectors and reset counters"""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM embeddings")
+        conn.execute("UPDATE stats SET value = 0")
+        conn.execute("COMMIT")
+        self._take_pending()
+        with self._counter_lock:
+            self.hits = 0
+            self.misses = 0
+
+# Global instance - lazy loaded
+embedding_cache = None
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """Get the global embedding cache (None when caching is disabled)"""
+    global embedding_cache
+    if embedding_cache is None and settings.embedding_cache_enabled:
+        embedding_cache = EmbeddingCache(
+            path=settings.embedding_cache_path,
+            max_bytes=settings.embedding_cache_max_mb * 1024 * 1024,
+            dtype=settings.embedding_cache_dtype,
+            flush_seconds=settings.embedding_cache_flush_seconds
+        )
+    return embedding_cache
+
+def flush_embedding_cache():
+    """Write the global cache's buffered access times and counters (e.g. on shutdown)"""
+    if embedding_cache is not None:
+        embedding_cache.flush()
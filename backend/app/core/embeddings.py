@@ -1,23 +1,118 @@
 """
-OpenAI embeddings wrapper for StudyBuddy
+Embeddings service for StudyBuddy (OpenAI or local backends)
 """
-from openai import OpenAI
-from typing import List, Union
+from typing import List, Union, Iterator, Tuple, Callable, Optional
+from concurrent.futures import Future, ThreadPoolExecutor
+import asyncio
 import logging
+import queue
+import threading
+import time
+import numpy as np
 from .config import settings
+from .embedding_backends import EmbeddingBackend, create_embedding_backend
+from .embedding_cache import get_embedding_cache
+from .tokenizer import count_tokens, split_by_tokens
 
 logger = logging.getLogger(__name__)
 
-class EmbeddingsService:
-    def __init__(self, api_key: str = None):
-        self.api_key = api_key or settings.openai_api_key
-        if not self.api_key:
-            raise ValueError("OpenAI API key is required")
+class QueryCoalescer:
+    """
+    Micro-batches concurrent query embeddings into single API requests
+    
+    Callers on any thread or event loop submit a query and get a Future.
+    A background thread collects queries that arrive within window_ms of
+    the first pending one (up to max_batch) and embeds them in one call.
+    """
+    
+    def __init__(self, embed_batch: Callable[[List[str]], np.ndarray],
+                 window_ms: float, max_batch: int, max_in_flight: int = 4):
+        self._embed_batch = embed_batch
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="embed-coalescer")
+        self._thread = None
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.queries = 0
+    
+    def submit(self, text: str) -> Future:
+        """Queue a query for the next batch"""
+        future = Future()
+        self._ensure_thread()
+        self._queue.put((text, future))
+        return future
+    
+    def _ensure_thread(self):
+        """Start the collector thread on first use"""
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="embed-coalescer", daemon=True)
+                    self._thread.start()
+    
+    def _run(self):
+        """Collect pending queries into batches and dispatch them"""
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            
+            # Keep collecting while the API call is in flight
+            self._executor.submit(self._flush, batch)
+    
+    def _flush(self, batch: List[Tuple[str, Future]]):
+        """Embed one batch and resolve each caller's future"""
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        try:
+            vectors = dict(zip(texts, self._embed_batch(texts)))
+            for text, future in batch:
+                if not future.cancelled():
+                    future.set_result(vectors[text])
+        except Exception as e:
+            for _, future in batch:
+                if not future.cancelled():
+                    future.set_exception(e)
         
-        self.client = OpenAI(api_key=self.api_key)
-        self.model = "text-embedding-ada-002"
+        with self._lock:
+            self.requests += 1
+            self.queries += len(batch)
     
-    def embed_text(self, text: str) -> List[float]:
+    def stats(self) -> dict:
+        """Number of API requests versus queries served"""
+        return {
+            "requests": self.requests,
+            "queries": self.queries,
+            "avg_batch_size": round(self.queries / self.requests, 2) if self.requests else 0.0
+        }
+
+class EmbeddingsService:
+    def __init__(self, api_key: str = None, backend: EmbeddingBackend = None):
+        self.backend = backend or create_embedding_backend(api_key)
+        self.model = self.backend.model
+        self.dimension = self.backend.dimension
+        # Cache entries are keyed by vector space, so shortened vectors never mix with full-size ones
+        self.vector_space = self.backend.vector_space
+        self.cache = get_embedding_cache()
+        self.coalescer = None
+        if settings.embedding_coalesce_enabled:
+            self.coalescer = QueryCoalescer(
+                embed_batch=self._embed_and_cache,
+                window_ms=settings.embedding_coalesce_window_ms,
+                max_batch=settings.embedding_coalesce_max_batch,
+                max_in_flight=settings.embedding_max_concurrency
+            )
+    
+    def embed_text(self, text: str) -> np.ndarray:
         """
         Get embedding for a single text
         
@@ -25,58 +120,279 @@ class EmbeddingsService:
             text: Text to embed
             
         Returns:
-            List of floats representing the embedding vector
+            float32 vector of shape (dimension,)
         """
         try:
-            response = self.client.embeddings.create(
-                input=text,
-                model=self.model
-            )
-            return response.data[0].embedding
+            if self.cache:
+                cached = self.cache.get_many(self.vector_space, [text])[0]
+                if cached is not None:
+                    return cached
+            
+            embedding = self._embed_batches([text])[0]
+            
+            if self.cache:
+                self.cache.put_many(self.vector_space, [text], embedding[None, :])
+            
+            return embedding
         except Exception as e:
             logger.error(f"Error embedding text: {e}")
             raise
     
-    def embed_texts(self, texts: List[str]) -> List[List[float]]:
+    def embed_texts(self, texts: List[str]) -> np.ndarray:
         """
         Get embeddings for multiple texts (batch processing)
         
+        Texts already in the embedding cache are served from disk; only
+        the remaining unique texts are sent to the API.
+        
         Args:
             texts: List of texts to embed
             
         Returns:
-            List of embedding vectors
+            Contiguous float32 matrix of shape (len(texts), dimension)
         """
         try:
-            # Process in batches to avoid API limits
-            batch_size = 100
-            all_embeddings = []
-            
-            for i in range(0, len(texts), batch_size):
-                batch = texts[i:i + batch_size]
+            cached = self._lookup_cached(texts)
+            missing = self._missing_texts(texts, cached)
+            new_embeddings = None
                 
-                response = self.client.embeddings.create(
-                    input=batch,
-                    model=self.model
-                )
-                
-                batch_embeddings = [data.embedding for data in response.data]
-                all_embeddings.extend(batch_embeddings)
-                
-                logger.info(f"Processed batch {i//batch_size + 1}, embedded {len(batch)} texts")
+            if missing:
+                missing_texts = list(missing)
+                new_embeddings = self._embed_batches(missing_texts)
+            
+                if self.cache:
+                    self.cache.put_many(self.vector_space, missing_texts, new_embeddings)
+            
+            logger.info(f"Embedded {len(texts)} texts ({len(texts) - sum(len(v) for v in missing.values())} from cache)")
+            return self._assemble(len(texts), cached, missing, new_embeddings)
+            
+        except Exception as e:
+            logger.error(f"Error embedding texts: {e}")
+            raise
+    
+    async def aembed_texts(self, texts: List[str]) -> np.ndarray:
+        """
+        Async version of embed_texts for ingestion
+        
+        Batches are dispatched concurrently through the backend's async client,
+        with at most settings.embedding_max_concurrency requests in flight.
+        Results keep the order of the input texts.
+        
+        Args:
+            texts: List of texts to embed
+        
+        Returns:
+            Contiguous float32 matrix of shape (len(texts), dimension)
+        """
+        try:
+            cached = await asyncio.to_thread(self._lookup_cached, texts)
+            missing = self._missing_texts(texts, cached)
+            new_embeddings = None
             
-            return all_embeddings
+            if missing:
+                missing_texts = list(missing)
+                new_embeddings = await self._aembed_batches(missing_texts)
+                
+                if self.cache:
+                    await asyncio.to_thread(self.cache.put_many, self.vector_space, missing_texts, new_embeddings)
             
+            logger.info(f"Embedded {len(texts)} texts ({len(texts) - sum(len(v) for v in missing.values())} from cache)")
+            return self._assemble(len(texts), cached, missing, new_embeddings)
+        
         except Exception as e:
             logger.error(f"Error embedding texts: {e}")
             raise
     
-    def embed_query(self, query: str) -> List[float]:
+    def _lookup_cached(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Cached vectors aligned with texts (None where not cached)"""
+        if self.cache:
+            return self.cache.get_many(self.vector_space, texts)
+        return [None] * len(texts)
+    
+    @staticmethod
+    def _missing_texts(texts: List[str], cached: List[Optional[np.ndarray]]) -> dict:
+        """Map each distinct uncached text to the positions it appears at"""
+        missing = {}
+        for i, text in enumerate(texts):
+            if cached[i] is None:
+                missing.setdefault(text, []).append(i)
+        return missing
+    
+    def _assemble(self, n_texts: int, cached: List[Optional[np.ndarray]], missing: dict,
+                  new_embeddings: Optional[np.ndarray]) -> np.ndarray:
+        """Build the output matrix from cached rows and freshly computed rows"""
+        matrix = np.empty((n_texts, self.dimension), dtype=np.float32)
+        for i, vector in enumerate(cached):
+            if vector is not None:
+                matrix[i] = vector
+        for row, positions in enumerate(missing.values()):
+            matrix[positions] = new_embeddings[row]
+        return matrix
+    
+    def _split_oversize(self, texts: List[str]) -> Tuple[List[str], List[int], List[int]]:
+        """
+        Split inputs longer than the model context into token windows
+        
+        Returns:
+            (pieces, owner index of each piece, token count of each piece)
+        """
+        pieces, owners, piece_tokens = [], [], []
+        max_input_tokens = self.backend.max_input_tokens
+        
+        for i, text in enumerate(texts):
+            n_tokens = count_tokens(text)
+            if max_input_tokens is None or n_tokens <= max_input_tokens:
+                pieces.append(text)
+                owners.append(i)
+                piece_tokens.append(n_tokens)
+                continue
+            
+            parts = split_by_tokens(text, max_input_tokens)
+            logger.info(f"Split oversize input ({n_tokens} tokens) into {len(parts)} pieces")
+            for part in parts:
+                pieces.append(part)
+                owners.append(i)
+                piece_tokens.append(count_tokens(part))
+        
+        return pieces, owners, piece_tokens
+    
+    @staticmethod
+    def _pool(n_texts: int, owners: List[int], piece_tokens: List[int],
+              piece_embeddings: np.ndarray) -> np.ndarray:
+        """Token-weighted mean of each split input's piece vectors, re-normalized"""
+        if len(piece_embeddings) == n_texts:
+            return piece_embeddings
+        
+        owners = np.asarray(owners)
+        weights = np.asarray(piece_tokens, dtype=np.float32)[:, None]
+        pooled = np.zeros((n_texts, piece_embeddings.shape[1]), dtype=np.float32)
+        np.add.at(pooled, owners, piece_embeddings * weights)
+        
+        split = np.bincount(owners, minlength=n_texts) > 1
+        norms = np.linalg.norm(pooled[split], axis=1, keepdims=True)
+        pooled[split] /= np.where(norms > 0, norms, 1.0)
+        
+        # Inputs that weren't split keep their vector unchanged
+        unsplit = ~split[owners]
+        pooled[owners[unsplit]] = piece_embeddings[unsplit]
+        return pooled
+    
+    def _batches(self, texts: List[str], text_tokens: List[int]) -> Iterator[List[str]]:
+        """Greedily pack texts into requests under the per-request token budget"""
+        max_tokens = settings.embedding_max_batch_tokens
+        max_size = settings.embedding_max_batch_size
+        batch, batch_tokens = [], 0
+        
+        for text, n_tokens in zip(texts, text_tokens):
+            if batch and (batch_tokens + n_tokens > max_tokens or len(batch) >= max_size):
+                yield batch
+                batch, batch_tokens = [], 0
+            batch.append(text)
+            batch_tokens += n_tokens
+        
+        if batch:
+            yield batch
+    
+    def _embed_batches(self, texts: List[str]) -> np.ndarray:
+        """Embed texts through the backend in token-packed batches"""
+        pieces, owners, piece_tokens = self._split_oversize(texts)
+        piece_embeddings = np.empty((len(pieces), self.dimension), dtype=np.float32)
+        offset = 0
+        
+        for batch_num, batch in enumerate(self._batches(pieces, piece_tokens), 1):
+            piece_embeddings[offset:offset + len(batch)] = self.backend.embed(batch)
+            offset += len(batch)
+            
+            logger.info(f"Processed batch {batch_num}, embedded {len(batch)} texts")
+        
+        return self._pool(len(texts), owners, piece_tokens, piece_embeddings)
+    
+    async def _aembed_batches(self, texts: List[str]) -> np.ndarray:
+        """Embed texts through the backend with concurrent token-packed batches"""
+        pieces, owners, piece_tokens = self._split_oversize(texts)
+        semaphore = asyncio.Semaphore(settings.embedding_max_concurrency)
+        
+        async def embed_batch(batch_num: int, batch: List[str]) -> np.ndarray:
+            async with semaphore:
+                batch_embeddings = await self.backend.aembed(batch)
+            logger.info(f"Processed batch {batch_num}, embedded {len(batch)} texts")
+            return batch_embeddings
+        
+        # gather returns results in submission order
+        results = await asyncio.gather(*[
+            embed_batch(batch_num, batch)
+            for batch_num, batch in enumerate(self._batches(pieces, piece_tokens), 1)
+        ])
+        piece_embeddings = np.concatenate(results) if results else np.empty((0, self.dimension), dtype=np.float32)
+        return self._pool(len(texts), owners, piece_tokens, piece_embeddings)
+    
+    def embed_query(self, query: str) -> np.ndarray:
         """
         Embed a query for similarity search
-        Same as embed_text but with explicit naming for clarity
+        
+        Concurrent queries are coalesced into one batched API request.
+        """
+        if self.coalescer is None:
+            return self.embed_text(query)
+        
+        cached = self._lookup_cached([query])[0]
+        if cached is not None:
+            return cached
+        return self.coalescer.submit(query).result()
+    
+    async def aembed_query(self, query: str) -> np.ndarray:
+        """Async version of embed_query that doesn't block the event loop"""
+        if self.coalescer is None:
+            return await asyncio.to_thread(self.embed_text, query)
+        
+        cached = (await asyncio.to_thread(self._lookup_cached, [query]))[0]
+        if cached is not None:
+            return cached
+        return await asyncio.wrap_future(self.coalescer.submit(query))
+    
+    async def aembed_queries(self, queries: List[str]) -> np.ndarray:
         """
-        return self.embed_text(query)
+        Embed several search queries of one request
+        
+        Uncached queries go through the query coalescer one by one, so they
+        share embedding batches with concurrent requests.
+        
+        Args:
+            queries: Queries to embed
+        
+        Returns:
+            Contiguous float32 matrix of shape (len(queries), dimension)
+        """
+        if self.coalescer is None:
+            return await self.aembed_texts(queries)
+        
+        cached = await asyncio.to_thread(self._lookup_cached, queries)
+        missing = [i for i, vector in enumerate(cached) if vector is None]
+        vectors = await asyncio.gather(*(
+            asyncio.wrap_future(self.coalescer.submit(queries[i])) for i in missing
+        ))
+        for i, vector in zip(missing, vectors):
+            cached[i] = vector
+        return np.ascontiguousarray(np.stack(cached), dtype=np.float32)
+    
+    def _embed_and_cache(self, texts: List[str]) -> np.ndarray:
+        """Embed texts through the backend and store them in the cache"""
+        embeddings = self._embed_batches(texts)
+        if self.cache:
+            self.cache.put_many(self.vector_space, texts, embeddings)
+        return embeddings
+    
+    def cache_stats(self) -> dict:
+        """Embedding cache hit/miss counters (empty when caching is disabled)"""
+        if not self.cache:
+            return {"enabled": False}
+        return {"enabled": True, **self.cache.stats()}
+    
+    def coalescer_stats(self) -> dict:
+        """Query coalescing counters (empty when coalescing is disabled)"""
+        if self.coalescer is None:
+            return {"enabled": False}
+        return {"enabled": True, **self.coalescer.stats()}
 
 # Global instance - lazy loaded
 embeddings_service = None
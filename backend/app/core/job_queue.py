@@ -0,0 +1,304 @@
+"""
+Durable ingestion job queue for StudyBuddy
+
+Uploads enqueue a job and return; ingestion workers claim jobs from a
+SQLite table, so queued and interrupted work survives restarts and is
+shared safely by several uvicorn workers.
+
+A claimed job holds a lease that its worker keeps renewing. When a worker
+dies, the lease expires and the job is queued again (or failed, once it
+has used all its attempts). Failed attempts are retried with exponential
+backoff.
+"""
+import json
+import logging
+import sqlite3
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from .config import settings
+from .sqlite_util import ThreadLocalConnections
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = "queued"
+JOB_EXTRACTING = "extracting"
+JOB_EMBEDDING = "embedding"
+JOB_UPSERTING = "upserting"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+# States of a job held by a worker
+ACTIVE_STATES = (JOB_EXTRACTING, JOB_EMBEDDING, JOB_UPSERTING)
+
+class PermanentJobError(Exception):
+    """A job failure that retrying cannot fix (e.g. a document without text)"""
+
+class DocumentDeletedError(PermanentJobError):
+    """The job's document was deleted while the job was queued or running"""
+
+class JobQueue:
+    """
+    Ingestion jobs and their state backed by SQLite
+    
+    WAL mode with per-thread connections, like the document registry.
+    Claiming runs in an IMMEDIATE transaction, so a job is handed to exactly
+    one worker across processes.
+    """
+    
+    def __init__(self, path: str, max_attempts: int = 3, backoff_seconds: float = 5.0,
+                 max_backoff_seconds: float = 300.0, lease_seconds: float = 120.0):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.lease_seconds = lease_seconds
+        self._connections = ThreadLocalConnections(self.path, row_factory=sqlite3.Row)
+        self._init_db()
+    
+    def _connect(self) -> sqlite3.Connection:
+        """Get a per-thread connection to the queue database"""
+        return self._connections.get()
+    
+    def _init_db(self):
+        """Create queue tables if they don't exist"""
+        self._connect().executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                doc_id TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL DEFAULT '{}',
+                state TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL,
+                error TEXT,
+                result TEXT NOT NULL DEFAULT '{}',
+                run_after REAL NOT NULL,
+                lease_expires_at REAL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                finished_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_jobs_state_run_after ON jobs(state, run_after);
+            CREATE INDEX IF NOT EXISTS idx_jobs_doc_state ON jobs(doc_id, state);
+        """)
+    
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"])
+        return job
+    
+    def enqueue(self, doc_id: str, kind: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Add a queued job
+        
+        Args:
+            doc_id: Document the job ingests
+            kind: Handler to run (text, pdf or excel)
+            payload: Handler arguments (e.g. file path and filename)
+        
+        Returns:
+            The new job
+        """
+        now = time.time()
+        job_id = str(uuid.uuid4())
+        self._connect().execute(
+            "INSERT INTO jobs (job_id, doc_id, kind, payload, state, max_attempts, run_after, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, doc_id, kind, json.dumps(payload), JOB_QUEUED, self.max_attempts, now, now, now)
+        )
+        return self.get(job_id)
+    
+    def claim(self) -> Optional[Dict[str, Any]]:
+        """
+        Take the oldest runnable queued job (None if there is none)
+        
+        Jobs of a document that already has a job running are skipped, so
+        two ingestions of one document never diff, upsert and delete its
+        points at the same time.
+        """
+        conn = self._connect()
+        now = time.time()
+        # Idle workers poll often: only take the write lock when a job may be runnable
+        if conn.execute(
+            "SELECT 1 FROM jobs WHERE state = ? AND run_after <= ? LIMIT 1", (JOB_QUEUED, now)
+        ).fetchone() is None:
+            return None
+        
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT job_id FROM jobs AS queued WHERE state = ? AND run_after <= ? "
+                "AND NOT EXISTS (SELECT 1 FROM jobs AS running WHERE running.doc_id = queued.doc_id "
+                "AND running.state IN (?, ?, ?)) "
+                "ORDER BY run_after, created_at LIMIT 1",
+                (JOB_QUEUED, now, *ACTIVE_STATES)
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET state = ?, attempts = attempts + 1, lease_expires_at = ?, updated_at = ? "
+                    "WHERE job_id = ?",
+                    (JOB_EXTRACTING, now + self.lease_seconds, now, row["job_id"])
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return self.get(row["job_id"]) if row is not None else None
+    
+    def set_state(self, job_id: str, state: str):
+        """Move a claimed job to another active state, renewing its lease"""
+        now = time.time()
+        self._connect().execute(
+            "UPDATE jobs SET state = ?, lease_expires_at = ?, updated_at = ? WHERE job_id = ? AND state IN (?, ?, ?)",
+            (state, now + self.lease_seconds, now, job_id, *ACTIVE_STATES)
+        )
+    
+    def heartbeat(self, job_id: str):
+        """Renew the lease of a claimed job"""
+        now = time.time()
+        self._connect().execute(
+            "UPDATE jobs SET lease_expires_at = ? WHERE job_id = ? AND state IN (?, ?, ?)",
+            (now + self.lease_seconds, job_id, *ACTIVE_STATES)
+        )
+    
+    def complete(self, job_id: str, result: Optional[Dict[str, Any]] = None):
+        """Mark a claimed job done with its result (a cancelled job stays failed)"""
+        now = time.time()
+        self._connect().execute(
+            "UPDATE jobs SET state = ?, error = NULL, result = ?, lease_expires_at = NULL, "
+            "updated_at = ?, finished_at = ? WHERE job_id = ? AND state IN (?, ?, ?)",
+            (JOB_DONE, json.dumps(result or {}, default=str), now, now, job_id, *ACTIVE_STATES)
+        )
+    
+    def fail(self, job_id: str, error: str, retry: bool = True) -> Dict[str, Any]:
+        """
+        Record a failed attempt
+        
+        The job is queued again after an exponential backoff while it has
+        attempts left, and failed otherwise.
+        
+        Args:
+            job_id: Job that failed
+            error: Error message
+            retry: False for permanent errors, which fail the job at once
+        
+        Returns:
+            The updated job
+        """
+        job = self.get(job_id)
+        if job["state"] not in ACTIVE_STATES:
+            # Already finished, e.g. cancelled because its document was deleted
+            return job
+        now = time.time()
+        if retry and job["attempts"] < job["max_attempts"]:
+            delay = min(self.max_backoff_seconds, self.backoff_seconds * 2 ** (job["attempts"] - 1))
+            self._connect().execute(
+                "UPDATE jobs SET state = ?, error = ?, run_after = ?, lease_expires_at = NULL, updated_at = ? "
+                "WHERE job_id = ?",
+                (JOB_QUEUED, error, now + delay, now, job_id)
+            )
+        else:
+            self._connect().execute(
+                "UPDATE jobs SET state = ?, error = ?, lease_expires_at = NULL, updated_at = ?, finished_at = ? "
+                "WHERE job_id = ?",
+                (JOB_FAILED, error, now, now, job_id)
+            )
+        return self.get(job_id)
+    
+    def release(self, job_id: str):
+        """Put a claimed job back in the queue without using up an attempt (e.g. on shutdown)"""
+        now = time.time()
+        self._connect().execute(
+            "UPDATE jobs SET state = ?, attempts = MAX(attempts - 1, 0), run_after = ?, lease_expires_at = NULL, "
+            "updated_at = ? WHERE job_id = ? AND state IN (?, ?, ?)",
+            (JOB_QUEUED, now, now, job_id, *ACTIVE_STATES)
+        )
+    
+    def cancel_document(self, doc_id: str, error: str = "Document was deleted") -> int:
+        """
+        Fail the queued and running jobs of a document
+        
+        A running job notices at its next batch (see DocumentDeletedError);
+        its later complete or fail calls leave the job failed.
+        
+        Returns:
+            Number of jobs cancelled
+        """
+        now = time.time()
+        cursor = self._connect().execute(
+            "UPDATE jobs SET state = ?, error = ?, lease_expires_at = NULL, updated_at = ?, finished_at = ? "
+            "WHERE doc_id = ? AND state IN (?, ?, ?, ?)",
+            (JOB_FAILED, error, now, now, doc_id, JOB_QUEUED, *ACTIVE_STATES)
+        )
+        return cursor.rowcount
+    
+    def requeue_expired(self) -> List[Dict[str, Any]]:
+        """
+        Recover jobs whose worker stopped renewing the lease (e.g. after a crash)
+        
+        Returns:
+            The recovered jobs: queued again, or failed when out of attempts
+        """
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            expired = [row["job_id"] for row in conn.execute(
+                "SELECT job_id FROM jobs WHERE state IN (?, ?, ?) AND lease_expires_at < ?",
+                (*ACTIVE_STATES, now)
+            )]
+            for job_id in expired:
+                conn.execute(
+                    "UPDATE jobs SET state = CASE WHEN attempts < max_attempts THEN ? ELSE ? END, "
+                    "error = ?, run_after = ?, lease_expires_at = NULL, updated_at = ?, "
+                    "finished_at = CASE WHEN attempts < max_attempts THEN NULL ELSE ? END WHERE job_id = ?",
+                    (JOB_QUEUED, JOB_FAILED, "Worker stopped while processing the job", now, now, now, job_id)
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return [self.get(job_id) for job_id in expired]
+    
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Get a job by ID (None if unknown)"""
+        row = self._connect().execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+    
+    def list_jobs(self, doc_id: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        """Jobs, newest first (optionally only those of one document)"""
+        if doc_id is None:
+            rows = self._connect().execute(
+                "SELECT * FROM jobs ORDER BY created_at DESC, rowid DESC LIMIT ?", (limit,)
+            ).fetchall()
+        else:
+            rows = self._connect().execute(
+                "SELECT * FROM jobs WHERE doc_id = ? ORDER BY created_at DESC, rowid DESC LIMIT ?", (doc_id, limit)
+            ).fetchall()
+        return [self._to_dict(row) for row in rows]
+    
+    def count(self, state: Optional[str] = None) -> int:
+        """Number of jobs (optionally in one state)"""
+        if state is None:
+            return self._connect().execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+        return self._connect().execute("SELECT COUNT(*) FROM jobs WHERE state = ?", (state,)).fetchone()[0]
+
+# Global instance - lazy loaded
+job_queue = None
+
+def get_job_queue() -> JobQueue:
+    """Get the global ingestion job queue"""
+    global job_queue
+    if job_queue is None:
+        job_queue = JobQueue(
+            settings.job_queue_path,
+            max_attempts=settings.ingest_max_attempts,
+            backoff_seconds=settings.ingest_retry_backoff_seconds,
+            max_backoff_seconds=settings.ingest_retry_backoff_max_seconds,
+            lease_seconds=settings.ingest_job_lease_seconds
+        )
+    return job_queue
@@ -0,0 +1,40 @@
+"""
+Shared SQLite connection setup for StudyBuddy's local stores
+
+The job queue, document registry, dedupe index and embedding cache each
+open one connection per thread in autocommit mode (transactions are
+explicit), with WAL so readers never block the writer and several
+uvicorn workers can share the same files.
+"""
+import os
+import sqlite3
+import threading
+from typing import Optional
+
+def connect(path: str, row_factory: Optional[type] = None) -> sqlite3.Connection:
+    """Open a WAL-mode autocommit connection to a SQLite database"""
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    if row_factory is not None:
+        conn.row_factory = row_factory
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+class ThreadLocalConnections:
+    """One connection per thread to a SQLite database (its directory is created if needed)"""
+    
+    def __init__(self, path: str, row_factory: Optional[type] = None):
+        self.path = path
+        self.row_factory = row_factory
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+    
+    def get(self) -> sqlite3.Connection:
+        """Get the calling thread's connection"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = connect(self.path, self.row_factory)
+            self._local.conn = conn
+        return conn
@@ -0,0 +1,137 @@
+"""
+Tokenizer helpers for StudyBuddy
+
+Token counts follow the embedding model's tokenizer (tiktoken). If the
+encoding can't be loaded (e.g. offline without a tiktoken cache) counts
+fall back to a conservative estimate from the UTF-8 length.
+
+Token counts are memoized (settings.tokenizer_cache_size texts), so a chunk
+counted while batching embeddings is not re-tokenized when its payload is
+written or when it is packed into a prompt.
+"""
+from typing import Any, Callable, Dict, List, Optional
+from functools import lru_cache
+import logging
+import numpy as np
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# Rough bytes-per-token used when tiktoken is unavailable
+_FALLBACK_BYTES_PER_TOKEN = 3
+
+_encoding = None
+_encoding_loaded = False
+
+def get_encoding():
+    """Get the tiktoken encoding (None if it can't be loaded)"""
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(settings.tokenizer_encoding)
+        except Exception as e:
+            logger.warning(f"Tokenizer unavailable, estimating token counts: {e}")
+            _encoding = None
+    return _encoding
+
+@lru_cache(maxsize=settings.tokenizer_cache_size)
+def count_tokens(text: str) -> int:
+    """Number of tokens in text (memoized)"""
+    encoding = get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return -(-len(text.encode("utf-8")) // _FALLBACK_BYTES_PER_TOKEN)
+
+def split_by_tokens(text: str, max_tokens: int) -> List[str]:
+    """
+    Deterministically split text into consecutive pieces of at most max_tokens
+    
+    Args:
+        text: Text to split
+        max_tokens: Maximum tokens per piece
+    
+    Returns:
+        List of text pieces (a single piece if text already fits)
+    """
+    encoding = get_encoding()
+    if encoding is not None:
+        tokens = encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return [text]
+        return [
+            encoding.decode(tokens[i:i + max_tokens])
+            for i in range(0, len(tokens), max_tokens)
+        ]
+    
+    max_chars = max_tokens * _FALLBACK_BYTES_PER_TOKEN // 4  # worst case 4 bytes per char
+    if len(text.encode("utf-8")) <= max_tokens * _FALLBACK_BYTES_PER_TOKEN:
+        return [text]
+    return [text[i:i + max_chars] for i in range(0, len(text), max_chars)]
+
+def token_offsets(text: str) -> List[int]:
+    """
+    Character offset at which each token of text starts
+    
+    Without tiktoken, a token is assumed to start every
+    _FALLBACK_BYTES_PER_TOKEN UTF-8 bytes, matching count_tokens.
+    
+    Args:
+        text: Text to tokenize
+    
+    Returns:
+        Sorted list with one offset per token
+    """
+    if not text:
+        return []
+    
+    encoding = get_encoding()
+    if encoding is not None:
+        _, offsets = encoding.decode_with_offsets(encoding.encode(text, disallowed_special=()))
+        return offsets
+    
+    if text.isascii():
+        return list(range(0, len(text), _FALLBACK_BYTES_PER_TOKEN))
+    codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+    char_bytes = 1 + (codes >= 0x80) + (codes >= 0x800) + (codes >= 0x10000)
+    bytes_before = np.cumsum(char_bytes) - char_bytes
+    token_index = bytes_before // _FALLBACK_BYTES_PER_TOKEN
+    starts = np.flatnonzero(np.diff(token_index, prepend=-1))
+    return starts.tolist()
+
+def chunk_token_count(chunk: Dict[str, Any]) -> int:
+    """Stored token count of a chunk (counted from its text for older points)"""
+    token_count = chunk.get("token_count")
+    if token_count is None:
+        token_count = count_tokens(chunk.get("text", ""))
+    return token_count
+
+def pack_chunks(chunks: List[Dict[str, Any]], max_tokens: int,
+                header: Optional[Callable[[Dict[str, Any]], str]] = None) -> List[Dict[str, Any]]:
+    """
+    Select the chunks that fit a prompt token budget, in rank order
+    
+    Chunks that don't fit are skipped so a smaller lower-ranked chunk can
+    still use the remaining budget.
+    
+    Args:
+        chunks: Ranked context chunks
+        max_tokens: Token budget for the context section of the prompt
+        header: Source line printed above each chunk, counted against the budget
+    
+    Returns:
+        Chunks to include in the prompt
+    """
+    packed = []
+    used = 0
+    for chunk in chunks:
+        # Each chunk is joined with a blank line and its header on its own line
+        tokens = chunk_token_count(chunk) + 2
+        if header is not None:
+            tokens += count_tokens(header(chunk))
+        if used + tokens > max_tokens:
+            continue
+        packed.append(chunk)
+        used += tokens
+    return packed
@@ -0,0 +1,469 @@
+"""
+Vector store interface and in-process backend for StudyBuddy
+
+The API talks to a VectorStore: either the Qdrant server (AsyncQdrantDB in
+db.py) or LocalVectorStore, an embedded index for single-node deployments,
+tests and benchmarks that needs no external service.
+"""
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import uuid
+import numpy as np
+from .embedding_backends import get_embedding_dimension
+from .tokenizer import chunk_token_count
+
+logger = logging.getLogger(__name__)
+
+# Namespace for deterministic point IDs (uuid5 of doc_id and chunk_id)
+POINT_ID_NAMESPACE = uuid.UUID("6f1c2a4e-8d3b-5e7f-9a1c-2b4d6e8f0a1c")
+
+# Matches below this cosine similarity are dropped
+SCORE_THRESHOLD = 0.1
+
+def point_id(doc_id: str, chunk_id: str) -> str:
+    """Stable point ID for a chunk of a document"""
+    return str(uuid.uuid5(POINT_ID_NAMESPACE, f"{doc_id}/{chunk_id}"))
+
+def chunk_hash(chunk: Dict[str, Any]) -> str:
+    """Hash of everything a chunk stores, to detect changed chunks on re-ingest"""
+    content = {
+        key: chunk.get(key)
+        for key in ("text", "page", "type", "filename", "metadata")
+    }
+    encoded = json.dumps(content, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+def chunk_payload(chunk: Dict[str, Any], doc_id: str, index: int) -> Tuple[str, Dict[str, Any]]:
+    """Point ID and stored payload for the index-th chunk of a document"""
+    chunk_id = chunk.get("chunk_id", f"{doc_id}_chunk_{index}")
+    payload = {
+        "doc_id": doc_id,
+        "filename": chunk.get("filename"),
+        "chunk_id": chunk_id,
+        "content_hash": chunk_hash(chunk),
+        "text": chunk.get("text", ""),
+        "token_count": chunk_token_count(chunk),
+        "page": chunk.get("page", None),
+        "metadata": chunk.get("metadata", {}),
+        "type": chunk.get("type", "text"),
+        "canonical_id": chunk.get("canonical_id")
+    }
+    return point_id(doc_id, chunk_id), payload
+
+def payload_to_chunk(point_id: Any, score: float, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert a stored point into the chunk dict used by the agents"""
+    return {
+        "id": point_id,
+        "score": score,
+        "text": payload.get("text", ""),
+        "token_count": payload.get("token_count"),
+        "page": payload.get("page"),
+        "chunk_id": payload.get("chunk_id"),
+        "filename": payload.get("filename"),
+        "metadata": payload.get("metadata", {}),
+        "type": payload.get("type", "text"),
+        "canonical_id": payload.get("canonical_id")
+    }
+
+def collapse_duplicates(chunks: List[Dict[str, Any]], top_k: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Keep the best-ranked chunk of each duplicate group
+    
+    Points linked to a canonical point (canonical_id, set by corpus dedupe)
+    share a vector with it, so without collapsing they take several of the
+    top-k slots with the same content.
+    """
+    seen = set()
+    collapsed = []
+    for chunk in chunks:
+        group = chunk.get("canonical_id") or chunk["id"]
+        if group in seen:
+            continue
+        seen.add(group)
+        collapsed.append(chunk)
+    return collapsed if top_k is None else collapsed[:top_k]
+
+def reciprocal_rank_fusion(result_lists: List[List[Dict[str, Any]]], k: int = 60,
+                           top_k: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Fuse ranked result lists with reciprocal rank fusion
+    
+    Each chunk scores sum(1 / (k + rank)) over the lists it appears in. The
+    fused list is ordered by that score (kept as "rrf_score"); "score" stays
+    the chunk's best similarity in any list.
+    
+    Args:
+        result_lists: Ranked chunk lists, one per query
+        k: RRF damping constant (60 in the original paper)
+        top_k: Number of fused results to return (all if None)
+    
+    Returns:
+        Fused list of chunks
+    """
+    fused: Dict[Any, Dict[str, Any]] = {}
+    for results in result_lists:
+        for rank, chunk in enumerate(results, 1):
+            entry = fused.get(chunk["id"])
+            if entry is None:
+                entry = fused[chunk["id"]] = dict(chunk, rrf_score=0.0)
+            entry["rrf_score"] += 1.0 / (k + rank)
+            entry["score"] = max(entry["score"], chunk["score"])
+    
+    ranked = sorted(fused.values(), key=lambda chunk: chunk["rrf_score"], reverse=True)
+    return ranked if top_k is None else ranked[:top_k]
+
+class VectorStore:
+    """Async interface shared by the vector store backends"""
+    
+    collection_name: str = ""
+    vector_size: int = 0
+    
+    async def add_chunks(self, chunks: List[Dict[str, Any]], embeddings: np.ndarray, doc_id: str):
+        """Upsert document chunks with one embedding row per chunk"""
+        raise NotImplementedError
+    
+    async def query_chunks(self, query_embedding: np.ndarray, doc_id: Optional[str] = None,
+                           top_k: int = 5) -> List[Dict[str, Any]]:
+        """Most similar chunks, optionally restricted to one document"""
+        raise NotImplementedError
+    
+    async def query_chunks_batch(self, query_embeddings: np.ndarray, doc_id: Optional[str] = None,
+                                 top_k: int = 5) -> List[List[Dict[str, Any]]]:
+        """query_chunks for each row of a query matrix, in one round trip"""
+        raise NotImplementedError
+    
+    async def delete_document(self, doc_id: str):
+        """Delete all chunks for a document"""
+        raise NotImplementedError
+    
+    async def get_chunk_hashes(self, doc_id: str) -> Dict[str, str]:
+        """Mapping of point ID to content hash for a document's chunks"""
+        raise NotImplementedError
+    
+    async def delete_points(self, point_ids: List[str]):
+        """Delete points by ID"""
+        raise NotImplementedError
+    
+    async def get_vectors(self, point_ids: List[str]) -> Dict[str, np.ndarray]:
+        """Stored vectors by point ID (missing points are left out)"""
+        raise NotImplementedError
+    
+    async def ping(self):
+        """Raise if the store is unavailable"""
+        raise NotImplementedError
+
+    async def count_points(self) -> int:
+        """Number of stored points"""
+        raise NotImplementedError
+    
+    async def scroll_points(self, batch_size: int = 1000):
+        """
+        Iterate over all points
+        
+        Yields:
+            (point IDs, float32 vector matrix, payloads) per batch
+        """
+        raise NotImplementedError
+        yield
+    
+    async def import_points(self, point_ids: List[str], vectors: np.ndarray, payloads: List[Dict[str, Any]]):
+        """Bulk upsert points exported by scroll_points"""
+        raise NotImplementedError
+
+class LocalVectorStore(VectorStore):
+    """
+    In-process vector index
+    
+    L2-normalized float32 vectors live in a memory-mapped matrix file and
+    payloads in SQLite next to it, so the index survives restarts. Search is
+    an exact cosine scan (one matrix-vector product) with argpartition top-k.
+    The index is owned by a single process; run one worker with this backend.
+    """
+    
+    MIN_CAPACITY = 1024
+    
+    def __init__(self, path: str, vector_size: Optional[int] = None, collection_name: str = "local"):
+        self.path = path
+        self.collection_name = collection_name
+        self.vector_size = vector_size or get_embedding_dimension()
+        self._lock = threading.RLock()
+        self._matrix_path = os.path.join(path, "vectors.f32")
+        os.makedirs(path, exist_ok=True)
+        
+        # One connection guarded by _lock
+        self._conn = sqlite3.connect(
+            os.path.join(path, "points.sqlite3"), timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS points (
+                row INTEGER PRIMARY KEY,
+                point_id TEXT UNIQUE NOT NULL,
+                doc_id TEXT NOT NULL,
+                payload TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_points_doc_id ON points(doc_id);
+            CREATE TABLE IF NOT EXISTS meta (
+                name TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+        """)
+        self._check_dimension()
+        self._load()
+    
+    def _check_dimension(self):
+        """Refuse to open an index built for another vector size"""
+        row = self._conn.execute("SELECT value FROM meta WHERE name = 'dimension'").fetchone()
+        if row is None:
+            self._conn.execute("INSERT INTO meta(name, value) VALUES ('dimension', ?)", (str(self.vector_size),))
+        elif int(row[0]) != self.vector_size:
+            raise ValueError(
+                f"Local vector store at {self.path} has vector size {row[0]} but the "
+                f"embedding backend produces {self.vector_size}; use another LOCAL_VECTOR_STORE_PATH"
+            )
+    
+    def _load(self):
+        """Rebuild the in-memory payload and doc_id maps from SQLite"""
+        self._payloads: Dict[int, Dict[str, Any]] = {}
+        self._point_ids: Dict[int, str] = {}
+        self._rows_by_id: Dict[str, int] = {}
+        self._doc_rows: Dict[str, set] = defaultdict(set)
+        
+        rows = self._conn.execute("SELECT row, point_id, doc_id, payload FROM points").fetchall()
+        self._size = max((row for row, _, _, _ in rows), default=-1) + 1
+        self._open_matrix(max(self.MIN_CAPACITY, self._size))
+        self._alive = np.zeros(self._capacity, dtype=bool)
+        
+        for row, pid, doc_id, payload in rows:
+            self._payloads[row] = json.loads(payload)
+            self._point_ids[row] = pid
+            self._rows_by_id[pid] = row
+            self._doc_rows[doc_id].add(row)
+            self._alive[row] = True
+        self._free = [row for row in range(self._size) if not self._alive[row]]
+        
+        logger.info(f"Loaded local vector store {self.path} ({len(rows)} points)")
+    
+    def _open_matrix(self, capacity: int):
+        """Map the vector file with room for at least capacity rows"""
+        row_bytes = self.vector_size * 4
+        existing = os.path.getsize(self._matrix_path) // row_bytes if os.path.exists(self._matrix_path) else 0
+        capacity = max(capacity, existing)
+        with open(self._matrix_path, "ab") as f:
+            f.truncate(capacity * row_bytes)
+        self._matrix = np.memmap(self._matrix_path, dtype=np.float32, mode="r+",
+                                 shape=(capacity, self.vector_size))
+        self._capacity = capacity
+    
+    def _reserve(self, rows: int):
+        """Grow the matrix (doubling) so that rows fit"""
+        if rows <= self._capacity:
+            return
+        self._matrix.flush()
+        del self._matrix
+        old_capacity = self._capacity
+        self._open_matrix(max(rows, old_capacity * 2))
+        self._alive = np.concatenate([self._alive, np.zeros(self._capacity - old_capacity, dtype=bool)])
+    
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        vectors = np.array(vectors, dtype=np.float32, ndmin=2)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+    
+    def add_chunks_sync(self, chunks: List[Dict[str, Any]], embeddings: np.ndarray, doc_id: str) -> bool:
+        if len(chunks) != len(embeddings):
+            raise ValueError(f"Got {len(embeddings)} embeddings for {len(chunks)} chunks")
+        
+        points = [chunk_payload(chunk, doc_id, i) for i, chunk in enumerate(chunks)]
+        self._write_points([pid for pid, _ in points], embeddings, [payload for _, payload in points])
+        
+        logger.info(f"Added {len(points)} chunks for document {doc_id}")
+        return True
+    
+    def import_points_sync(self, point_ids: List[str], vectors: np.ndarray, payloads: List[Dict[str, Any]]):
+        self._write_points(point_ids, vectors, payloads)
+    
+    def _write_points(self, point_ids: List[str], vectors: np.ndarray, payloads: List[Dict[str, Any]]):
+        """Upsert points by ID"""
+        vectors = self._normalize(vectors)
+        
+        with self._lock:
+            records = []
+            new_points = []
+            for pid, payload in zip(point_ids, payloads):
+                row = self._rows_by_id.get(pid)
+                if row is None:
+                    if self._free:
+                        row = self._free.pop()
+                    else:
+                        row = self._size
+                        self._size += 1
+                    self._rows_by_id[pid] = row
+                    new_points.append((pid, row))
+                records.append((row, pid, payload["doc_id"], payload))
+            
+            try:
+                # Vectors hit the file before their rows are committed
+                self._reserve(self._size)
+                if records:
+                    self._matrix[np.asarray([record[0] for record in records])] = vectors
+                    self._matrix.flush()
+                
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO points(row, point_id, doc_id, payload) VALUES (?, ?, ?, ?)",
+                        [(row, pid, doc, json.dumps(payload)) for row, pid, doc, payload in records]
+                    )
+                    self._conn.execute("COMMIT")
+                except Exception:
+                    self._conn.execute("ROLLBACK")
+                    raise
+            except Exception:
+                # Give back the rows reserved for new points
+                for pid, row in new_points:
+                    del self._rows_by_id[pid]
+                    self._free.append(row)
+                raise
+            
+            for row, pid, doc, payload in records:
+                self._payloads[row] = payload
+                self._point_ids[row] = pid
+                self._doc_rows[doc].add(row)
+                self._alive[row] = True
+    
+    def query_chunks_sync(self, query_embedding: np.ndarray, doc_id: Optional[str] = None,
+                          top_k: int = 5) -> List[Dict[str, Any]]:
+        return self.query_chunks_batch_sync(query_embedding, doc_id, top_k)[0]
+    
+    def query_chunks_batch_sync(self, query_embeddings: np.ndarray, doc_id: Optional[str] = None,
+                                top_k: int = 5) -> List[List[Dict[str, Any]]]:
+        queries = self._normalize(query_embeddings)
+        
+        with self._lock:
+            if doc_id:
+                rows = np.fromiter(self._doc_rows.get(doc_id, ()), dtype=np.int64)
+                scores = self._matrix[rows] @ queries.T
+            else:
+                rows = np.flatnonzero(self._alive[:self._size])
+                scores = np.asarray(self._matrix[:self._size] @ queries.T)[rows]
+            
+            return [self._top_k(rows, scores[:, i], top_k) for i in range(len(queries))]
+            
+    def _top_k(self, rows: np.ndarray, scores: np.ndarray, top_k: int) -> List[Dict[str, Any]]:
+        """Best rows above the score threshold as chunks (caller holds _lock)"""
+        keep = scores >= SCORE_THRESHOLD
+        rows, scores = rows[keep], scores[keep]
+        k = min(top_k, rows.size)
+        if k == 0:
+            return []
+        
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            payload_to_chunk(self._point_ids[row], float(score), self._payloads[row])
+            for row, score in zip(rows[top].tolist(), scores[top].tolist())
+        ]
+    
+    def _remove_rows(self, rows: List[int]):
+        """Free rows and drop their payloads (caller holds _lock)"""
+        for row in rows:
+            pid = self._point_ids.pop(row)
+            payload = self._payloads.pop(row)
+            del self._rows_by_id[pid]
+            self._doc_rows[payload["doc_id"]].discard(row)
+            if not self._doc_rows[payload["doc_id"]]:
+                del self._doc_rows[payload["doc_id"]]
+            self._alive[row] = False
+            self._free.append(row)
+    
+    def delete_document_sync(self, doc_id: str) -> bool:
+        with self._lock:
+            self._conn.execute("DELETE FROM points WHERE doc_id = ?", (doc_id,))
+            self._remove_rows(list(self._doc_rows.get(doc_id, ())))
+        logger.info(f"Deleted document {doc_id}")
+        return True
+    
+    def delete_points_sync(self, point_ids: List[str]):
+        with self._lock:
+            rows = [self._rows_by_id[pid] for pid in point_ids if pid in self._rows_by_id]
+            self._conn.executemany("DELETE FROM points WHERE row = ?", [(row,) for row in rows])
+            self._remove_rows(rows)
+    
+    def get_chunk_hashes_sync(self, doc_id: str) -> Dict[str, str]:
+        with self._lock:
+            return {
+                self._point_ids[row]: self._payloads[row].get("content_hash")
+                for row in self._doc_rows.get(doc_id, ())
+            }
+    
+    def get_vectors_sync(self, point_ids: List[str]) -> Dict[str, np.ndarray]:
+        with self._lock:
+            return {
+                pid: np.array(self._matrix[self._rows_by_id[pid]])
+                for pid in point_ids if pid in self._rows_by_id
+            }
+    
+    def count(self) -> int:
+        """Number of stored points"""
+        return len(self._rows_by_id)
+    
+    def _point_batch(self, rows: List[int]):
+        """(point IDs, vectors, payloads) for the rows that still exist"""
+        with self._lock:
+            rows = [row for row in rows if row in self._point_ids]
+            return (
+                [self._point_ids[row] for row in rows],
+                np.array(self._matrix[np.asarray(rows)]),
+                [self._payloads[row] for row in rows]
+            )
+    
+    async def add_chunks(self, chunks: List[Dict[str, Any]], embeddings: np.ndarray, doc_id: str):
+        return await asyncio.to_thread(self.add_chunks_sync, chunks, embeddings, doc_id)
+    
+    async def query_chunks(self, query_embedding: np.ndarray, doc_id: Optional[str] = None,
+                           top_k: int = 5) -> List[Dict[str, Any]]:
+        return await asyncio.to_thread(self.query_chunks_sync, query_embedding, doc_id, top_k)
+    
+    async def query_chunks_batch(self, query_embeddings: np.ndarray, doc_id: Optional[str] = None,
+                                 top_k: int = 5) -> List[List[Dict[str, Any]]]:
+        return await asyncio.to_thread(self.query_chunks_batch_sync, query_embeddings, doc_id, top_k)
+    
+    async def delete_document(self, doc_id: str):
+        return await asyncio.to_thread(self.delete_document_sync, doc_id)
+    
+    async def get_chunk_hashes(self, doc_id: str) -> Dict[str, str]:
+        return self.get_chunk_hashes_sync(doc_id)
+    
+    async def delete_points(self, point_ids: List[str]):
+        if point_ids:
+            await asyncio.to_thread(self.delete_points_sync, point_ids)
+    
+    async def get_vectors(self, point_ids: List[str]) -> Dict[str, np.ndarray]:
+        return self.get_vectors_sync(point_ids)
+    
+    async def ping(self):
+        self._conn.execute("SELECT 1")
+
+    async def count_points(self) -> int:
+        return self.count()
+    
+    async def scroll_points(self, batch_size: int = 1000):
+        with self._lock:
+            rows = sorted(self._point_ids)
+        for start in range(0, len(rows), batch_size):
+            point_ids, vectors, payloads = await asyncio.to_thread(self._point_batch, rows[start:start + batch_size])
+            if point_ids:
+                yield point_ids, vectors, payloads
+    
+    async def import_points(self, point_ids: List[str], vectors: np.ndarray, payloads: List[Dict[str, Any]]):
+        await asyncio.to_thread(self.import_points_sync, point_ids, vectors, payloads)
@@ -1,10 +1,18 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from .api.routes_docs import router as docs_router
 from .api.routes_chat import router as chat_router
 from .api.routes_plan import router as plan_router
 from .api.routes_flashcards import router as flashcards_router
+from .api.routes_admin import router as admin_router
+from .core.config import settings
+from .core.embedding_cache import flush_embedding_cache
 from .core.logger import setup_logging
+from .services.ingestion_service import get_ingestion_workers
+from .services.pdf_service import shutdown_pdf_executor
+from .services.registry_migration import backfill_registry
+import logging
 import os
 
 # Setup logging
@@ -21,6 +29,21 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Multipart framing around the file in an upload request
+UPLOAD_OVERHEAD_BYTES = 64 * 1024
+
+@app.middleware("http")
+async def reject_oversized_uploads(request: Request, call_next):
+    """Reject uploads by Content-Length before the body is received"""
+    content_length = request.headers.get("content-length")
+    if (request.url.path.startswith("/api/upload") and content_length and content_length.isdigit()
+            and int(content_length) > settings.max_file_size + UPLOAD_OVERHEAD_BYTES):
+        return JSONResponse(
+            status_code=413,
+            content={"detail": f"File exceeds the maximum upload size of {settings.max_file_size // (1024 * 1024)} MB"}
+        )
+    return await call_next(request)
+
 # Create storage directory if it doesn't exist
 os.makedirs("storage", exist_ok=True)
 os.makedirs("data", exist_ok=True)  # For flashcards
@@ -30,6 +53,23 @@ app.include_router(docs_router, prefix="/api")
 app.include_router(chat_router, prefix="/api")
 app.include_router(plan_router, prefix="/api/plan")
 app.include_router(flashcards_router, prefix="/api")
+app.include_router(admin_router, prefix="/api")
+
+@app.on_event("startup")
+async def start_ingestion_workers():
+    # Registers documents ingested before the registry existed (once; retried on the next start if the store is down)
+    try:
+        await backfill_registry()
+    except Exception as e:
+        logging.getLogger(__name__).warning(f"Document registry backfill failed: {e}")
+    # Resumes jobs queued or interrupted before the last shutdown
+    await get_ingestion_workers().start()
+
+@app.on_event("shutdown")
+async def stop_workers():
+    await get_ingestion_workers().stop()
+    shutdown_pdf_executor()
+    flush_embedding_cache()
 
 @app.get("/ping")
 async def ping():
@@ -0,0 +1,528 @@
+"""
+Document ingestion for StudyBuddy
+
+Uploads are processed by a pool of ingestion workers that take jobs from
+the durable job queue (see core/job_queue.py). A job extracts and chunks
+the stored upload, then embeds and upserts the chunks in bounded batches;
+its state (queued, extracting, embedding, upserting, done or failed) is
+kept in the queue and the outcome in the document registry.
+"""
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from itertools import islice
+import asyncio
+import logging
+import os
+import time
+import numpy as np
+import pandas as pd
+
+from ..core.config import settings
+from ..core.db import vector_store
+from ..core.vector_store import point_id, chunk_hash
+from ..core.embeddings import get_embeddings_service
+from ..core.document_registry import get_document_registry
+from ..core.dedupe import SCOPE_CORPUS, get_dedupe_index
+from ..core.job_queue import (
+    JOB_EMBEDDING, JOB_FAILED, JOB_UPSERTING, DocumentDeletedError, JobQueue, PermanentJobError, get_job_queue
+)
+from ..agents.chunker import split_text, iter_split_text, pack_pages, should_pack_pages
+from .pdf_service import clean_pdf_pages, extract_pdf_pages
+
+logger = logging.getLogger(__name__)
+
+async def process_and_store_chunks(chunks: Iterable[Dict[str, Any]], doc_id: str, filename: str,
+                                   metadata: Optional[Dict[str, Any]] = None,
+                                   on_stage: Optional[Callable[[str], Any]] = None) -> Dict[str, Any]:
+    """
+    Embed and store document chunks
+    
+    Chunks may be a list or a lazy iterator (streamed uploads); they are
+    pulled, embedded and upserted settings.ingest_batch_size at a time, so
+    memory stays bounded by the batch, not the document.
+    
+    Ingestion is incremental: chunks whose content hash matches the stored
+    point are skipped, only new or changed chunks are embedded and upserted,
+    and points of chunks that no longer exist are deleted. A completed
+    ingestion is recorded in the document registry with its stage timings;
+    errors are raised to the caller (the ingestion job), which retries or
+    fails the document. DocumentDeletedError is raised when the document
+    leaves the registry before a batch or by the end of the ingestion.
+    
+    Args:
+        chunks: Chunk dicts with chunk_id and text
+        doc_id: Document the chunks belong to
+        filename: Original upload filename
+        metadata: Extra registry metadata recorded on completion (e.g. page count)
+        on_stage: Called with embedding / upserting as ingestion moves between stages
+    
+    Returns:
+        Summary with the stored, changed, duplicate, linked and stale chunk counts and timings
+    """
+    registry = get_document_registry()
+    dedupe = get_dedupe_index()
+    timings = {"dedupe_seconds": 0.0, "diff_seconds": 0.0, "embed_seconds": 0.0, "upsert_seconds": 0.0}
+    started = time.perf_counter()
+    current_stage = None
+    
+    async def enter_stage(name: str):
+        nonlocal current_stage
+        if on_stage is not None and name != current_stage:
+            current_stage = name
+            await asyncio.to_thread(on_stage, name)
+    
+    try:
+        # The document's dedupe entries are rebuilt from this ingestion
+        deduper = None
+        if dedupe is not None:
+            await asyncio.to_thread(dedupe.delete_document, doc_id)
+            deduper = dedupe.document_deduper(doc_id)
+        
+        # What is already stored for this document; seen points are removed, the rest are stale
+        stage = time.perf_counter()
+        stored = await vector_store.get_chunk_hashes(doc_id)
+        timings["diff_seconds"] += time.perf_counter() - stage
+        
+        embeddings_service = get_embeddings_service()
+        chunk_iterator = iter(chunks)
+        total = 0
+        changed_total = 0
+        duplicates = 0
+        linked = 0
+        
+        while True:
+            # Pulling from a lazy iterator reads and chunks the file; keep it off the event loop
+            batch = await asyncio.to_thread(list, islice(chunk_iterator, settings.ingest_batch_size))
+            if not batch:
+                break
+            if await asyncio.to_thread(registry.get, doc_id) is None:
+                raise DocumentDeletedError("Document was deleted during ingestion")
+            
+            # Only chunks with text are embedded and stored
+            batch = [chunk for chunk in batch if chunk.get("text")]
+            
+            # Add metadata to chunks
+            for i, chunk in enumerate(batch, total):
+                chunk.setdefault("chunk_id", f"{doc_id}_chunk_{i}")
+                chunk["doc_id"] = doc_id
+                chunk["filename"] = filename
+            total += len(batch)
+            
+            # Drop near-duplicates of earlier chunks of this document before anything is embedded
+            signatures = {}
+            if deduper is not None:
+                stage = time.perf_counter()
+                kept, kept_signatures = await asyncio.to_thread(deduper.filter, batch)
+                duplicates += len(batch) - len(kept)
+                batch = kept
+                signatures = {chunk["chunk_id"]: signature for chunk, signature in zip(batch, kept_signatures)}
+                timings["dedupe_seconds"] += time.perf_counter() - stage
+            
+            # Diff against what is stored (dropped duplicates stay in stored and are deleted as stale)
+            stage = time.perf_counter()
+            changed = []
+            for chunk in batch:
+                if stored.pop(point_id(doc_id, chunk["chunk_id"]), None) != chunk_hash(chunk):
+                    changed.append(chunk)
+            timings["diff_seconds"] += time.perf_counter() - stage
+            
+            if changed:
+                # Duplicates of other documents' chunks reuse the stored vector
+                canonical_vectors = {}
+                if dedupe is not None and settings.dedupe_scope == SCOPE_CORPUS:
+                    stage = time.perf_counter()
+                    links = await asyncio.to_thread(dedupe.link_duplicates, changed, signatures, doc_id)
+                    canonical_vectors = await vector_store.get_vectors(sorted(set(links.values())))
+                    for chunk in changed:
+                        if links.get(chunk["chunk_id"]) in canonical_vectors:
+                            chunk["canonical_id"] = links[chunk["chunk_id"]]
+                    timings["dedupe_seconds"] += time.perf_counter() - stage
+                
+                # Generate embeddings (batches are sent concurrently)
+                await enter_stage(JOB_EMBEDDING)
+                stage = time.perf_counter()
+                to_embed = [chunk["text"] for chunk in changed if not chunk.get("canonical_id")]
+                embedded = iter(await embeddings_service.aembed_texts(to_embed) if to_embed else [])
+                embeddings = np.asarray([
+                    canonical_vectors[chunk["canonical_id"]] if chunk.get("canonical_id") else next(embedded)
+                    for chunk in changed
+                ], dtype=np.float32)
+                linked += len(changed) - len(to_embed)
+                timings["embed_seconds"] += time.perf_counter() - stage
+                
+                # Store in vector database
+                await enter_stage(JOB_UPSERTING)
+                stage = time.perf_counter()
+                await vector_store.add_chunks(chunks=changed, embeddings=embeddings, doc_id=doc_id)
+                timings["upsert_seconds"] += time.perf_counter() - stage
+                changed_total += len(changed)
+        
+        if not total:
+            logger.warning(f"No text found in chunks for document {doc_id}")
+            raise PermanentJobError("No text found in document")
+        
+        stale = list(stored)
+        await enter_stage(JOB_UPSERTING)
+        await vector_store.delete_points(stale)
+        
+        stored_total = total - duplicates
+        logger.info(
+            f"Document {doc_id}: {changed_total} new or changed ({linked} linked to duplicates), "
+            f"{stored_total - changed_total} unchanged, {duplicates} duplicates dropped, {len(stale)} stale chunks"
+        )
+        
+        timings = {name: round(seconds, 3) for name, seconds in timings.items()}
+        timings["total_seconds"] = round(time.perf_counter() - started, 3)
+        await asyncio.to_thread(
+            registry.mark_completed,
+            doc_id,
+            chunk_count=stored_total,
+            timings=timings,
+            metadata={**(metadata or {}), "duplicate_chunks": duplicates, "linked_chunks": linked}
+        )
+        # Deleted while the last batch was stored: nothing may keep its points searchable
+        if await asyncio.to_thread(registry.get, doc_id) is None:
+            raise DocumentDeletedError("Document was deleted during ingestion")
+        logger.info(f"Successfully stored {stored_total} chunks for document {doc_id}")
+        return {
+            "chunk_count": stored_total,
+            "changed_chunks": changed_total,
+            "duplicate_chunks": duplicates,
+            "linked_chunks": linked,
+            "stale_chunks": len(stale),
+            "timings": timings
+        }
+    
+    except Exception as e:
+        logger.error(f"Error processing chunks for document {doc_id}: {e}")
+        raise
+
+def iter_text_file_chunks(file_path: str, doc_id: str, filename: str) -> Iterator[Dict[str, Any]]:
+    """Lazily read and chunk a stored text upload into chunk dicts"""
+    with open(file_path, "rb") as f:
+        for i, chunk in enumerate(iter_split_text(f)):
+            yield {
+                "chunk_id": f"{doc_id}_chunk_{i}",
+                "text": chunk,
+                "type": "text",
+                "metadata": {
+                    "source_file": filename,
+                    "chunk_index": i
+                }
+            }
+
+async def build_pdf_chunks(file_path: str, doc_id: str, filename: str) -> Tuple[List[Dict[str, Any]], Dict[str, Any], List[Dict[str, Any]]]:
+    """
+    Extract, clean and chunk a stored PDF upload
+    
+    Returns:
+        (chunks, registry metadata with page count, cleanup and extraction stats, per-page summaries)
+    """
+    # Extract pages in parallel in the PDF process pool (PyMuPDF, pdfplumber fallback)
+    extracted, extraction = await extract_pdf_pages(file_path)
+    raw_pages = [page["text"] for page in extracted]
+    
+    # Normalize whitespace and strip repeated headers, footers and page numbers
+    page_texts, cleanup = await asyncio.to_thread(clean_pdf_pages, raw_pages)
+    
+    all_chunks = await asyncio.to_thread(_pdf_page_chunks, page_texts, doc_id, filename)
+    
+    # Chunks covering each page
+    chunks_per_page = [0] * len(page_texts)
+    for chunk in all_chunks:
+        metadata = chunk["metadata"]
+        for page_num in range(metadata.get("page_start", chunk["page"]), metadata.get("page_end", chunk["page"]) + 1):
+            chunks_per_page[page_num - 1] += 1
+    
+    pages_data = []
+    for page_num, text in enumerate(page_texts, 1):
+        # Create page summary for the job result
+        sample_text = text[:200] + "..." if len(text) > 200 else text
+        pages_data.append({
+            "page": page_num,
+            "sample_text": sample_text,
+            "char_count": len(text),
+            "chunks_count": chunks_per_page[page_num - 1],
+            "extractor": extracted[page_num - 1]["extractor"],
+            "extract_seconds": extracted[page_num - 1]["seconds"]
+        })
+    
+    logger.info(
+        f"Cleaned {filename}: removed {cleanup['chars_removed']} characters, "
+        f"{cleanup['tokens_removed']} tokens ({cleanup['reduction_percent']}%)"
+    )
+    return all_chunks, {"total_pages": len(pages_data), "cleanup": cleanup, "extraction": extraction}, pages_data
+
+def _pdf_page_chunks(page_texts: List[str], doc_id: str, filename: str) -> List[Dict[str, Any]]:
+    """Chunk cleaned PDF pages, packed across pages or page by page"""
+    all_chunks = []
+    if should_pack_pages(page_texts):
+        # Chunk across page boundaries; each chunk records the page range it spans.
+        # IDs and metadata come from where the chunk starts, not its position in the
+        # document, so chunks of unchanged pages keep their ID and hash on re-ingest
+        for packed in pack_pages(page_texts):
+            all_chunks.append({
+                "chunk_id": f"{doc_id}_packed_p{packed['page_start']}_{packed['start_offset']}",
+                "text": packed["text"],
+                "page": packed["page_start"],
+                "type": "pdf_text",
+                "metadata": {
+                    "source_file": filename,
+                    "page_number": packed["page_start"],
+                    "page_start": packed["page_start"],
+                    "page_end": packed["page_end"],
+                    "start_offset": packed["start_offset"],
+                    "end_offset": packed["end_offset"]
+                }
+            })
+    else:
+        for page_num, text in enumerate(page_texts, 1):
+            if text.strip():  # Only process pages with text
+                # Chunk the page text
+                page_chunks = split_text(text)
+                
+                # Add page metadata to chunks
+                for i, chunk in enumerate(page_chunks):
+                    chunk_data = {
+                        "chunk_id": f"{doc_id}_page_{page_num}_chunk_{i}",
+                        "text": chunk,
+                        "page": page_num,
+                        "type": "pdf_text",
+                        "metadata": {
+                            "source_file": filename,
+                            "page_number": page_num,
+                            "chunk_index": i
+                        }
+                    }
+                    all_chunks.append(chunk_data)
+    return all_chunks
+
+def build_excel_chunks(file_path: str, doc_id: str, filename: str) -> Tuple[List[Dict[str, Any]], Dict[str, Any], List[Dict[str, Any]]]:
+    """
+    Read and chunk a stored Excel upload, one text block per sheet
+    
+    Returns:
+        (chunks, registry metadata with the sheet count, per-sheet summaries)
+    """
+    # Read Excel file
+    excel_file = pd.ExcelFile(file_path)
+    sheets_data = []
+    all_chunks = []
+    
+    for sheet_name in excel_file.sheet_names:
+        # Parse from the already-open workbook rather than re-reading the file per sheet
+        df = excel_file.parse(sheet_name)
+        
+        # Convert sheet to text for chunking
+        sheet_text = f"Sheet: {sheet_name}\n\n"
+        
+        # Add headers
+        headers = df.columns.tolist()
+        sheet_text += "Headers: " + ", ".join(headers) + "\n\n"
+        
+        # Add data rows
+        for idx, row in df.iterrows():
+            row_text = " | ".join([f"{col}: {val}" for col, val in row.items() if pd.notna(val)])
+            sheet_text += f"Row {idx + 1}: {row_text}\n"
+        
+        # Chunk the sheet text
+        sheet_chunks = split_text(sheet_text)
+        
+        # Add sheet metadata to chunks
+        for i, chunk in enumerate(sheet_chunks):
+            chunk_data = {
+                "chunk_id": f"{doc_id}_sheet_{sheet_name}_chunk_{i}",
+                "text": chunk,
+                "page": sheet_name,  # Use sheet name as "page"
+                "type": "excel_data",
+                "metadata": {
+                    "source_file": filename,
+                    "sheet_name": sheet_name,
+                    "chunk_index": i,
+                    "headers": headers,
+                    "total_rows": len(df)
+                }
+            }
+            all_chunks.append(chunk_data)
+        
+        # Get sample data for the job result
+        sample_rows = df.head(5).to_dict('records')
+        
+        sheets_data.append({
+            "sheet_name": sheet_name,
+            "headers": headers,
+            "sample_rows": sample_rows,
+            "total_rows": len(df),
+            "total_columns": len(df.columns),
+            "chunks_count": len(sheet_chunks)
+        })
+    
+    return all_chunks, {"total_sheets": len(sheets_data)}, sheets_data
+
+async def ingest_text(job: Dict[str, Any], on_stage: Callable[[str], Any]) -> Dict[str, Any]:
+    """Job handler for text uploads: the file is read and chunked lazily while batches are stored"""
+    payload = job["payload"]
+    chunks = iter_text_file_chunks(payload["file_path"], job["doc_id"], payload["filename"])
+    return await process_and_store_chunks(chunks, job["doc_id"], payload["filename"], on_stage=on_stage)
+
+async def ingest_pdf(job: Dict[str, Any], on_stage: Callable[[str], Any]) -> Dict[str, Any]:
+    """Job handler for PDF uploads"""
+    payload = job["payload"]
+    chunks, metadata, pages = await build_pdf_chunks(payload["file_path"], job["doc_id"], payload["filename"])
+    result = await process_and_store_chunks(chunks, job["doc_id"], payload["filename"],
+                                            metadata=metadata, on_stage=on_stage)
+    return {**result, **metadata, "pages": pages}
+
+async def ingest_excel(job: Dict[str, Any], on_stage: Callable[[str], Any]) -> Dict[str, Any]:
+    """Job handler for Excel uploads"""
+    payload = job["payload"]
+    chunks, metadata, sheets = await asyncio.to_thread(
+        build_excel_chunks, payload["file_path"], job["doc_id"], payload["filename"]
+    )
+    result = await process_and_store_chunks(chunks, job["doc_id"], payload["filename"],
+                                            metadata=metadata, on_stage=on_stage)
+    return {**result, **metadata, "sheets": sheets}
+
+JOB_HANDLERS = {
+    "text": ingest_text,
+    "pdf": ingest_pdf,
+    "excel": ingest_excel
+}
+
+async def run_job(queue: JobQueue, job: Dict[str, Any]):
+    """
+    Run a claimed ingestion job and record its outcome
+    
+    The job's lease is renewed while it runs. Failed attempts are retried
+    with backoff by the queue; once a job fails for good, so does its
+    document. A cancelled job (worker shutdown) is released back to the
+    queue without using up an attempt.
+    """
+    job_id, doc_id = job["job_id"], job["doc_id"]
+    registry = get_document_registry()
+    heartbeat = asyncio.create_task(_renew_lease(queue, job_id))
+    try:
+        if await asyncio.to_thread(registry.get, doc_id) is None:
+            raise DocumentDeletedError("Document was deleted before ingestion")
+        if not os.path.exists(job["payload"]["file_path"]):
+            raise PermanentJobError("Uploaded file is missing")
+        if job["kind"] not in JOB_HANDLERS:
+            raise PermanentJobError(f"Unknown job kind: {job['kind']}")
+        
+        logger.info(f"Job {job_id}: ingesting {job['kind']} document {doc_id} (attempt {job['attempts']})")
+        result = await JOB_HANDLERS[job["kind"]](job, lambda state: queue.set_state(job_id, state))
+        await asyncio.to_thread(queue.complete, job_id, result)
+        logger.info(f"Job {job_id} done: {result['chunk_count']} chunks")
+    
+    except asyncio.CancelledError:
+        await asyncio.to_thread(queue.release, job_id)
+        raise
+    
+    except DocumentDeletedError as e:
+        # Remove what the job stored after the delete request removed the document's points
+        await vector_store.delete_document(doc_id)
+        dedupe = get_dedupe_index()
+        if dedupe is not None:
+            await asyncio.to_thread(dedupe.delete_document, doc_id)
+        await asyncio.to_thread(queue.fail, job_id, str(e), False)
+        logger.info(f"Job {job_id} stopped: {e}")
+    
+    except Exception as e:
+        job = await asyncio.to_thread(queue.fail, job_id, str(e), not isinstance(e, PermanentJobError))
+        if job["state"] == JOB_FAILED:
+            logger.error(f"Job {job_id} failed after {job['attempts']} attempts: {e}")
+            await asyncio.to_thread(registry.mark_failed, doc_id, str(e))
+        else:
+            logger.warning(f"Job {job_id} attempt {job['attempts']} failed, retrying: {e}")
+    
+    finally:
+        heartbeat.cancel()
+
+async def _renew_lease(queue: JobQueue, job_id: str):
+    """Keep a running job's lease alive"""
+    while True:
+        await asyncio.sleep(queue.lease_seconds / 3)
+        await asyncio.to_thread(queue.heartbeat, job_id)
+
+def recover_expired_jobs(queue: JobQueue) -> int:
+    """Requeue jobs of workers that died; fail their documents when out of attempts"""
+    recovered = queue.requeue_expired()
+    registry = get_document_registry()
+    for job in recovered:
+        if job["state"] == JOB_FAILED and registry.get(job["doc_id"]) is not None:
+            registry.mark_failed(job["doc_id"], job["error"])
+    if recovered:
+        logger.warning(f"Recovered {len(recovered)} interrupted ingestion jobs")
+    return len(recovered)
+
+class IngestionWorkers:
+    """
+    Pool of asyncio ingestion workers sharing the job queue
+    
+    settings.ingest_workers jobs run at once per app process; the CPU-heavy
+    parts of a job run in threads and the PDF process pool, so the event
+    loop keeps serving requests.
+    """
+    
+    def __init__(self, queue: JobQueue, workers: int = 2, poll_interval: float = 1.0):
+        self.queue = queue
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._tasks: List[asyncio.Task] = []
+        self._wake: Optional[asyncio.Event] = None
+    
+    async def start(self):
+        """Recover interrupted jobs and start the workers"""
+        if self._tasks:
+            return
+        self._wake = asyncio.Event()
+        await asyncio.to_thread(recover_expired_jobs, self.queue)
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        logger.info(f"Started {self.workers} ingestion workers")
+    
+    async def stop(self):
+        """Stop the workers; running jobs go back to the queue"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+    
+    def notify(self):
+        """Wake idle workers after a job was enqueued"""
+        if self._wake is not None:
+            self._wake.set()
+    
+    async def _work(self):
+        while True:
+            # Cleared before claiming, so a job enqueued meanwhile still wakes this worker
+            self._wake.clear()
+            job = await asyncio.to_thread(self.queue.claim)
+            if job is not None:
+                await run_job(self.queue, job)
+                continue
+            
+            # Idle: pick up jobs of crashed workers, then wait for new work
+            await asyncio.to_thread(recover_expired_jobs, self.queue)
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+# Global instance - lazy loaded
+ingestion_workers = None
+
+def get_ingestion_workers() -> IngestionWorkers:
+    """Get the app's ingestion worker pool"""
+    global ingestion_workers
+    if ingestion_workers is None:
+        ingestion_workers = IngestionWorkers(
+            get_job_queue(),
+            workers=settings.ingest_workers,
+            poll_interval=settings.ingest_poll_interval
+        )
+    return ingestion_workers
+
+def enqueue_ingestion(doc_id: str, kind: str, file_path: str, filename: str) -> Dict[str, Any]:
+    """Queue a stored upload for ingestion and wake the workers"""
+    job = get_job_queue().enqueue(doc_id, kind, {"file_path": file_path, "filename": filename})
+    get_ingestion_workers().notify()
+    return job
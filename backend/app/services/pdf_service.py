@@ -1 +1,297 @@
-# PDF service
+"""
+PDF text processing for StudyBuddy
+
+Pages are extracted in a process pool, so a large PDF is parsed on all
+cores without holding the GIL or the event loop: PyMuPDF is the fast
+default extractor, and pages where it finds no usable text are re-extracted
+with pdfplumber's layout-sensitive extraction.
+
+Extracted page text is cleaned before chunking: pdfplumber's spacing
+artifacts are normalized, and running headers, footers, page numbers and
+copyright lines that repeat across pages are removed so they aren't
+embedded (and retrieved) once per page.
+"""
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import logging
+import multiprocessing
+import os
+import re
+import time
+
+from ..core.config import settings
+from ..core.tokenizer import count_tokens
+
+logger = logging.getLogger(__name__)
+
+EXTRACTOR_PYMUPDF = "pymupdf"
+EXTRACTOR_PDFPLUMBER = "pdfplumber"
+
+# PyMuPDF output with less text than this (or mostly undecodable glyphs) is re-extracted with pdfplumber
+_MIN_PAGE_CHARS = 20
+_MAX_REPLACEMENT_RATIO = 0.05
+
+_SPACE_RUN = re.compile(r"[ \t\u00a0\u2000-\u200b\u3000]+")
+_BLANK_LINES = re.compile(r"\n{3,}")
+_SPACE_BEFORE_PUNCTUATION = re.compile(r" +([,.;:!?)\]])")
+_HYPHENATED_BREAK = re.compile(r"(\w)-\n(\w)")
+_DIGITS = re.compile(r"\d+")
+
+# Running headers and footers are short; longer repeated lines are kept as content
+_MAX_BOILERPLATE_LINE = 120
+
+# "12", "- 12 -", "Page 12", "12 / 40", "Page 12 of 40"
+_PAGE_NUMBER_LINE = re.compile(r"^\W*(page|p\.|slide)?\s*\d+(\s*(/|of)\s*\d+)?\W*$", re.IGNORECASE)
+
+def normalize_whitespace(text: str) -> str:
+    """
+    Collapse pdfplumber spacing artifacts
+    
+    Runs of spaces (including non-breaking and zero-width ones) become one
+    space, lines are trimmed, words hyphenated across a line break are
+    joined, spaces before punctuation are dropped and blank line runs are
+    reduced to a single paragraph break.
+    """
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    text = _SPACE_RUN.sub(" ", text)
+    text = "\n".join(line.strip() for line in text.split("\n"))
+    text = _HYPHENATED_BREAK.sub(r"\1\2", text)
+    text = _SPACE_BEFORE_PUNCTUATION.sub(r"\1", text)
+    return _BLANK_LINES.sub("\n\n", text).strip()
+
+def _line_key(line: str) -> str:
+    """Repetition key of a line: case-folded, with numbers masked"""
+    return _DIGITS.sub("#", line.casefold())
+
+def _edge_indexes(lines: List[str], edge_lines: int) -> List[int]:
+    """Indexes of the first and last edge_lines non-empty lines of a page"""
+    filled = [i for i, line in enumerate(lines) if line]
+    return sorted(set(filled[:edge_lines] + filled[-edge_lines:]))
+
+def _page_number(line: str) -> Optional[int]:
+    """Number of a stand-alone page number line (None for other lines)"""
+    if not _PAGE_NUMBER_LINE.match(line):
+        return None
+    return int(_DIGITS.search(line).group())
+
+def strip_boilerplate(pages: List[str], edge_lines: int = 3,
+                      min_fraction: float = 0.5, min_pages: int = 3) -> Tuple[List[str], int]:
+    """
+    Remove lines repeated at the top or bottom of many pages
+    
+    A short line near a page edge is boilerplate if the same line (ignoring
+    case and numbers, so "Header 3" matches "Header 4") sits near the edge
+    of at least min_fraction of the pages, and at least min_pages of them.
+    
+    Stand-alone numbers ("12", "Page 3 of 20") are only removed as page
+    numbers when they are the first or last remaining line of a page and
+    follow the page index (or a fixed offset from it) on as many pages, so
+    numbers that are slide content are kept.
+    
+    Args:
+        pages: Normalized text of each page
+        edge_lines: Lines at the top and bottom of a page that are checked
+        min_fraction: Share of pages a line must repeat on
+        min_pages: Minimum number of pages a line must repeat on
+    
+    Returns:
+        (page texts without boilerplate, number of lines removed)
+    """
+    page_lines = [page.split("\n") for page in pages]
+    edges = [_edge_indexes(lines, edge_lines) for lines in page_lines]
+    
+    # Pages each edge line appears on (page number lines are checked against the page index instead)
+    counts = Counter()
+    for lines, indexes in zip(page_lines, edges):
+        counts.update({
+            _line_key(lines[i]) for i in indexes
+            if len(lines[i]) <= _MAX_BOILERPLATE_LINE and not _PAGE_NUMBER_LINE.match(lines[i])
+        })
+    threshold = max(min_pages, min_fraction * len(pages))
+    repeated = {key for key, count in counts.items() if count >= threshold}
+    drops = [
+        {i for i in indexes if _line_key(lines[i]) in repeated}
+        for lines, indexes in zip(page_lines, edges)
+    ]
+    
+    # Page number candidates: the first and last remaining lines, keyed by position and offset from the page index
+    candidates = []
+    offsets = Counter()
+    for page_index, (lines, drop) in enumerate(zip(page_lines, drops), 1):
+        filled = [i for i, line in enumerate(lines) if line and i not in drop]
+        found = {}
+        if filled:
+            for position, i in (("last", filled[-1]), ("first", filled[0])):
+                number = _page_number(lines[i])
+                if number is not None:
+                    found[i] = (position, number - page_index)
+        candidates.append(found)
+        offsets.update(set(found.values()))
+    numbering = {offset for offset, count in offsets.items() if count >= threshold}
+    
+    cleaned = []
+    removed = 0
+    for lines, drop, found in zip(page_lines, drops, candidates):
+        drop = drop | {i for i, offset in found.items() if offset in numbering}
+        removed += len(drop)
+        kept = "\n".join(line for i, line in enumerate(lines) if i not in drop)
+        cleaned.append(_BLANK_LINES.sub("\n\n", kept).strip())
+    return cleaned, removed
+
+def clean_pdf_pages(pages: List[str]) -> Tuple[List[str], Dict[str, Any]]:
+    """
+    Normalize whitespace and strip repeated boilerplate from extracted pages
+    
+    Args:
+        pages: Raw text of each page, in order
+    
+    Returns:
+        (cleaned page texts, stats with the characters, tokens and lines removed)
+    """
+    chars_before = sum(len(page) for page in pages)
+    tokens_before = sum(count_tokens(page) for page in pages)
+    
+    cleaned = [normalize_whitespace(page) for page in pages]
+    lines_removed = 0
+    if settings.pdf_strip_boilerplate:
+        cleaned, lines_removed = strip_boilerplate(
+            cleaned,
+            edge_lines=settings.pdf_boilerplate_edge_lines,
+            min_fraction=settings.pdf_boilerplate_min_fraction
+        )
+    
+    chars_after = sum(len(page) for page in cleaned)
+    tokens_after = sum(count_tokens(page) for page in cleaned)
+    stats = {
+        "chars_before": chars_before,
+        "chars_removed": chars_before - chars_after,
+        "tokens_before": tokens_before,
+        "tokens_removed": tokens_before - tokens_after,
+        "lines_removed": lines_removed,
+        "reduction_percent": round(100 * (tokens_before - tokens_after) / tokens_before, 1) if tokens_before else 0.0
+    }
+    return cleaned, stats
+
+def _needs_fallback(text: str) -> bool:
+    """Whether PyMuPDF's text for a page looks unusable"""
+    stripped = text.strip()
+    if len(stripped) < _MIN_PAGE_CHARS:
+        return True
+    garbled = stripped.count("\ufffd") + stripped.count("(cid:")
+    return garbled / len(stripped) > _MAX_REPLACEMENT_RATIO
+
+def extract_page_range(file_path: str, start: int, stop: int, extractor: str = EXTRACTOR_PYMUPDF) -> List[Dict[str, Any]]:
+    """
+    Extract the text of pages [start, stop) of a PDF (runs in a pool worker)
+    
+    Args:
+        file_path: PDF to read
+        start: Index of the first page (0-based)
+        stop: Index after the last page
+        extractor: pymupdf (falls back to pdfplumber per page) or pdfplumber
+    
+    Returns:
+        One {"page", "text", "extractor", "seconds"} dict per page
+    """
+    import fitz  # PyMuPDF
+    import pdfplumber
+    
+    pages = []
+    plumber = None
+    try:
+        with fitz.open(file_path) as document:
+            for index in range(start, stop):
+                started = time.perf_counter()
+                text, used = "", extractor
+                if extractor == EXTRACTOR_PYMUPDF:
+                    text = document[index].get_text("text", sort=True)
+                if extractor == EXTRACTOR_PDFPLUMBER or _needs_fallback(text):
+                    plumber = plumber or pdfplumber.open(file_path)
+                    plumber_text = plumber.pages[index].extract_text() or ""
+                    if extractor == EXTRACTOR_PDFPLUMBER or len(plumber_text.strip()) > len(text.strip()):
+                        text, used = plumber_text, EXTRACTOR_PDFPLUMBER
+                pages.append({
+                    "page": index + 1,
+                    "text": text,
+                    "extractor": used,
+                    "seconds": round(time.perf_counter() - started, 4)
+                })
+    finally:
+        if plumber is not None:
+            plumber.close()
+    return pages
+
+def page_count(file_path: str) -> int:
+    """Number of pages in a PDF"""
+    import fitz  # PyMuPDF
+    with fitz.open(file_path) as document:
+        return document.page_count
+
+pdf_executor: Optional[ProcessPoolExecutor] = None
+pdf_executor_workers = 0
+
+def get_pdf_executor() -> ProcessPoolExecutor:
+    """Get the process pool used for PDF extraction"""
+    global pdf_executor, pdf_executor_workers
+    if pdf_executor is None:
+        pdf_executor_workers = settings.pdf_extract_workers or os.cpu_count() or 1
+        # spawn: workers must not inherit the server's threads, sockets and event loop
+        pdf_executor = ProcessPoolExecutor(
+            max_workers=pdf_executor_workers, mp_context=multiprocessing.get_context("spawn")
+        )
+    return pdf_executor
+
+def shutdown_pdf_executor():
+    """Stop the PDF extraction workers"""
+    global pdf_executor, pdf_executor_workers
+    if pdf_executor is not None:
+        pdf_executor.shutdown(cancel_futures=True)
+        pdf_executor = None
+        pdf_executor_workers = 0
+
+async def extract_pdf_pages(file_path: str) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Extract all pages of a PDF in parallel in the process pool
+    
+    Pages are split into ranges of settings.pdf_pages_per_task, so large
+    documents are spread across every worker and small ones stay a single
+    task. The event loop only awaits the results.
+    
+    Args:
+        file_path: PDF to read
+    
+    Returns:
+        (page dicts in page order, extraction stats with per-stage timings)
+    """
+    started = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    executor = get_pdf_executor()
+    
+    total_pages = await loop.run_in_executor(executor, page_count, file_path)
+    per_task = max(1, settings.pdf_pages_per_task)
+    ranges = [(start, min(start + per_task, total_pages)) for start in range(0, total_pages, per_task)]
+    results = await asyncio.gather(*[
+        loop.run_in_executor(executor, extract_page_range, file_path, start, stop, settings.pdf_extractor)
+        for start, stop in ranges
+    ])
+    pages = [page for result in results for page in result]
+    
+    page_seconds = [page["seconds"] for page in pages]
+    slowest = sorted(pages, key=lambda page: page["seconds"], reverse=True)[:5]
+    stats = {
+        "pages": len(pages),
+        "tasks": len(ranges),
+        "workers": pdf_executor_workers,
+        "seconds": round(time.perf_counter() - started, 3),
+        "page_seconds_total": round(sum(page_seconds), 3),
+        "page_seconds_max": max(page_seconds, default=0.0),
+        "slowest_pages": [{"page": page["page"], "seconds": page["seconds"]} for page in slowest],
+        "fallback_pages": sum(1 for page in pages if page["extractor"] == EXTRACTOR_PDFPLUMBER)
+    }
+    logger.info(
+        f"Extracted {stats['pages']} pages from {os.path.basename(file_path)} in {stats['seconds']}s "
+        f"({stats['tasks']} tasks, {stats['fallback_pages']} pdfplumber fallbacks)"
+    )
+    return pages, stats
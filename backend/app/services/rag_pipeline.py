@@ -10,7 +10,7 @@ from langgraph.graph.message import add_messages
 from typing_extensions import Annotated, TypedDict
 import logging
 
-from ..core.db import qdrant_db
+from ..core.db import get_qdrant_db
 from ..core.embeddings import get_embeddings_service
 from ..core.config import settings
 from ..core.logger import interaction_logger
@@ -58,7 +58,7 @@ class StudyBuddyRAG:
                 query_embedding = embeddings_service.embed_query(query)
                 
                 # Search vector store
-                chunks = qdrant_db.query_chunks(
+                chunks = get_qdrant_db().query_chunks(
                     query_embedding=query_embedding,
                     top_k=settings.max_context_chunks
                 )
@@ -0,0 +1,76 @@
+"""
+One-time backfill of the document registry for StudyBuddy
+
+Documents ingested before the registry existed only live in the vector
+store. On the first start with a registry, their doc_ids are scrolled from
+the store and registered as completed, with the stored upload (if it is
+still in settings.upload_dir) as their file, so they are listed, report
+their status and can be deleted by ID.
+"""
+from typing import Any, Dict, Optional
+import asyncio
+import logging
+import os
+
+from ..core.config import settings
+from ..core.db import vector_store
+from ..core.document_registry import DocumentRegistry, get_document_registry
+from ..core.vector_store import VectorStore
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_MIGRATION = "backfill_from_vector_store"
+
+def _file_type(filename: str) -> str:
+    """Upload type from the filename (as chosen by the upload routes)"""
+    extension = os.path.splitext(filename or "")[1].lower()
+    if extension == ".pdf":
+        return "pdf"
+    if extension in (".xlsx", ".xls"):
+        return "excel"
+    return "text"
+
+async def backfill_registry(store: Optional[VectorStore] = None,
+                            registry: Optional[DocumentRegistry] = None,
+                            upload_dir: Optional[str] = None) -> int:
+    """
+    Register documents found in the vector store but missing from the registry
+    
+    Runs once per registry; later calls return 0 without scanning the store.
+    
+    Returns:
+        Number of documents registered
+    """
+    store = store or vector_store
+    registry = registry or get_document_registry()
+    upload_dir = upload_dir or settings.upload_dir
+    if await asyncio.to_thread(registry.has_migration, BACKFILL_MIGRATION):
+        return 0
+    
+    documents: Dict[str, Dict[str, Any]] = {}
+    async for _, _, payloads in store.scroll_points():
+        for payload in payloads:
+            doc_id = payload.get("doc_id")
+            if not doc_id:
+                continue
+            document = documents.setdefault(doc_id, {
+                "doc_id": doc_id,
+                "filename": payload.get("filename") or doc_id,
+                "chunk_count": 0,
+                "metadata": {"backfilled": True}
+            })
+            document["chunk_count"] += 1
+    
+    for document in documents.values():
+        document["file_type"] = _file_type(document["filename"])
+        file_path = os.path.join(upload_dir, f"{document['doc_id']}_{document['filename']}")
+        if os.path.exists(file_path):
+            document["file_path"] = file_path
+            document["size_bytes"] = os.path.getsize(file_path)
+            document["created_at"] = os.path.getmtime(file_path)
+    
+    added = await asyncio.to_thread(registry.backfill, list(documents.values()))
+    await asyncio.to_thread(registry.record_migration, BACKFILL_MIGRATION)
+    if added:
+        logger.info(f"Registered {added} documents ingested before the document registry existed")
+    return added
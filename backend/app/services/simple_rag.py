@@ -3,13 +3,19 @@ Simplified RAG Pipeline for StudyBuddy (Day 2)
 Using basic OpenAI API without full LangChain dependencies
 """
 from typing import Dict, List, Any, Optional
+import asyncio
 import logging
 import uuid
 import json
 from datetime import datetime
+from openai import OpenAI
 
-from ..core.db import qdrant_db
+from ..core.db import vector_store
+from ..core.vector_store import reciprocal_rank_fusion, collapse_duplicates
+from ..core.dedupe import SCOPE_CORPUS
+from ..agents.chunker import page_label
 from ..core.embeddings import get_embeddings_service
+from ..core.tokenizer import pack_chunks
 from ..core.config import settings
 from ..core.logger import interaction_logger
 
@@ -25,16 +31,116 @@ class SimpleRAGPipeline:
     def _get_client(self):
         """Get OpenAI client (lazy loading)"""
         if self.client is None:
-            self.embeddings_service = get_embeddings_service()
-            self.client = self.embeddings_service.client
+            self.client = OpenAI(api_key=settings.openai_api_key)
         return self.client
     
+    def _expansion_prompt(self, query: str, count: int, intent: str) -> str:
+        """Prompt asking for sub-queries (subtopics for study plans)"""
+        if intent == "plan":
+            task = f"List the {count} most important subtopics a study plan for this topic should cover."
+        else:
+            task = (
+                f"Write {count} different search queries that would find passages answering "
+                f"this question (rephrasings or the sub-questions it depends on)."
+            )
+        return f"""{task}
+Respond with one per line, without numbering or extra text.
+
+Question: {query}"""
+
+    async def expand_query(self, query: str, intent: str = "chat") -> List[str]:
+        """
+        Expand a question into several retrieval queries
+        
+        Args:
+            query: User's question (or study plan topic)
+            intent: "plan" asks for subtopics, anything else for query variants
+        
+        Returns:
+            The original query followed by up to settings.multi_query_count sub-queries
+        """
+        count = settings.multi_query_count
+        if count <= 0:
+            return [query]
+        
+        try:
+            client = self._get_client()
+            response = await asyncio.to_thread(
+                client.chat.completions.create,
+                model=settings.multi_query_model,
+                messages=[{"role": "user", "content": self._expansion_prompt(query, count, intent)}],
+                temperature=0.3,
+                max_tokens=200
+            )
+            lines = response.choices[0].message.content.splitlines()
+        except Exception as e:
+            logger.warning(f"Query expansion failed, using the original query: {e}")
+            return [query]
+        
+        queries = [query]
+        for line in lines:
+            sub_query = line.strip().lstrip("-*•0123456789.) ").strip()
+            if sub_query and sub_query.lower() not in (q.lower() for q in queries):
+                queries.append(sub_query)
+        return queries[:count + 1]
+    
+    async def retrieve(self, query: str, doc_id: Optional[str] = None, intent: str = "chat",
+                       top_k: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Multi-query retrieval
+        
+        When settings.multi_query_count is set, the question is expanded into
+        sub-queries, all of them are embedded through the query coalescer and
+        searched in one batch round trip, and the result lists are fused with
+        reciprocal rank fusion.
+        
+        Args:
+            query: User's question (or study plan topic)
+            doc_id: Optional document ID to filter search to specific document
+            intent: "plan" expands into subtopics, "chat" into query variants
+            top_k: Number of fused chunks (default settings.max_context_chunks)
+        
+        Returns:
+            Dictionary with the fused context_chunks and the queries used
+        """
+        top_k = top_k or settings.max_context_chunks
+        if self.embeddings_service is None:
+            self.embeddings_service = get_embeddings_service()
+        
+        # Linked corpus duplicates are collapsed, so search a few extra candidates to fill top_k
+        candidates = top_k * 2 if settings.dedupe_scope == SCOPE_CORPUS else top_k
+        
+        queries = await self.expand_query(query, intent)
+        if len(queries) == 1:
+            query_embedding = await self.embeddings_service.aembed_query(query)
+            results = await vector_store.query_chunks(query_embedding, doc_id=doc_id, top_k=candidates)
+            return {
+                "context_chunks": collapse_duplicates(results, top_k=top_k),
+                "queries": queries
+            }
+        
+        query_embeddings = await self.embeddings_service.aembed_queries(queries)
+        result_lists = await vector_store.query_chunks_batch(query_embeddings, doc_id=doc_id, top_k=candidates)
+        result_lists = [collapse_duplicates(results) for results in result_lists]
+        return {
+            "context_chunks": collapse_duplicates(
+                reciprocal_rank_fusion(result_lists, k=settings.rrf_k),
+                top_k=top_k
+            ),
+            "queries": queries
+        }
+    
+    @staticmethod
+    def _source_header(chunk: Dict[str, Any]) -> str:
+        return f"[Source: Page {page_label(chunk)}]"
+    
     def _build_prompt(self, query: str, context_chunks: List[Dict[str, Any]]) -> str:
         """Build the prompt for the LLM"""
         
-        # Build context from chunks
+        # Build context from the chunks that fit the context token budget
+        context_chunks = pack_chunks(context_chunks, settings.max_context_tokens, header=self._source_header)
         context_text = "\n\n".join([
-            f"[Source: Page {chunk.get('page', 'N/A')}]\n{chunk.get('text', '')}"
+            f"{self._source_header(chunk)}\n{chunk.get('text', '')}"
             for chunk in context_chunks
         ])
         
@@ -75,29 +181,19 @@ Answer:"""
             # Step 1: Retrieve context
             agent_steps.append({
                 "step": "retrieve_context",
-                "action": "Embedding query and searching vector store",
+                "action": "Embedding queries and searching vector store",
                 "status": "running",
                 "timestamp": datetime.now().isoformat()
             })
             
-            # Get query embedding
-            # Get embeddings service
-            if self.embeddings_service is None:
-                self.embeddings_service = get_embeddings_service()
-            
-            query_embedding = self.embeddings_service.embed_query(query)
-            
-            # Search vector store (filter by doc_id if provided)
-            context_chunks = qdrant_db.query_chunks(
-                query_embedding=query_embedding,
-                doc_id=doc_id,  # This will filter to specific document if provided
-                top_k=settings.max_context_chunks
-            )
+            # Multi-query search (filter by doc_id if provided)
+            retrieval = await self.retrieve(query, doc_id=doc_id)
+            context_chunks = retrieval["context_chunks"]
             
             # Update step
             agent_steps[-1].update({
                 "status": "completed",
-                "result": f"Retrieved {len(context_chunks)} relevant chunks"
+                "result": f"Retrieved {len(context_chunks)} relevant chunks for {len(retrieval['queries'])} queries"
             })
             
             # Step 2: Generate response
@@ -0,0 +1,208 @@
+"""
+Snapshot export/import for StudyBuddy
+
+A snapshot is a directory holding everything a node needs to serve a
+document set without re-embedding it:
+
+    manifest.json        format version, vector size, vector space, counts
+    vectors.npy          float32 matrix, one row per point
+    payloads.jsonl.gz    {"id", "payload"} per point, aligned with vectors.npy
+    documents.jsonl.gz   document registry records
+"""
+from typing import Any, Dict, List, Optional
+import gzip
+import json
+import logging
+import os
+import re
+import shutil
+import time
+import numpy as np
+
+from ..core.config import settings
+from ..core.db import vector_store
+from ..core.document_registry import DocumentRegistry, get_document_registry
+from ..core.embedding_backends import get_vector_space
+from ..core.vector_store import VectorStore
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+
+# Snapshot names are used as directory names
+SNAPSHOT_NAME_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]{0,127}$")
+
+def snapshot_path(name: str) -> str:
+    """Directory of a named snapshot under settings.snapshot_dir"""
+    if not SNAPSHOT_NAME_PATTERN.match(name):
+        raise ValueError(f"Invalid snapshot name: {name}")
+    return os.path.join(settings.snapshot_dir, name)
+
+def read_manifest(path: str) -> Dict[str, Any]:
+    with open(os.path.join(path, "manifest.json"), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def list_snapshots(directory: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Manifests of the snapshots in a directory, newest first"""
+    directory = directory or settings.snapshot_dir
+    if not os.path.isdir(directory):
+        return []
+    snapshots = []
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if os.path.isfile(os.path.join(path, "manifest.json")):
+            snapshots.append(dict(read_manifest(path), name=name))
+    return sorted(snapshots, key=lambda manifest: manifest.get("created_at", 0), reverse=True)
+
+async def export_snapshot(path: str, store: Optional[VectorStore] = None,
+                          registry: Optional[DocumentRegistry] = None,
+                          batch_size: int = 1000) -> Dict[str, Any]:
+    """
+    Export all points and the document registry to a snapshot directory
+    
+    The snapshot is written to a temporary directory that is renamed into
+    place when complete, so a crashed export never looks like a snapshot.
+    
+    Args:
+        path: Snapshot directory (must not exist)
+        store: Vector store to export (default: the configured store)
+        registry: Document registry to export (default: the global registry)
+        batch_size: Points read per scroll request
+    
+    Returns:
+        The snapshot manifest
+    """
+    store = store or vector_store
+    registry = registry or get_document_registry()
+    if os.path.exists(path):
+        raise FileExistsError(f"Snapshot already exists: {path}")
+    
+    started = time.perf_counter()
+    partial = f"{path}.partial"
+    shutil.rmtree(partial, ignore_errors=True)
+    os.makedirs(partial)
+    
+    try:
+        # Vectors are streamed to a raw file first; the count is only known at the end
+        raw_path = os.path.join(partial, "vectors.f32")
+        count = 0
+        with open(raw_path, "wb") as raw, \
+                gzip.open(os.path.join(partial, "payloads.jsonl.gz"), "wt", encoding="utf-8") as payloads:
+            async for point_ids, vectors, batch_payloads in store.scroll_points(batch_size=batch_size):
+                vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+                if vectors.shape[1] != store.vector_size:
+                    raise ValueError(f"Point vectors have size {vectors.shape[1]}, expected {store.vector_size}")
+                raw.write(vectors.tobytes())
+                for pid, payload in zip(point_ids, batch_payloads):
+                    payloads.write(json.dumps({"id": pid, "payload": payload}, ensure_ascii=False) + "\n")
+                count += len(point_ids)
+        
+        with open(os.path.join(partial, "vectors.npy"), "wb") as f, open(raw_path, "rb") as raw:
+            np.lib.format.write_array_header_1_0(f, {
+                "descr": np.lib.format.dtype_to_descr(np.dtype(np.float32)),
+                "fortran_order": False,
+                "shape": (count, store.vector_size)
+            })
+            shutil.copyfileobj(raw, f, 16 * 1024 * 1024)
+        os.remove(raw_path)
+        
+        documents = registry.list_documents(limit=-1)
+        with gzip.open(os.path.join(partial, "documents.jsonl.gz"), "wt", encoding="utf-8") as f:
+            for document in documents:
+                f.write(json.dumps(document, ensure_ascii=False) + "\n")
+        
+        manifest = {
+            "version": SNAPSHOT_VERSION,
+            "created_at": time.time(),
+            "vector_size": store.vector_size,
+            "embedding_backend": settings.embedding_backend,
+            "embedding_model": settings.embedding_model,
+            "vector_space": get_vector_space(),
+            "points": count,
+            "documents": len(documents)
+        }
+        with open(os.path.join(partial, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        
+        os.rename(partial, path)
+    except BaseException:
+        shutil.rmtree(partial, ignore_errors=True)
+        raise
+    
+    logger.info(
+        f"Exported snapshot {path}: {count} points, {len(documents)} documents "
+        f"in {time.perf_counter() - started:.1f}s"
+    )
+    return manifest
+
+def _read_payload_batches(path: str, batch_size: int):
+    """Yield (point IDs, payloads) batches from payloads.jsonl.gz"""
+    point_ids, payloads = [], []
+    with gzip.open(os.path.join(path, "payloads.jsonl.gz"), "rt", encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            point_ids.append(record["id"])
+            payloads.append(record["payload"])
+            if len(point_ids) == batch_size:
+                yield point_ids, payloads
+                point_ids, payloads = [], []
+    if point_ids:
+        yield point_ids, payloads
+
+async def import_snapshot(path: str, store: Optional[VectorStore] = None,
+                          registry: Optional[DocumentRegistry] = None,
+                          force: bool = False, batch_size: int = 10000) -> Dict[str, Any]:
+    """
+    Bulk load a snapshot into the vector store and document registry
+    
+    Args:
+        path: Snapshot directory
+        store: Target vector store (default: the configured store)
+        registry: Target document registry (default: the global registry)
+        force: Import even if the store already holds points (IDs are upserted)
+            or the snapshot was embedded in another vector space
+        batch_size: Points handed to the store per import call
+    
+    Returns:
+        Import statistics
+    """
+    store = store or vector_store
+    registry = registry or get_document_registry()
+    manifest = read_manifest(path)
+    
+    if manifest.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot version: {manifest.get('version')}")
+    if manifest["vector_size"] != store.vector_size:
+        raise ValueError(
+            f"Snapshot vectors have size {manifest['vector_size']} but the store expects {store.vector_size}"
+        )
+    # Vectors of another model or output size are not comparable with this node's queries
+    if manifest.get("vector_space") != get_vector_space():
+        message = (
+            f"Snapshot was embedded in {manifest.get('vector_space') or manifest.get('embedding_model')}, "
+            f"this node uses {get_vector_space()}"
+        )
+        if not force:
+            raise ValueError(f"{message}; import with force to load it anyway")
+        logger.warning(message)
+    if not force and await store.count_points() > 0:
+        raise ValueError("Vector store is not empty; import with force to merge")
+    
+    started = time.perf_counter()
+    vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+    if vectors.shape[0] != manifest["points"]:
+        raise ValueError(f"vectors.npy has {vectors.shape[0]} rows, manifest says {manifest['points']}")
+    
+    imported = 0
+    for point_ids, payloads in _read_payload_batches(path, batch_size):
+        batch_vectors = np.asarray(vectors[imported:imported + len(point_ids)], dtype=np.float32)
+        await store.import_points(point_ids, batch_vectors, payloads)
+        imported += len(point_ids)
+    
+    with gzip.open(os.path.join(path, "documents.jsonl.gz"), "rt", encoding="utf-8") as f:
+        documents = [json.loads(line) for line in f]
+    registry.restore(documents)
+    
+    seconds = round(time.perf_counter() - started, 3)
+    logger.info(f"Imported snapshot {path}: {imported} points, {len(documents)} documents in {seconds}s")
+    return {"points": imported, "documents": len(documents), "seconds": seconds}
@@ -0,0 +1,45 @@
+"""
+Shared test setup: keep every on-disk store out of the working directory
+"""
+import pytest
+import shutil
+import sys
+import os
+import tempfile
+
+# Add the app directory to Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.core.config import settings
+
+# Modules that create directories at import time (the upload routes) see these paths
+_session_storage = tempfile.mkdtemp(prefix="studybuddy-tests-")
+
+def _storage_paths(root):
+    return {
+        "upload_dir": os.path.join(root, "uploads"),
+        "local_vector_store_path": os.path.join(root, "vector_store"),
+        "embedding_cache_path": os.path.join(root, "embedding_cache.sqlite3"),
+        "job_queue_path": os.path.join(root, "jobs.sqlite3"),
+        "document_registry_path": os.path.join(root, "documents.sqlite3"),
+        "dedupe_index_path": os.path.join(root, "dedupe.sqlite3")
+    }
+
+for _name, _path in _storage_paths(_session_storage).items():
+    setattr(settings, _name, _path)
+
+def pytest_unconfigure(config):
+    shutil.rmtree(_session_storage, ignore_errors=True)
+
+@pytest.fixture(autouse=True)
+def isolated_storage(monkeypatch, tmp_path):
+    """Point the global stores at a fresh directory for each test"""
+    from app.core import dedupe, document_registry, embedding_cache, job_queue
+    
+    for name, path in _storage_paths(str(tmp_path / "storage")).items():
+        monkeypatch.setattr(settings, name, path)
+    monkeypatch.setattr(embedding_cache, "embedding_cache", None)
+    monkeypatch.setattr(document_registry, "document_registry", None)
+    monkeypatch.setattr(job_queue, "job_queue", None)
+    monkeypatch.setattr(dedupe, "dedupe_index", None)
+    return tmp_path / "storage"
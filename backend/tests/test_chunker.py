@@ -0,0 +1,167 @@
+"""
+Unit tests for text chunking
+"""
+import pytest
+import io
+import sys
+import os
+
+# Add the app directory to Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.agents.chunker import (
+    chunk_text, chunk_text_by_tokens, find_boundaries, iter_split_text,
+    pack_pages, page_label, should_pack_pages
+)
+from app.core.config import settings
+from app.core import tokenizer
+from app.core.tokenizer import count_tokens, token_offsets, pack_chunks
+from app.core.vector_store import chunk_payload, payload_to_chunk
+
+@pytest.fixture
+def estimated_tokens(monkeypatch):
+    """Use the estimated (tiktoken-free) token counts"""
+    monkeypatch.setattr(tokenizer, "_encoding", None)
+    monkeypatch.setattr(tokenizer, "_encoding_loaded", True)
+    count_tokens.cache_clear()
+    yield
+    count_tokens.cache_clear()
+
+class TestChunkText:
+    """Test boundary selection and overlap"""
+    
+    def test_breaks_at_closest_sentence_end(self):
+        """The boundary nearest the target wins, not the first one in the window"""
+        text = "a" * 850 + ". " + "b" * 145 + ". " + "c" * 600
+        chunks = chunk_text(text, chunk_size=1000, chunk_overlap=0)
+        
+        assert chunks[0].endswith("b.")
+        assert len(chunks[0]) == 998
+    
+    def test_overlap_and_coverage(self):
+        """Consecutive chunks overlap and together cover the text"""
+        sentences = [f"Sentence number {i} talks about topic {i % 7}." for i in range(400)]
+        text = " ".join(sentences)
+        chunks = chunk_text(text, chunk_size=500, chunk_overlap=50)
+        
+        assert all(len(chunk) <= 500 + 200 for chunk in chunks)
+        for previous, current in zip(chunks, chunks[1:]):
+            assert previous[-30:].strip()[-10:] in current[:80]
+        assert chunks[0].startswith(sentences[0])
+        assert chunks[-1].endswith(sentences[-1])
+    
+    def test_no_duplicate_tail_chunk(self):
+        """The chunk that reaches the end of the text is the last one"""
+        text = "word " * 370  # 1850 characters without sentence ends
+        chunks = chunk_text(text, chunk_size=1000, chunk_overlap=100)
+        
+        assert len(chunks) == 2
+    
+    def test_streamed_chunks_match(self, monkeypatch):
+        """Chunking a stream in small reads gives the same chunks as the whole text"""
+        monkeypatch.setattr(settings, "chunking_mode", "chars")
+        text = " ".join(f"Énergie {i} ist größer als {i - 1}!\n\nNächster Absatz." for i in range(300))
+        expected = chunk_text(text, chunk_size=settings.chunk_size, chunk_overlap=settings.chunk_overlap)
+        
+        for read_size in (997, 4096, 1024 * 1024):
+            stream = io.BytesIO(text.encode("utf-8"))
+            assert list(iter_split_text(stream, read_size=read_size)) == expected
+    
+    def test_boundaries(self):
+        """Sentence ends and paragraph breaks are found, decimals are not"""
+        text = "Pi is 3.14. Really!\n\nNext"
+        
+        assert find_boundaries(text) == [11, 19, 20]
+
+class TestChunkTextByTokens:
+    """Test token-based chunking, token counts and prompt packing"""
+    
+    def test_token_offsets_match_counts(self, estimated_tokens):
+        """One offset per counted token, for ASCII and non-ASCII text"""
+        for text in ("plain ascii text here", "énergie cinétique – ½mv²"):
+            offsets = token_offsets(text)
+            assert offsets[0] == 0
+            assert offsets == sorted(set(offsets))
+            assert abs(len(offsets) - count_tokens(text)) <= 1
+    
+    def test_chunks_fit_token_budget(self, estimated_tokens):
+        """Chunks stay within the token budget and end at sentence boundaries"""
+        text = " ".join(f"Sentence {i} explains idea {i % 5}." for i in range(300))
+        chunks = chunk_text_by_tokens(text, chunk_tokens=100, overlap_tokens=10)
+        
+        assert len(chunks) > 1
+        assert all(count_tokens(chunk) <= 100 for chunk in chunks)
+        assert all(chunk.endswith(".") for chunk in chunks)
+        assert chunks[0].startswith("Sentence 0 ")
+        assert chunks[-1].endswith("Sentence 299 explains idea 4.")
+    
+    def test_short_text_is_one_chunk(self, estimated_tokens):
+        """Text within the budget is returned as is"""
+        assert chunk_text_by_tokens("Short note.", chunk_tokens=100) == ["Short note."]
+        assert chunk_text_by_tokens("", chunk_tokens=100) == []
+    
+    def test_payload_stores_token_count(self, estimated_tokens):
+        """The payload records the chunk's token count and it round-trips"""
+        chunk = {"chunk_id": "c0", "text": "Photosynthesis converts light into energy."}
+        pid, payload = chunk_payload(chunk, "doc", 0)
+        
+        assert payload["token_count"] == count_tokens(chunk["text"])
+        assert payload_to_chunk(pid, 0.9, payload)["token_count"] == payload["token_count"]
+    
+    def test_pack_chunks_respects_budget(self, estimated_tokens):
+        """Chunks are packed in rank order, skipping ones that don't fit"""
+        chunks = [
+            {"id": 1, "text": "x", "token_count": 60},
+            {"id": 2, "text": "x", "token_count": 50},
+            {"id": 3, "text": "x", "token_count": 20},
+            {"id": 4, "text": "x"}
+        ]
+        packed = pack_chunks(chunks, max_tokens=90)
+        
+        assert [chunk["id"] for chunk in packed] == [1, 3, 4]
+        assert pack_chunks(chunks, max_tokens=90, header=lambda chunk: "h" * 30) == [chunks[0], chunks[3]]
+
+class TestPackPages:
+    """Test page-spanning chunks for paged documents"""
+    
+    def slides(self, count=40):
+        return [f"Slide {i}: key idea number {i} explained in one short sentence." for i in range(1, count + 1)]
+    
+    def test_short_pages_share_chunks(self, monkeypatch):
+        """Slide-sized pages are packed into far fewer chunks than pages"""
+        monkeypatch.setattr(settings, "chunking_mode", "chars")
+        pages = self.slides()
+        chunks = pack_pages(pages)
+        
+        assert len(chunks) <= len(pages) // 10
+        assert chunks[0]["page_start"] == 1
+        assert chunks[-1]["page_end"] == len(pages)
+        assert all(chunk["page_start"] <= chunk["page_end"] for chunk in chunks)
+    
+    def test_ranges_and_offsets_locate_the_text(self, monkeypatch):
+        """Start and end pages and offsets point at the chunk's text"""
+        monkeypatch.setattr(settings, "chunking_mode", "chars")
+        pages = self.slides()
+        
+        for chunk in pack_pages(pages, first_page=1):
+            first = pages[chunk["page_start"] - 1]
+            last = pages[chunk["page_end"] - 1]
+            assert chunk["text"].startswith(first[chunk["start_offset"]:][:20])
+            assert chunk["text"].endswith(last[:chunk["end_offset"]][-20:])
+    
+    def test_auto_mode_packs_slides_only(self, monkeypatch):
+        """auto packs documents with short pages and keeps full pages separate"""
+        monkeypatch.setattr(settings, "chunking_mode", "chars")
+        monkeypatch.setattr(settings, "pdf_chunking", "auto")
+        
+        assert should_pack_pages(self.slides())
+        assert not should_pack_pages(["A full page of prose. " * 100] * 5)
+        
+        monkeypatch.setattr(settings, "pdf_chunking", "page")
+        assert not should_pack_pages(self.slides())
+    
+    def test_page_label(self):
+        """Chunks spanning pages cite the range"""
+        assert page_label({"page": 3, "metadata": {"page_start": 3, "page_end": 5}}) == "3-5"
+        assert page_label({"page": 3, "metadata": {"page_number": 3}}) == "3"
+        assert page_label({"page": "Sheet1"}) == "Sheet1"
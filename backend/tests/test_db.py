@@ -0,0 +1,279 @@
+"""
+Unit tests for the Qdrant store setup
+"""
+import pytest
+import sys
+import os
+from types import SimpleNamespace
+
+# Add the app directory to Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.core.db import QdrantDB
+
+class FakeQdrantClient:
+    """Qdrant client holding one existing collection"""
+    
+    def __init__(self, payload_schema):
+        self.payload_schema = payload_schema
+        self.created_indexes = []
+    
+    def get_collections(self):
+        return SimpleNamespace(collections=[SimpleNamespace(name="docs")])
+    
+    def get_collection(self, collection_name):
+        return SimpleNamespace(
+            config=SimpleNamespace(params=SimpleNamespace(vectors=SimpleNamespace(size=4))),
+            payload_schema=self.payload_schema
+        )
+    
+    def create_payload_index(self, collection_name, field_name, field_schema, wait):
+        self.created_indexes.append(field_name)
+
+class TestPayloadIndexes:
+    """Test payload index creation and migration"""
+    
+    def test_existing_collection_gets_missing_indexes(self):
+        """Only indexes missing from an existing collection are created"""
+        db = QdrantDB(collection_name="docs", vector_size=4, location=":memory:")
+        db.client = FakeQdrantClient(payload_schema={"doc_id": object()})
+        
+        assert db._check_and_init_collection()
+        
+        assert "doc_id" not in db.client.created_indexes
+        assert set(db.client.created_indexes) == set(QdrantDB.PAYLOAD_INDEXES) - {"doc_id"}
+
+class RecordingUpsertClient:
+    """Qdrant client that records upsert requests"""
+    
+    def __init__(self):
+        self.requests = []
+    
+    def upsert(self, collection_name, points, wait):
+        self.requests.append((points, wait))
+
+class TestBulkUpsert:
+    """Test batched, parallel upserts"""
+    
+    def test_points_are_sent_in_bounded_batches(self, monkeypatch):
+        """Chunks are split into batches and the last one waits as a barrier"""
+        import numpy as np
+        from app.core import db as db_module
+        monkeypatch.setattr(db_module.settings, "qdrant_upsert_batch_size", 3)
+        monkeypatch.setattr(db_module.settings, "qdrant_upsert_parallel", 2)
+        monkeypatch.setattr(db_module.settings, "qdrant_upsert_wait", False)
+        db = QdrantDB(collection_name="docs", vector_size=4, location=":memory:")
+        db._collection_initialized = True
+        db.client = RecordingUpsertClient()
+        
+        chunks = [{"text": f"chunk {i}"} for i in range(10)]
+        embeddings = np.arange(40, dtype=np.float32).reshape(10, 4)
+        assert db.add_chunks(chunks, embeddings, doc_id="doc")
+        
+        assert [len(points) for points, _ in db.client.requests[:-1]] == [3, 3, 3]
+        assert [wait for _, wait in db.client.requests] == [False, False, False, True]
+        points = sorted((point for points, _ in db.client.requests for point in points),
+                        key=lambda point: point.vector[0])
+        assert [point.payload["chunk_id"] for point in points] == [f"doc_chunk_{i}" for i in range(10)]
+        assert points[9].vector == [36.0, 37.0, 38.0, 39.0]
+
+@pytest.mark.filterwarnings("ignore:Payload indexes have no effect")
+class TestAsyncQdrantDB:
+    """Test the async store against an in-process Qdrant"""
+    
+    @pytest.fixture
+    def db(self):
+        from app.core.db import AsyncQdrantDB
+        return AsyncQdrantDB(collection_name="docs", vector_size=4, location=":memory:")
+    
+    @staticmethod
+    def add(db):
+        import asyncio
+        import numpy as np
+        chunks = [{"chunk_id": f"doc_chunk_{i}", "text": f"chunk {i}", "page": i} for i in range(3)]
+        embeddings = np.eye(3, 4, dtype=np.float32)
+        asyncio.run(db.add_chunks(chunks, embeddings, doc_id="doc"))
+        asyncio.run(db.add_chunks([{"chunk_id": "other_chunk_0", "text": "other"}], embeddings[:1], doc_id="other"))
+    
+    def test_collection_is_created_with_configured_index(self, db, monkeypatch):
+        """New collections get the configured vectors, HNSW and quantization settings"""
+        import asyncio
+        from app.core import db as db_module
+        monkeypatch.setattr(db_module.settings, "qdrant_hnsw_m", 32)
+        monkeypatch.setattr(db_module.settings, "qdrant_quantization", "scalar")
+        created = {}
+        create_collection = db.client.create_collection
+        
+        async def recording_create_collection(**kwargs):
+            created.update(kwargs)
+            return await create_collection(**kwargs)
+        
+        monkeypatch.setattr(db.client, "create_collection", recording_create_collection)
+        
+        assert asyncio.run(db._check_and_init_collection())
+        assert created["vectors_config"].size == 4
+        assert created["hnsw_config"].m == 32
+        assert created["quantization_config"].scalar.type == db_module.models.ScalarType.INT8
+    
+    def test_upsert_query_and_delete(self, db):
+        """Stored chunks are found by vector, filtered by document and deleted"""
+        import asyncio
+        self.add(db)
+        
+        results = asyncio.run(db.query_chunks([0.0, 1.0, 0.0, 0.0], top_k=2))
+        assert results[0]["chunk_id"] == "doc_chunk_1"
+        assert asyncio.run(db.count_points()) == 4
+        
+        filtered = asyncio.run(db.query_chunks([1.0, 0.0, 0.0, 0.0], doc_id="other", top_k=5))
+        assert [chunk["chunk_id"] for chunk in filtered] == ["other_chunk_0"]
+        
+        assert len(asyncio.run(db.get_chunk_hashes("doc"))) == 3
+        asyncio.run(db.delete_document("doc"))
+        assert asyncio.run(db.get_chunk_hashes("doc")) == {}
+        assert asyncio.run(db.count_points()) == 1
+    
+    def test_batch_query(self, db):
+        """Several query vectors are answered in one batch, in order"""
+        import asyncio
+        import numpy as np
+        self.add(db)
+        
+        results = asyncio.run(db.query_chunks_batch(np.eye(2, 4, k=1, dtype=np.float32), doc_id="doc", top_k=1))
+        
+        assert [[chunk["chunk_id"] for chunk in batch] for batch in results] == [["doc_chunk_1"], ["doc_chunk_2"]]
+
+class FakeAsyncStore:
+    """In-memory stand-in for AsyncQdrantDB keyed by point ID"""
+    
+    def __init__(self):
+        self.points = {}
+        self.upserted = 0
+        self.batch_sizes = []
+    
+    async def get_chunk_hashes(self, doc_id):
+        return {pid: payload["content_hash"] for pid, payload in self.points.items()
+                if payload["doc_id"] == doc_id}
+    
+    async def add_chunks(self, chunks, embeddings, doc_id):
+        for point in QdrantDB._build_points(chunks, embeddings, doc_id):
+            self.points[point.id] = point.payload
+        self.upserted += len(chunks)
+        self.batch_sizes.append(len(chunks))
+    
+    async def delete_points(self, point_ids):
+        for pid in point_ids:
+            del self.points[pid]
+
+class TestIncrementalIngest:
+    """Test deterministic point IDs and re-ingestion"""
+    
+    def test_point_ids_are_deterministic(self):
+        """The same document and chunk always map to the same point"""
+        from app.core.vector_store import point_id
+        
+        assert point_id("doc", "doc_chunk_0") == point_id("doc", "doc_chunk_0")
+        assert point_id("doc", "doc_chunk_0") != point_id("doc", "doc_chunk_1")
+        assert point_id("doc", "doc_chunk_0") != point_id("other", "doc_chunk_0")
+    
+    def test_reingest_only_touches_changed_chunks(self, monkeypatch, tmp_path):
+        """Unchanged chunks are skipped, changed ones upserted, stale ones deleted"""
+        import asyncio
+        from app.services import ingestion_service
+        from app.core.embeddings import EmbeddingsService
+        from app.core.embedding_backends import HashingEmbeddingBackend
+        from app.core.document_registry import DocumentRegistry
+        from app.core.dedupe import DedupeIndex
+        service = EmbeddingsService(backend=HashingEmbeddingBackend(dimension=8))
+        service.cache = None
+        store = FakeAsyncStore()
+        monkeypatch.setattr(ingestion_service, "vector_store", store)
+        monkeypatch.setattr(ingestion_service, "get_embeddings_service", lambda: service)
+        monkeypatch.setattr(ingestion_service, "get_dedupe_index", lambda: DedupeIndex(str(tmp_path / "dedupe.sqlite3")))
+        registry = DocumentRegistry(str(tmp_path / "documents.sqlite3"))
+        registry.register("doc", "book.pdf", "pdf")
+        monkeypatch.setattr(ingestion_service, "get_document_registry", lambda: registry)
+        
+        def pages(texts):
+            return [{"chunk_id": f"doc_page_{i}_chunk_0", "text": text, "page": i}
+                    for i, text in enumerate(texts, 1)]
+        
+        asyncio.run(ingestion_service.process_and_store_chunks(pages(["a", "b", "c"]), "doc", "book.pdf"))
+        assert store.upserted == 3
+        
+        asyncio.run(ingestion_service.process_and_store_chunks(pages(["a", "B"]), "doc", "book.pdf"))
+        assert store.upserted == 4
+        assert sorted(payload["text"] for payload in store.points.values()) == ["B", "a"]
+        assert registry.get("doc")["status"] == "completed"
+        assert registry.get("doc")["chunk_count"] == 2
+
+    def test_streamed_text_upload_is_ingested_in_batches(self, monkeypatch, tmp_path):
+        """A text file is chunked lazily and stored in bounded batches"""
+        import asyncio
+        from app.services import ingestion_service
+        from app.agents.chunker import chunk_text
+        from app.core.config import settings
+        from app.core.embeddings import EmbeddingsService
+        from app.core.embedding_backends import HashingEmbeddingBackend
+        from app.core.document_registry import DocumentRegistry
+        from app.core.dedupe import DedupeIndex
+        service = EmbeddingsService(backend=HashingEmbeddingBackend(dimension=8))
+        service.cache = None
+        store = FakeAsyncStore()
+        monkeypatch.setattr(ingestion_service, "vector_store", store)
+        monkeypatch.setattr(ingestion_service, "get_embeddings_service", lambda: service)
+        monkeypatch.setattr(ingestion_service, "get_dedupe_index", lambda: DedupeIndex(str(tmp_path / "dedupe.sqlite3")))
+        registry = DocumentRegistry(str(tmp_path / "documents.sqlite3"))
+        registry.register("doc", "notes.txt", "text")
+        monkeypatch.setattr(ingestion_service, "get_document_registry", lambda: registry)
+        monkeypatch.setattr(settings, "chunking_mode", "chars")
+        monkeypatch.setattr(settings, "ingest_batch_size", 4)
+        
+        text = " ".join(f"Fact {i} about the water cycle." for i in range(2000))
+        file_path = tmp_path / "notes.txt"
+        file_path.write_text(text, encoding="utf-8")
+        
+        chunks = ingestion_service.iter_text_file_chunks(str(file_path), "doc", "notes.txt")
+        asyncio.run(ingestion_service.process_and_store_chunks(chunks, "doc", "notes.txt"))
+        
+        expected = chunk_text(text, chunk_size=settings.chunk_size, chunk_overlap=settings.chunk_overlap)
+        assert store.upserted == len(expected)
+        assert max(store.batch_sizes) == 4
+        assert sorted(payload["text"] for payload in store.points.values()) == sorted(expected)
+        assert registry.get("doc")["chunk_count"] == len(expected)
+
+    def test_editing_a_slide_reembeds_only_its_neighbours(self, monkeypatch, tmp_path):
+        """Packed chunks away from an edited page keep their IDs and are not embedded again"""
+        import asyncio
+        from app.services import ingestion_service
+        from app.core.config import settings
+        from app.core.embeddings import EmbeddingsService
+        from app.core.embedding_backends import HashingEmbeddingBackend
+        from app.core.document_registry import DocumentRegistry
+        service = EmbeddingsService(backend=HashingEmbeddingBackend(dimension=8))
+        service.cache = None
+        store = FakeAsyncStore()
+        monkeypatch.setattr(ingestion_service, "vector_store", store)
+        monkeypatch.setattr(ingestion_service, "get_embeddings_service", lambda: service)
+        monkeypatch.setattr(ingestion_service, "get_dedupe_index", lambda: None)
+        registry = DocumentRegistry(str(tmp_path / "documents.sqlite3"))
+        registry.register("doc", "slides.pdf", "pdf")
+        monkeypatch.setattr(ingestion_service, "get_document_registry", lambda: registry)
+        monkeypatch.setattr(settings, "chunking_mode", "chars")
+        monkeypatch.setattr(settings, "pdf_chunking", "packed")
+        
+        slides = [f"Slide {i}: key idea number {i} explained in one short sentence about topic {i * 7 % 13}."
+                  for i in range(1, 301)]
+        
+        def ingest():
+            chunks = ingestion_service._pdf_page_chunks(slides, "doc", "slides.pdf")
+            asyncio.run(ingestion_service.process_and_store_chunks(chunks, "doc", "slides.pdf"))
+            return len(chunks)
+        
+        total = ingest()
+        slides[150] = "Slide 151: this slide was rewritten with a longer explanation of the idea. " * 3
+        ingest()
+        
+        assert total >= 20
+        assert store.upserted - total <= 3
+        assert any(payload["metadata"]["page_start"] <= 151 <= payload["metadata"]["page_end"]
+                   and "rewritten" in payload["text"] for payload in store.points.values())
@@ -0,0 +1,110 @@
+"""
+Unit tests for near-duplicate chunk suppression
+"""
+import pytest
+import asyncio
+import numpy as np
+import sys
+import os
+
+# Add the app directory to Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.core.config import settings
+from app.core.dedupe import DedupeIndex, MinHasher, similarity
+from app.core.vector_store import LocalVectorStore, collapse_duplicates
+
+LECTURE = (
+    "Photosynthesis converts light energy into chemical energy stored in glucose. "
+    "The light dependent reactions take place in the thylakoid membranes, where water is split "
+    "and oxygen is released. The Calvin cycle in the stroma fixes carbon dioxide into sugars "
+    "using ATP and NADPH produced by the light reactions."
+)
+
+HANDOUT = LECTURE.replace("Photosynthesis", "PHOTOSYNTHESIS").replace("  ", " ") + " (Handout)"
+
+OTHER = (
+    "Newton's second law states that the net force on a body equals its mass times its "
+    "acceleration. Momentum is conserved in a closed system, and impulse equals the change "
+    "in momentum over the duration of the collision."
+)
+
+class CountingEmbeddings:
+    """Embeddings service stand-in that counts embedded texts"""
+    
+    def __init__(self):
+        self.embedded = 0
+    
+    async def aembed_texts(self, texts):
+        # A distinct basis vector per embedded text
+        vectors = np.eye(4, dtype=np.float32)[self.embedded:self.embedded + len(texts)]
+        self.embedded += len(texts)
+        return vectors
+
+class TestMinHash:
+    """Test signature similarity estimates"""
+    
+    def test_near_duplicates_score_high(self):
+        """Case and punctuation changes keep the estimate high, unrelated text scores low"""
+        hasher = MinHasher()
+        
+        assert similarity(hasher.signature(LECTURE), hasher.signature(HANDOUT)) > 0.85
+        assert similarity(hasher.signature(LECTURE), hasher.signature(OTHER)) < 0.2
+    
+    def test_signatures_are_deterministic(self):
+        """Signatures are persisted, so they must not depend on the process"""
+        assert (MinHasher().signature(LECTURE) == MinHasher().signature(LECTURE)).all()
+
+class TestDedupeIndex:
+    """Test the LSH index and the ingestion stage"""
+    
+    def test_document_duplicates_are_dropped(self, tmp_path):
+        """Later near-duplicates of a chunk in the same document are dropped"""
+        index = DedupeIndex(str(tmp_path / "dedupe.sqlite3"))
+        deduper = index.document_deduper("doc")
+        kept, signatures = deduper.filter([{"chunk_id": "c0", "text": LECTURE}, {"chunk_id": "c1", "text": OTHER}])
+        assert [chunk["chunk_id"] for chunk in kept] == ["c0", "c1"]
+        assert len(signatures) == 2
+        
+        # Later batches are compared against the chunks kept so far
+        kept, _ = deduper.filter([{"chunk_id": "c2", "text": HANDOUT}])
+        assert kept == []
+        assert index.count() == 2
+        
+        # Other documents are not compared in document scope
+        kept, _ = index.document_deduper("other").filter([{"chunk_id": "c0", "text": LECTURE}])
+        assert len(kept) == 1
+        
+        index.delete_document("doc")
+        assert index.count() == 1
+    
+    def test_corpus_duplicates_reuse_vectors(self, monkeypatch, tmp_path):
+        """A chunk duplicating another document is stored with that document's vector"""
+        from app.services import ingestion_service
+        from app.core.document_registry import DocumentRegistry
+        store = LocalVectorStore(str(tmp_path / "index"), vector_size=4)
+        index = DedupeIndex(str(tmp_path / "dedupe.sqlite3"))
+        service = CountingEmbeddings()
+        registry = DocumentRegistry(str(tmp_path / "documents.sqlite3"))
+        monkeypatch.setattr(ingestion_service, "vector_store", store)
+        monkeypatch.setattr(ingestion_service, "get_embeddings_service", lambda: service)
+        monkeypatch.setattr(ingestion_service, "get_dedupe_index", lambda: index)
+        monkeypatch.setattr(ingestion_service, "get_document_registry", lambda: registry)
+        monkeypatch.setattr(settings, "dedupe_scope", "corpus")
+        
+        for doc_id, texts in (("slides", [LECTURE, OTHER, LECTURE]), ("handout", [HANDOUT])):
+            registry.register(doc_id, f"{doc_id}.pdf", "pdf")
+            chunks = [{"chunk_id": f"{doc_id}_chunk_{i}", "text": text} for i, text in enumerate(texts)]
+            asyncio.run(ingestion_service.process_and_store_chunks(chunks, doc_id, f"{doc_id}.pdf"))
+        
+        assert service.embedded == 2
+        assert store.count() == 3
+        assert registry.get("slides")["metadata"]["duplicate_chunks"] == 1
+        assert registry.get("handout")["metadata"]["linked_chunks"] == 1
+        
+        # The linked copy and the chunk it duplicates take a single retrieval slot
+        (handout_id, vector), = store.get_vectors_sync(list(store.get_chunk_hashes_sync("handout"))).items()
+        results = store.query_chunks_sync(vector, top_k=5)
+        assert handout_id in {result["id"] for result in results[:2]}
+        assert results[0]["score"] == pytest.approx(results[1]["score"])
+        assert len(collapse_duplicates(results[:2])) == 1
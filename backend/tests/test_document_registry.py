@@ -0,0 +1,86 @@
+"""
+Unit tests for the document registry
+"""
+import pytest
+import asyncio
+import sys
+import os
+import numpy as np
+
+# Add the app directory to Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.core.document_registry import DocumentRegistry
+from app.core.vector_store import LocalVectorStore
+from app.services.registry_migration import backfill_registry
+
+class TestDocumentRegistry:
+    """Test document registration, status updates and listing"""
+    
+    def test_lifecycle(self, tmp_path):
+        """A document goes from processing to completed with its timings"""
+        registry = DocumentRegistry(str(tmp_path / "documents.sqlite3"))
+        registry.register("doc-1", "notes.pdf", "pdf", size_bytes=1234, content_hash="abc",
+                          chunk_count=7, metadata={"total_pages": 3})
+        
+        assert registry.get("doc-1")["status"] == "processing"
+        
+        registry.mark_completed("doc-1", chunk_count=6, timings={"total_seconds": 1.5})
+        document = registry.get("doc-1")
+        assert document["status"] == "completed"
+        assert document["chunk_count"] == 6
+        assert document["timings"] == {"total_seconds": 1.5}
+        assert document["metadata"] == {"total_pages": 3}
+        assert registry.get("missing") is None
+    
+    def test_failure_and_reregistration(self, tmp_path):
+        """A failed document is reset to processing when uploaded again"""
+        registry = DocumentRegistry(str(tmp_path / "documents.sqlite3"))
+        registry.register("doc-1", "notes.pdf", "pdf")
+        registry.mark_failed("doc-1", "boom")
+        assert registry.get("doc-1")["error"] == "boom"
+        
+        registry.register("doc-1", "notes-v2.pdf", "pdf")
+        document = registry.get("doc-1")
+        assert document["status"] == "processing"
+        assert document["error"] is None
+        assert document["filename"] == "notes-v2.pdf"
+        assert registry.count() == 1
+    
+    def test_list_and_delete(self, tmp_path):
+        """Documents are listed newest first and can be removed"""
+        registry = DocumentRegistry(str(tmp_path / "documents.sqlite3"))
+        for i in range(3):
+            registry.register(f"doc-{i}", f"file-{i}.txt", "text")
+        
+        assert [doc["doc_id"] for doc in registry.list_documents(limit=2)] == ["doc-2", "doc-1"]
+        assert registry.delete("doc-1")["filename"] == "file-1.txt"
+        assert registry.delete("doc-1") is None
+        assert registry.count() == 2
+
+    def test_backfill_from_vector_store(self, tmp_path):
+        """Documents ingested before the registry existed are registered once"""
+        store = LocalVectorStore(str(tmp_path / "index"), vector_size=4)
+        vectors = np.random.default_rng(0).standard_normal((5, 4)).astype(np.float32)
+        store.add_chunks_sync([{"text": f"page {i}", "filename": "book.pdf"} for i in range(3)], vectors[:3], "old-1")
+        store.add_chunks_sync([{"text": f"row {i}", "filename": "grades.xlsx"} for i in range(2)], vectors[3:], "old-2")
+        uploads = tmp_path / "uploads"
+        uploads.mkdir()
+        (uploads / "old-1_book.pdf").write_bytes(b"%PDF-1.4 stored upload")
+        
+        registry = DocumentRegistry(str(tmp_path / "documents.sqlite3"))
+        registry.register("old-2", "grades.xlsx", "excel", chunk_count=2)
+        
+        added = asyncio.run(backfill_registry(store=store, registry=registry, upload_dir=str(uploads)))
+        assert added == 1
+        document = registry.get("old-1")
+        assert document["status"] == "completed"
+        assert document["file_type"] == "pdf"
+        assert document["chunk_count"] == 3
+        assert document["file_path"] == str(uploads / "old-1_book.pdf")
+        assert document["size_bytes"] == len(b"%PDF-1.4 stored upload")
+        assert registry.get("old-2")["status"] == "processing"
+        
+        registry.delete("old-1")
+        assert asyncio.run(backfill_registry(store=store, registry=registry, upload_dir=str(uploads))) == 0
+        assert registry.get("old-1") is None
@@ -0,0 +1,97 @@
+"""
+Unit tests for the persistent embedding cache
+"""
+import pytest
+import numpy as np
+import sys
+import os
+
+# Add the app directory to Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.core.embedding_cache import EmbeddingCache
+
+class TestEmbeddingCache:
+    """Test cache lookups, storage and eviction"""
+    
+    def test_roundtrip_float32(self, tmp_path):
+        """Stored vectors come back exactly and count as hits"""
+        cache = EmbeddingCache(str(tmp_path / "cache.sqlite3"), max_bytes=1024 * 1024)
+        vector = [0.25, -0.5, 0.125]
+        
+        assert cache.get_many("model-a", ["hello"]) == [None]
+        cache.put_many("model-a", ["hello"], [vector])
+        
+        cached = cache.get_many("model-a", ["hello", "other"])
+        assert cached[0].dtype == np.float32
+        assert cached[0].tolist() == vector
+        assert cached[1] is None
+        
+        stats = cache.stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 2
+        assert stats["entries"] == 1
+    
+    def test_keys_include_model(self, tmp_path):
+        """The same text embedded by another model is a miss"""
+        cache = EmbeddingCache(str(tmp_path / "cache.sqlite3"), max_bytes=1024 * 1024)
+        cache.put_many("model-a", ["hello"], [[1.0, 2.0]])
+        
+        assert cache.get_many("model-b", ["hello"]) == [None]
+    
+    def test_int8_quantization(self, tmp_path):
+        """int8 vectors are compact and close to the original"""
+        cache = EmbeddingCache(str(tmp_path / "cache.sqlite3"), max_bytes=1024 * 1024, dtype="int8")
+        vector = np.linspace(-1.0, 1.0, 64, dtype=np.float32)
+        cache.put_many("model-a", ["hello"], [vector])
+        
+        cached = cache.get_many("model-a", ["hello"])[0]
+        assert np.allclose(cached, vector, atol=1.0 / 127)
+        assert cache.stats()["bytes"] == 64
+    
+    def test_lru_eviction(self, tmp_path):
+        """Least recently used entries are evicted once over the size limit"""
+        vector = np.ones(16, dtype=np.float32)  # 64 bytes each
+        cache = EmbeddingCache(str(tmp_path / "cache.sqlite3"), max_bytes=64 * 3)
+        
+        cache.put_many("m", ["a", "b", "c"], [vector] * 3)
+        cache.get_many("m", ["a"])  # "b" is now the oldest entry
+        cache.put_many("m", ["d"], [vector])
+        
+        cached = cache.get_many("m", ["a", "b", "c", "d"])
+        assert cached[0] is not None
+        assert cached[1] is None
+        assert cache.stats()["bytes"] <= 64 * 3
+    
+    def test_shared_between_instances(self, tmp_path):
+        """Separate instances (e.g. uvicorn workers) share entries and counters"""
+        path = str(tmp_path / "cache.sqlite3")
+        writer = EmbeddingCache(path, max_bytes=1024 * 1024)
+        reader = EmbeddingCache(path, max_bytes=1024 * 1024)
+        
+        writer.put_many("m", ["shared"], [[0.5, 0.5]])
+        assert reader.get_many("m", ["shared"])[0] is not None
+        reader.flush()
+        assert writer.stats()["hits"] == 1
+
+    def test_lookups_do_not_take_the_write_lock(self, tmp_path):
+        """Reads succeed while another worker holds the write lock; access times are flushed later"""
+        import sqlite3
+        path = str(tmp_path / "cache.sqlite3")
+        cache = EmbeddingCache(path, max_bytes=1024 * 1024, flush_seconds=3600)
+        cache.put_many("m", ["hello"], [[1.0, 2.0]])
+        
+        other = sqlite3.connect(path, isolation_level=None)
+        other.execute("BEGIN IMMEDIATE")
+        try:
+            assert cache.get_many("m", ["hello", "other"])[0] is not None
+        finally:
+            other.execute("ROLLBACK")
+        
+        counters = dict(other.execute("SELECT name, value FROM stats").fetchall())
+        assert counters["hits"] == 0
+        
+        cache.flush()
+        counters = dict(other.execute("SELECT name, value FROM stats").fetchall())
+        assert (counters["hits"], counters["misses"]) == (1, 1)
+        other.close()
@@ -0,0 +1,230 @@
+"""
+Unit tests for EmbeddingsService batching and dispatch
+"""
+import pytest
+import asyncio
+import sys
+import os
+from types import SimpleNamespace
+
+# Add the app directory to Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.core.embeddings import EmbeddingsService
+from app.core.embedding_cache import EmbeddingCache
+from app.core.embedding_backends import OpenAIEmbeddingBackend
+
+def fake_response(inputs):
+    """Embeddings API response where each vector encodes its input length"""
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    return SimpleNamespace(data=[SimpleNamespace(embedding=[float(len(text)), 1.0]) for text in inputs])
+
+class FakeAsyncEmbeddings:
+    """Async embeddings endpoint that records request concurrency"""
+    
+    def __init__(self):
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+    
+    async def create(self, input, model, **kwargs):
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        # Finish later batches first to check that order is preserved
+        await asyncio.sleep(0.01 / self.calls)
+        self.in_flight -= 1
+        return fake_response(input)
+
+@pytest.fixture
+def service():
+    """Service with 2-d vectors, no cache and no network access"""
+    service = EmbeddingsService(backend=OpenAIEmbeddingBackend(api_key="test-key", dimension=2))
+    service.cache = None
+    return service
+
+class TestAsyncEmbedding:
+    """Test the concurrent async embedding path"""
+    
+    def test_order_and_concurrency_limit(self, service, monkeypatch):
+        """Batches run concurrently up to the limit and keep input order"""
+        from app.core import embeddings as embeddings_module
+        monkeypatch.setattr(embeddings_module.settings, "embedding_max_concurrency", 3)
+        monkeypatch.setattr(embeddings_module.settings, "embedding_max_batch_size", 100)
+        fake = FakeAsyncEmbeddings()
+        service.backend.async_client = SimpleNamespace(embeddings=fake)
+        
+        texts = ["x" * (i % 50 + 1) + str(i) for i in range(950)]
+        vectors = asyncio.run(service.aembed_texts(texts))
+        
+        assert [vector[0] for vector in vectors] == [float(len(text)) for text in texts]
+        assert fake.calls == 10
+        assert fake.max_in_flight == 3
+    
+    def test_cached_texts_skip_api(self, service, tmp_path):
+        """Only uncached, distinct texts are sent to the API"""
+        service.cache = EmbeddingCache(str(tmp_path / "cache.sqlite3"), max_bytes=1024 * 1024)
+        service.cache.put_many(service.vector_space, ["cached"], [[9.0, 9.0]])
+        fake = FakeAsyncEmbeddings()
+        service.backend.async_client = SimpleNamespace(embeddings=fake)
+        
+        vectors = asyncio.run(service.aembed_texts(["cached", "new", "new"]))
+        
+        assert vectors.tolist() == [[9.0, 9.0], [3.0, 1.0], [3.0, 1.0]]
+        assert fake.calls == 1
+    
+    def test_shortened_vectors_do_not_share_cache_entries(self, tmp_path):
+        """A full-size cached vector is not returned by a backend with a shorter EMBEDDING_DIMENSION"""
+        cache = EmbeddingCache(str(tmp_path / "cache.sqlite3"), max_bytes=1024 * 1024)
+        full = EmbeddingsService(backend=OpenAIEmbeddingBackend(api_key="test-key", model="text-embedding-3-small"))
+        short = EmbeddingsService(backend=OpenAIEmbeddingBackend(api_key="test-key", model="text-embedding-3-small",
+                                                                 dimension=2))
+        full.cache = short.cache = cache
+        cache.put_many(full.vector_space, ["syllabus"], [[0.5] * 1536])
+        fake = FakeAsyncEmbeddings()
+        short.backend.async_client = SimpleNamespace(embeddings=fake)
+        
+        vectors = asyncio.run(short.aembed_texts(["syllabus"]))
+        
+        assert full.model == short.model
+        assert full.vector_space != short.vector_space
+        assert vectors.tolist() == [[8.0, 1.0]]
+        assert fake.calls == 1
+
+class FakeEmbeddings:
+    """Sync embeddings endpoint that records each request's inputs"""
+    
+    def __init__(self):
+        self.requests = []
+    
+    def create(self, input, model, **kwargs):
+        self.requests.append(list(input))
+        return fake_response(input)
+
+class TestTokenAwareBatching:
+    """Test token-budget packing and oversize input splitting"""
+    
+    def test_batches_respect_token_budget(self, service, monkeypatch):
+        """No request exceeds the per-request token budget"""
+        from app.core import embeddings as embeddings_module
+        from app.core.tokenizer import count_tokens
+        monkeypatch.setattr(embeddings_module.settings, "embedding_max_batch_tokens", 200)
+        fake = FakeEmbeddings()
+        service.backend.client = SimpleNamespace(embeddings=fake)
+        
+        texts = [("word " * (i % 40 + 1)) + str(i) for i in range(100)]
+        vectors = service.embed_texts(texts)
+        
+        assert len(vectors) == len(texts)
+        assert all(sum(count_tokens(text) for text in batch) <= 200 for batch in fake.requests)
+        assert sum(len(batch) for batch in fake.requests) == len(texts)
+    
+    def test_oversize_input_is_split_and_pooled(self, service):
+        """Inputs over the model context are split and pooled into one unit vector"""
+        from app.core.tokenizer import count_tokens
+        fake = FakeEmbeddings()
+        service.backend.client = SimpleNamespace(embeddings=fake)
+        service.backend.max_input_tokens = 50
+        
+        long_text = "lorem ipsum dolor sit amet " * 40
+        vectors = service.embed_texts(["short", long_text])
+        
+        pieces = [text for batch in fake.requests for text in batch]
+        assert len(pieces) > 2
+        assert all(count_tokens(piece) <= 50 for piece in pieces)
+        assert len(vectors) == 2
+        assert abs(sum(value * value for value in vectors[1]) - 1.0) < 1e-5
+        assert vectors[0].tolist() == [5.0, 1.0]
+
+class TestQueryCoalescing:
+    """Test micro-batching of concurrent query embeddings"""
+    
+    def test_concurrent_queries_share_requests(self, service):
+        """Queries arriving together are embedded in one request"""
+        from app.core.embeddings import QueryCoalescer
+        fake = FakeEmbeddings()
+        service.backend.client = SimpleNamespace(embeddings=fake)
+        service.coalescer = QueryCoalescer(service._embed_and_cache, window_ms=50, max_batch=64)
+        
+        queries = [f"question {i}" + "?" * i for i in range(20)]
+        
+        async def ask_all():
+            return await asyncio.gather(*[service.aembed_query(query) for query in queries])
+        
+        vectors = asyncio.run(ask_all())
+        
+        assert [vector[0] for vector in vectors] == [float(len(query)) for query in queries]
+        assert len(fake.requests) < 5
+        assert service.coalescer.stats()["queries"] == 20
+    
+    def test_batch_size_cap(self, service):
+        """A batch never exceeds max_batch queries"""
+        from app.core.embeddings import QueryCoalescer
+        fake = FakeEmbeddings()
+        service.backend.client = SimpleNamespace(embeddings=fake)
+        service.coalescer = QueryCoalescer(service._embed_and_cache, window_ms=50, max_batch=4)
+        
+        futures = [service.coalescer.submit(f"q{i}") for i in range(10)]
+        results = [future.result(timeout=5) for future in futures]
+        
+        assert len(results) == 10
+        assert max(len(batch) for batch in fake.requests) <= 4
+
+class TestHashingBackend:
+    """Test the local CPU embedding backend"""
+    
+    def test_vectors_are_deterministic_and_normalized(self):
+        """Same text gives the same unit vector of the configured size"""
+        from app.core.embedding_backends import HashingEmbeddingBackend
+        backend = HashingEmbeddingBackend(dimension=256)
+        
+        first, second = backend.embed(["Photosynthesis converts light", "Photosynthesis converts light"])
+        
+        assert len(first) == 256
+        assert (first == second).all()
+        assert abs(sum(value * value for value in first) - 1.0) < 1e-5
+    
+    def test_similar_texts_score_higher(self):
+        """Overlapping texts are closer than unrelated ones"""
+        from app.core.embedding_backends import HashingEmbeddingBackend
+        backend = HashingEmbeddingBackend(dimension=512)
+        
+        query, related, unrelated = backend.embed([
+            "how does photosynthesis work in plants",
+            "Photosynthesis in plants converts light energy into chemical energy",
+            "The French revolution began in 1789"
+        ])
+        dot = lambda a, b: sum(x * y for x, y in zip(a, b))
+        
+        assert dot(query, related) > dot(query, unrelated)
+    
+    def test_service_without_api_key(self):
+        """The service runs on the local backend with no OpenAI key"""
+        from app.core.embedding_backends import HashingEmbeddingBackend
+        service = EmbeddingsService(backend=HashingEmbeddingBackend(dimension=64))
+        service.cache = None
+        service.coalescer = None
+        
+        assert service.model == "hashing-64"
+        assert len(service.embed_query("hello")) == service.dimension == 64
+
+class TestOpenAIBackend:
+    """Test response decoding of the OpenAI backend"""
+    
+    def test_base64_response_decodes_to_float32(self):
+        """base64 embeddings are decoded without going through Python floats"""
+        import base64
+        import numpy as np
+        backend = OpenAIEmbeddingBackend(api_key="test-key", dimension=3)
+        vector = np.array([0.5, -0.25, 1.0], dtype=np.float32)
+        encoded = base64.b64encode(vector.tobytes()).decode()
+        backend.client = SimpleNamespace(embeddings=SimpleNamespace(
+            create=lambda **kwargs: SimpleNamespace(data=[SimpleNamespace(embedding=encoded)] * 2)
+        ))
+        
+        matrix = backend.embed(["a", "b"])
+        
+        assert matrix.dtype == np.float32
+        assert matrix.shape == (2, 3)
+        assert matrix[1].tolist() == [0.5, -0.25, 1.0]
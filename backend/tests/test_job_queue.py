@@ -0,0 +1,252 @@
+"""
+Unit tests for the ingestion job queue and workers
+"""
+import pytest
+import asyncio
+import time
+import sys
+import os
+
+# Add the app directory to Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.core.config import settings
+from app.core.document_registry import DocumentRegistry
+from app.core.job_queue import JobQueue
+from app.core.vector_store import LocalVectorStore
+from app.services import ingestion_service
+
+class TestJobQueue:
+    """Test job states, retries and recovery"""
+    
+    def test_claim_and_complete(self, tmp_path):
+        """A job is claimed once, moves through its states and finishes"""
+        queue = JobQueue(str(tmp_path / "jobs.sqlite3"))
+        job = queue.enqueue("doc", "text", {"file_path": "notes.txt", "filename": "notes.txt"})
+        assert job["state"] == "queued"
+        
+        claimed = queue.claim()
+        assert claimed["job_id"] == job["job_id"]
+        assert claimed["state"] == "extracting"
+        assert claimed["attempts"] == 1
+        assert queue.claim() is None
+        
+        queue.set_state(job["job_id"], "embedding")
+        assert queue.get(job["job_id"])["state"] == "embedding"
+        
+        queue.complete(job["job_id"], {"chunk_count": 3})
+        done = queue.get(job["job_id"])
+        assert done["state"] == "done"
+        assert done["result"] == {"chunk_count": 3}
+    
+    def test_jobs_of_a_running_document_wait(self, tmp_path):
+        """A document's next job is not claimed while another of its jobs runs"""
+        queue = JobQueue(str(tmp_path / "jobs.sqlite3"))
+        first = queue.enqueue("doc", "text", {})
+        second = queue.enqueue("doc", "text", {})
+        other = queue.enqueue("other", "text", {})
+        
+        assert queue.claim()["job_id"] == first["job_id"]
+        assert queue.claim()["job_id"] == other["job_id"]
+        assert queue.claim() is None
+        
+        queue.complete(first["job_id"])
+        assert queue.claim()["job_id"] == second["job_id"]
+    
+    def test_idle_claim_does_not_take_the_write_lock(self, tmp_path):
+        """Polling an empty queue doesn't wait for another writer"""
+        import sqlite3
+        queue = JobQueue(str(tmp_path / "jobs.sqlite3"))
+        writer = sqlite3.connect(queue.path, isolation_level=None)
+        writer.execute("BEGIN IMMEDIATE")
+        try:
+            started = time.monotonic()
+            assert queue.claim() is None
+            assert time.monotonic() - started < 1
+        finally:
+            writer.execute("ROLLBACK")
+    
+    def test_cancelled_jobs_stay_failed(self, tmp_path):
+        """Jobs of a deleted document are failed and a running one can't complete afterwards"""
+        queue = JobQueue(str(tmp_path / "jobs.sqlite3"))
+        running = queue.enqueue("doc", "text", {})
+        queued = queue.enqueue("doc", "text", {})
+        queue.claim()
+        
+        assert queue.cancel_document("doc") == 2
+        queue.complete(running["job_id"], {"chunk_count": 3})
+        
+        assert queue.get(running["job_id"])["state"] == "failed"
+        assert queue.get(queued["job_id"])["error"] == "Document was deleted"
+        assert queue.claim() is None
+    
+    def test_failures_back_off_then_fail(self, tmp_path):
+        """Failed attempts are requeued with doubling delays until attempts run out"""
+        queue = JobQueue(str(tmp_path / "jobs.sqlite3"), max_attempts=2, backoff_seconds=10)
+        job = queue.enqueue("doc", "text", {})
+        
+        queue.claim()
+        retried = queue.fail(job["job_id"], "rate limited")
+        assert retried["state"] == "queued"
+        assert retried["run_after"] >= time.time() + 9
+        assert queue.claim() is None  # not runnable before the backoff
+        
+        queue._connect().execute("UPDATE jobs SET run_after = 0")
+        queue.claim()
+        failed = queue.fail(job["job_id"], "rate limited")
+        assert failed["state"] == "failed"
+        assert failed["attempts"] == 2
+    
+    def test_permanent_errors_are_not_retried(self, tmp_path):
+        """retry=False fails the job on its first attempt"""
+        queue = JobQueue(str(tmp_path / "jobs.sqlite3"))
+        job = queue.enqueue("doc", "text", {})
+        queue.claim()
+        
+        assert queue.fail(job["job_id"], "No text found in document", retry=False)["state"] == "failed"
+    
+    def test_expired_leases_are_requeued(self, tmp_path):
+        """Jobs of a worker that stopped renewing its lease run again"""
+        queue = JobQueue(str(tmp_path / "jobs.sqlite3"), lease_seconds=-1)
+        job = queue.enqueue("doc", "text", {})
+        queue.claim()
+        
+        recovered, = queue.requeue_expired()
+        
+        assert recovered["job_id"] == job["job_id"]
+        assert recovered["state"] == "queued"
+        assert queue.claim()["attempts"] == 2
+    
+    def test_released_jobs_keep_their_attempts(self, tmp_path):
+        """A job interrupted by shutdown goes back to the queue unchanged"""
+        queue = JobQueue(str(tmp_path / "jobs.sqlite3"))
+        job = queue.enqueue("doc", "text", {})
+        queue.claim()
+        
+        queue.release(job["job_id"])
+        
+        released = queue.get(job["job_id"])
+        assert released["state"] == "queued"
+        assert released["attempts"] == 0
+
+class TestIngestionWorkers:
+    """Test jobs run by the worker pool"""
+    
+    @pytest.fixture
+    def ingestion(self, monkeypatch, tmp_path):
+        """Queue, registry and local vector store wired into the ingestion service"""
+        from app.core.embeddings import EmbeddingsService
+        from app.core.embedding_backends import HashingEmbeddingBackend
+        service = EmbeddingsService(backend=HashingEmbeddingBackend(dimension=8))
+        service.cache = None
+        queue = JobQueue(str(tmp_path / "jobs.sqlite3"), backoff_seconds=0)
+        registry = DocumentRegistry(str(tmp_path / "documents.sqlite3"))
+        store = LocalVectorStore(str(tmp_path / "index"), vector_size=8)
+        monkeypatch.setattr(ingestion_service, "vector_store", store)
+        monkeypatch.setattr(ingestion_service, "get_embeddings_service", lambda: service)
+        monkeypatch.setattr(ingestion_service, "get_document_registry", lambda: registry)
+        monkeypatch.setattr(settings, "dedupe_scope", "off")
+        return queue, registry, store
+    
+    def run_until_finished(self, queue, job_ids):
+        """Run two workers until every job is done or failed"""
+        async def run():
+            workers = ingestion_service.IngestionWorkers(queue, workers=2, poll_interval=0.01)
+            await workers.start()
+            try:
+                while any(queue.get(job_id)["state"] not in ("done", "failed") for job_id in job_ids):
+                    await asyncio.sleep(0.01)
+            finally:
+                await workers.stop()
+        asyncio.run(asyncio.wait_for(run(), timeout=30))
+    
+    def test_text_job_is_ingested(self, ingestion, tmp_path):
+        """A queued text upload is chunked, embedded and stored by a worker"""
+        queue, registry, store = ingestion
+        file_path = tmp_path / "notes.txt"
+        file_path.write_text("The water cycle moves water between the oceans, air and land.", encoding="utf-8")
+        registry.register("doc", "notes.txt", "text", file_path=str(file_path))
+        job = queue.enqueue("doc", "text", {"file_path": str(file_path), "filename": "notes.txt"})
+        
+        self.run_until_finished(queue, [job["job_id"]])
+        
+        done = queue.get(job["job_id"])
+        assert done["state"] == "done"
+        assert done["result"]["chunk_count"] == 1
+        assert registry.get("doc")["status"] == "completed"
+        assert store.count() == 1
+    
+    def test_document_deleted_during_ingestion(self, ingestion, monkeypatch, tmp_path):
+        """A running job stops at the next batch and removes the points it stored"""
+        queue, registry, store = ingestion
+        service = ingestion_service.get_embeddings_service()
+        aembed_texts = service.aembed_texts
+        monkeypatch.setattr(settings, "chunking_mode", "chars")
+        monkeypatch.setattr(settings, "ingest_batch_size", 2)
+        
+        async def embed_then_delete(texts):
+            # The delete request arrives while the first batch is embedded
+            if registry.get("doc") is not None:
+                queue.cancel_document("doc")
+                await store.delete_document("doc")
+                registry.delete("doc")
+            return await aembed_texts(texts)
+        
+        monkeypatch.setattr(service, "aembed_texts", embed_then_delete)
+        file_path = tmp_path / "notes.txt"
+        file_path.write_text(" ".join(f"Fact {i} about the water cycle." for i in range(500)), encoding="utf-8")
+        registry.register("doc", "notes.txt", "text", file_path=str(file_path))
+        job = queue.enqueue("doc", "text", {"file_path": str(file_path), "filename": "notes.txt"})
+        
+        asyncio.run(ingestion_service.run_job(queue, queue.claim()))
+        
+        assert queue.get(job["job_id"])["state"] == "failed"
+        assert store.count() == 0
+        assert registry.get("doc") is None
+    
+    def test_failing_job_is_retried_then_failed(self, ingestion, monkeypatch, tmp_path):
+        """Errors are retried up to max_attempts and then fail the document"""
+        queue, registry, _ = ingestion
+        calls = []
+        
+        async def failing_handler(job, on_stage):
+            calls.append(job["attempts"])
+            raise RuntimeError("embedding service unavailable")
+        
+        monkeypatch.setitem(ingestion_service.JOB_HANDLERS, "text", failing_handler)
+        file_path = tmp_path / "notes.txt"
+        file_path.write_text("text", encoding="utf-8")
+        registry.register("doc", "notes.txt", "text", file_path=str(file_path))
+        job = queue.enqueue("doc", "text", {"file_path": str(file_path), "filename": "notes.txt"})
+        
+        self.run_until_finished(queue, [job["job_id"]])
+        
+        assert calls == [1, 2, 3]
+        assert queue.get(job["job_id"])["state"] == "failed"
+        assert registry.get("doc")["status"] == "failed"
+        assert registry.get("doc")["error"] == "embedding service unavailable"
+
+    def test_same_document_jobs_never_overlap(self, ingestion, monkeypatch, tmp_path):
+        """Two workers run two jobs of one document one after the other"""
+        queue, registry, _ = ingestion
+        running = []
+        overlaps = []
+        
+        async def slow_handler(job, on_stage):
+            overlaps.append(len(running))
+            running.append(job["job_id"])
+            await asyncio.sleep(0.05)
+            running.remove(job["job_id"])
+            return {"chunk_count": 1}
+        
+        monkeypatch.setitem(ingestion_service.JOB_HANDLERS, "text", slow_handler)
+        file_path = tmp_path / "notes.txt"
+        file_path.write_text("text", encoding="utf-8")
+        registry.register("doc", "notes.txt", "text", file_path=str(file_path))
+        jobs = [queue.enqueue("doc", "text", {"file_path": str(file_path), "filename": "notes.txt"})
+                for _ in range(2)]
+        
+        self.run_until_finished(queue, [job["job_id"] for job in jobs])
+        
+        assert overlaps == [0, 0]
+        assert all(queue.get(job["job_id"])["state"] == "done" for job in jobs)
@@ -0,0 +1,128 @@
+"""
+Unit tests for PDF text cleanup
+"""
+import pytest
+import asyncio
+import sys
+import os
+
+# Add the app directory to Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.core.config import settings
+from app.services import pdf_service
+from app.services.pdf_service import clean_pdf_pages, extract_page_range, normalize_whitespace, strip_boilerplate
+
+TOPICS = ["Sorting", "Searching", "Hash tables", "Graphs"]
+
+def lecture_pages(count=12):
+    """Slide-like pages with a running header, footer and page numbers"""
+    return [
+        f"CS 101 – Introduction to Algorithms   Fall 2024\n"
+        f"Lecture {i}:  {TOPICS[i % 4]}\n"
+        f"{TOPICS[i % 4]} is covered with worked examples in section {i}, and the exercises "
+        f"at the end of the slide\nrevisit {TOPICS[(i + 1) % 4].lower()} from lecture {i - 1}.\n"
+        f"© 2024 University of Somewhere. All rights reserved.\n"
+        f"Page {i} of {count}"
+        for i in range(1, count + 1)
+    ]
+
+class TestCleanup:
+    """Test whitespace normalization and boilerplate stripping"""
+    
+    def test_normalize_whitespace(self):
+        """Space runs, hyphenated breaks, stray spaces and blank line runs are collapsed"""
+        text = "Merge  sort  is   a divide-\nand-conquer algo-\nrithm .\n\n\n\nNext   para  "
+        
+        assert normalize_whitespace(text) == "Merge sort is a divideand-conquer algorithm.\n\nNext para"
+    
+    def test_repeated_edge_lines_are_removed(self):
+        """Headers, footers and page numbers go; page content stays"""
+        pages, removed = strip_boilerplate([normalize_whitespace(page) for page in lecture_pages()])
+        
+        assert removed == 12 * 3
+        assert pages[0] == (
+            "Lecture 1: Searching\n"
+            "Searching is covered with worked examples in section 1, and the exercises "
+            "at the end of the slide\nrevisit hash tables from lecture 0."
+        )
+    
+    def test_page_numbers_follow_the_page_index(self):
+        """Numbers are page numbers only when they count up with the pages, at any offset"""
+        pages = [f"{topic}, explained with examples\n{i + 9}" for i, topic in enumerate(TOPICS + ["Heaps"], 1)]
+        pages[2] = "Hash tables map keys to 99 buckets\n99"
+        
+        cleaned, removed = strip_boilerplate(pages)
+        
+        assert removed == 4
+        assert cleaned[0] == "Sorting, explained with examples"
+        assert cleaned[2].endswith("\n99")
+    
+    def test_numeric_slide_content_is_kept(self):
+        """Numbers that are the content of short slides are not page numbers"""
+        pages = ["The answer\n42", "Days in a week\n7", "Release year\n2024", "Steps\n1.\nMix"]
+        
+        assert strip_boilerplate(pages) == (pages, 0)
+    
+    def test_short_documents_keep_their_lines(self):
+        """Lines repeated on fewer than min_pages pages are not boilerplate"""
+        pages = ["Title\nBody one", "Title\nBody two"]
+        
+        assert strip_boilerplate(pages) == (pages, 0)
+    
+    def test_stats_report_reduction(self):
+        """Removed characters and tokens are reported"""
+        pages, stats = clean_pdf_pages(lecture_pages())
+        
+        assert stats["chars_removed"] == stats["chars_before"] - sum(len(page) for page in pages)
+        assert stats["tokens_removed"] > 0
+        assert stats["reduction_percent"] >= 10
+
+@pytest.fixture
+def lecture_pdf(tmp_path):
+    """A PDF of the lecture pages, plus one blank page"""
+    import fitz  # PyMuPDF
+    path = str(tmp_path / "lecture.pdf")
+    with fitz.open() as document:
+        for text in lecture_pages(5):
+            document.new_page().insert_text((72, 72), text, fontsize=10)
+        document.new_page()
+        document.save(path)
+    return path
+
+class TestExtraction:
+    """Test page extraction and the process pool"""
+    
+    def test_pages_are_extracted_in_order(self, lecture_pdf):
+        """Each page reports its text, extractor and timing"""
+        pages = extract_page_range(lecture_pdf, 0, 6)
+        
+        assert [page["page"] for page in pages] == [1, 2, 3, 4, 5, 6]
+        assert "Lecture 2:" in pages[1]["text"]
+        assert [page["extractor"] for page in pages] == ["pymupdf"] * 6
+        assert pages[5]["text"].strip() == ""
+        assert all(page["seconds"] >= 0 for page in pages)
+    
+    def test_pdfplumber_extractor(self, lecture_pdf):
+        """The layout-sensitive extractor reads the same pages"""
+        pages = extract_page_range(lecture_pdf, 1, 3, extractor="pdfplumber")
+        
+        assert [page["extractor"] for page in pages] == ["pdfplumber"] * 2
+        assert "Lecture 3:" in pages[1]["text"]
+    
+    def test_pool_extraction_matches_serial(self, monkeypatch, lecture_pdf):
+        """Page ranges split across workers come back in page order with timings"""
+        monkeypatch.setattr(settings, "pdf_extract_workers", 2)
+        monkeypatch.setattr(settings, "pdf_pages_per_task", 2)
+        monkeypatch.setattr(pdf_service, "pdf_executor", None)
+        try:
+            pages, stats = asyncio.run(pdf_service.extract_pdf_pages(lecture_pdf))
+        finally:
+            pdf_service.shutdown_pdf_executor()
+        
+        assert [page["text"] for page in pages] == [page["text"] for page in extract_page_range(lecture_pdf, 0, 6)]
+        assert stats["pages"] == 6
+        assert stats["tasks"] == 3
+        assert stats["workers"] == 2
+        assert stats["fallback_pages"] == 0
+        assert len(stats["slowest_pages"]) == 5
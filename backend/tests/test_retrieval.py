@@ -0,0 +1,90 @@
+"""
+Unit tests for multi-query retrieval
+"""
+import pytest
+import asyncio
+import sys
+import os
+
+# Add the app directory to Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.services import simple_rag
+from app.services.simple_rag import SimpleRAGPipeline
+from app.core.embeddings import EmbeddingsService
+from app.core.embedding_backends import HashingEmbeddingBackend
+from app.core.vector_store import LocalVectorStore
+
+class CountingStore(LocalVectorStore):
+    """Local store that counts search round trips"""
+    
+    searches = 0
+    
+    async def query_chunks(self, *args, **kwargs):
+        self.searches += 1
+        return await super().query_chunks(*args, **kwargs)
+    
+    async def query_chunks_batch(self, *args, **kwargs):
+        self.searches += 1
+        return await super().query_chunks_batch(*args, **kwargs)
+
+@pytest.fixture
+def pipeline(tmp_path, monkeypatch):
+    """Pipeline over a local store with a few chunks and local embeddings"""
+    service = EmbeddingsService(backend=HashingEmbeddingBackend(dimension=256))
+    service.cache = None
+    service.coalescer = None
+    texts = [
+        "Photosynthesis converts light energy into chemical energy in plants",
+        "Chlorophyll absorbs light in the chloroplasts",
+        "The Calvin cycle fixes carbon dioxide into sugar",
+        "The French revolution began in 1789"
+    ]
+    store = CountingStore(str(tmp_path / "index"), vector_size=256)
+    store.add_chunks_sync([{"text": text} for text in texts], service.embed_texts(texts), "doc")
+    monkeypatch.setattr(simple_rag, "vector_store", store)
+    
+    pipeline = SimpleRAGPipeline()
+    pipeline.embeddings_service = service
+    return pipeline
+
+class TestMultiQueryRetrieval:
+    """Test query expansion, batched search and fusion"""
+    
+    def test_sub_queries_share_one_search(self, pipeline, monkeypatch):
+        """All sub-queries are searched in a single batch and fused"""
+        async def expand(query, intent="chat"):
+            return [query, "chlorophyll light absorption", "calvin cycle carbon dioxide"]
+        monkeypatch.setattr(pipeline, "expand_query", expand)
+        
+        result = asyncio.run(pipeline.retrieve("how does photosynthesis work", doc_id="doc", top_k=3))
+        
+        texts = [chunk["text"] for chunk in result["context_chunks"]]
+        assert len(result["queries"]) == 3
+        assert simple_rag.vector_store.searches == 1
+        assert "The French revolution began in 1789" not in texts
+        assert any("Calvin" in text for text in texts)
+        assert all("rrf_score" in chunk for chunk in result["context_chunks"])
+    
+    def test_expansion_disabled(self, pipeline, monkeypatch):
+        """With no sub-queries the question is searched on its own"""
+        monkeypatch.setattr(simple_rag.settings, "multi_query_count", 0)
+        
+        result = asyncio.run(pipeline.retrieve("photosynthesis in plants", top_k=2))
+        
+        assert result["queries"] == ["photosynthesis in plants"]
+        assert result["context_chunks"][0]["text"].startswith("Photosynthesis")
+
+    def test_sub_queries_are_coalesced(self, pipeline, monkeypatch):
+        """Sub-query embeddings go through the query coalescer"""
+        from app.core.embeddings import QueryCoalescer
+        service = pipeline.embeddings_service
+        service.coalescer = QueryCoalescer(service._embed_and_cache, window_ms=50, max_batch=64)
+        async def expand(query, intent="chat"):
+            return [query, "chlorophyll light absorption", "calvin cycle carbon dioxide"]
+        monkeypatch.setattr(pipeline, "expand_query", expand)
+        
+        result = asyncio.run(pipeline.retrieve("how does photosynthesis work", doc_id="doc", top_k=3))
+        
+        assert len(result["context_chunks"]) == 3
+        assert service.coalescer.stats() == {"requests": 1, "queries": 3, "avg_batch_size": 3.0}
@@ -0,0 +1,73 @@
+"""
+Unit tests for snapshot export/import
+"""
+import pytest
+import asyncio
+import numpy as np
+import sys
+import os
+
+# Add the app directory to Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.core.vector_store import LocalVectorStore
+from app.core.document_registry import DocumentRegistry
+from app.services.snapshot_service import export_snapshot, import_snapshot, list_snapshots
+
+class TestSnapshots:
+    """Test exporting a store and warming an empty one from the snapshot"""
+    
+    def test_roundtrip(self, tmp_path):
+        """Imported points, vectors and registry records match the source"""
+        source = LocalVectorStore(str(tmp_path / "source"), vector_size=4)
+        vectors = np.random.default_rng(2).standard_normal((25, 4)).astype(np.float32)
+        source.add_chunks_sync([{"text": f"chunk {i}", "page": i} for i in range(25)], vectors, "doc")
+        source_registry = DocumentRegistry(str(tmp_path / "source.sqlite3"))
+        source_registry.register("doc", "book.pdf", "pdf", chunk_count=25)
+        source_registry.mark_completed("doc", chunk_count=25, timings={"total_seconds": 2.0})
+        
+        path = str(tmp_path / "snapshots" / "snap-1")
+        manifest = asyncio.run(export_snapshot(path, store=source, registry=source_registry, batch_size=10))
+        assert manifest["points"] == 25
+        assert [snapshot["name"] for snapshot in list_snapshots(str(tmp_path / "snapshots"))] == ["snap-1"]
+        
+        target = LocalVectorStore(str(tmp_path / "target"), vector_size=4)
+        target_registry = DocumentRegistry(str(tmp_path / "target.sqlite3"))
+        stats = asyncio.run(import_snapshot(path, store=target, registry=target_registry, batch_size=7))
+        
+        assert stats["points"] == 25
+        assert target.get_chunk_hashes_sync("doc") == source.get_chunk_hashes_sync("doc")
+        assert target.query_chunks_sync(vectors[3], top_k=1)[0]["text"] == "chunk 3"
+        assert target_registry.get("doc")["timings"] == {"total_seconds": 2.0}
+    
+    def test_import_refuses_non_empty_store(self, tmp_path):
+        """Importing into a store that already has points needs force"""
+        store = LocalVectorStore(str(tmp_path / "store"), vector_size=4)
+        store.add_chunks_sync([{"text": "x"}], np.ones((1, 4), dtype=np.float32), "doc")
+        registry = DocumentRegistry(str(tmp_path / "registry.sqlite3"))
+        path = str(tmp_path / "snap")
+        asyncio.run(export_snapshot(path, store=store, registry=registry))
+        
+        with pytest.raises(ValueError):
+            asyncio.run(import_snapshot(path, store=store, registry=registry))
+        assert asyncio.run(import_snapshot(path, store=store, registry=registry, force=True))["points"] == 1
+        
+        with pytest.raises(FileExistsError):
+            asyncio.run(export_snapshot(path, store=store, registry=registry))
+
+    def test_import_refuses_other_vector_space(self, monkeypatch, tmp_path):
+        """Vectors embedded by another backend or model are only imported with force"""
+        from app.services import snapshot_service
+        store = LocalVectorStore(str(tmp_path / "store"), vector_size=4)
+        store.add_chunks_sync([{"text": "x"}], np.ones((1, 4), dtype=np.float32), "doc")
+        registry = DocumentRegistry(str(tmp_path / "registry.sqlite3"))
+        path = str(tmp_path / "snap")
+        manifest = asyncio.run(export_snapshot(path, store=store, registry=registry))
+        monkeypatch.setattr(snapshot_service, "get_vector_space", lambda: "hashing-4")
+        target = LocalVectorStore(str(tmp_path / "target"), vector_size=4)
+        
+        assert manifest["vector_space"] != "hashing-4"
+        with pytest.raises(ValueError, match="embedded in"):
+            asyncio.run(import_snapshot(path, store=target, registry=registry))
+        assert target.count() == 0
+        assert asyncio.run(import_snapshot(path, store=target, registry=registry, force=True))["points"] == 1
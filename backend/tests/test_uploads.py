@@ -0,0 +1,147 @@
+"""
+Unit tests for streaming upload handling
+"""
+import pytest
+import asyncio
+import hashlib
+import io
+import sys
+import os
+
+# Add the app directory to Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from fastapi import HTTPException, UploadFile
+
+from app.api import routes_docs
+from app.core.config import settings
+from app.core.document_registry import DocumentRegistry
+from app.core.job_queue import JobQueue
+from app.services import ingestion_service
+
+def make_upload(content: bytes, size=None) -> UploadFile:
+    return UploadFile(io.BytesIO(content), size=size, filename="notes.txt")
+
+class TestSaveUpload:
+    """Test block-wise saving, hashing and size enforcement"""
+    
+    @pytest.fixture(autouse=True)
+    def upload_dir(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(routes_docs, "STORAGE_DIR", str(tmp_path))
+        monkeypatch.setattr(settings, "upload_block_size", 4)
+        return tmp_path
+    
+    def test_saves_and_hashes_in_one_pass(self):
+        """The stored file, size and hash match the upload"""
+        content = b"Mitochondria are the powerhouse of the cell."
+        upload = asyncio.run(routes_docs.save_upload(make_upload(content), "doc"))
+        routes_docs.commit_upload(upload)
+        
+        with open(upload["path"], "rb") as f:
+            assert f.read() == content
+        assert upload["size_bytes"] == len(content)
+        assert upload["content_hash"] == hashlib.sha256(content).hexdigest()
+        assert upload["has_text"]
+    
+    def test_whitespace_upload_has_no_text(self):
+        """Blank uploads are detected while streaming"""
+        upload = asyncio.run(routes_docs.save_upload(make_upload(b" \n\t\n  "), "doc"))
+        
+        assert not upload["has_text"]
+    
+    def test_oversized_upload_is_aborted(self, monkeypatch, upload_dir):
+        """Crossing the limit raises 413 and removes the partial file"""
+        monkeypatch.setattr(settings, "max_file_size", 10)
+        
+        with pytest.raises(HTTPException) as error:
+            asyncio.run(routes_docs.save_upload(make_upload(b"x" * 64), "doc"))
+        assert error.value.status_code == 413
+        assert list(upload_dir.iterdir()) == []
+        
+        # A declared size over the limit is rejected before reading
+        with pytest.raises(HTTPException) as error:
+            asyncio.run(routes_docs.save_upload(make_upload(b"", size=11), "doc"))
+        assert error.value.status_code == 413
+    
+    def test_failed_reupload_keeps_current_file(self, monkeypatch, upload_dir):
+        """The stored file is only replaced once a re-upload has been saved in full"""
+        current = upload_dir / "doc_notes.txt"
+        current.write_bytes(b"Version 1")
+        monkeypatch.setattr(settings, "max_file_size", 10)
+        
+        with pytest.raises(HTTPException):
+            asyncio.run(routes_docs.save_upload(make_upload(b"x" * 64), "doc"))
+        
+        assert current.read_bytes() == b"Version 1"
+        assert list(upload_dir.iterdir()) == [current]
+        
+        upload = asyncio.run(routes_docs.save_upload(make_upload(b"Version 2"), "doc"))
+        assert current.read_bytes() == b"Version 1"
+        routes_docs.commit_upload(upload)
+        assert current.read_bytes() == b"Version 2"
+        assert list(upload_dir.iterdir()) == [current]
+
+class TestDuplicateUploads:
+    """Test content-hash deduplication of uploads"""
+    
+    @pytest.fixture
+    def queue(self, monkeypatch, tmp_path):
+        queue = JobQueue(str(tmp_path / "jobs.sqlite3"))
+        monkeypatch.setattr(ingestion_service, "get_job_queue", lambda: queue)
+        monkeypatch.setattr(ingestion_service, "ingestion_workers", None)
+        return queue
+    
+    @pytest.fixture
+    def registry(self, monkeypatch, tmp_path, queue):
+        registry = DocumentRegistry(str(tmp_path / "documents.sqlite3"))
+        monkeypatch.setattr(routes_docs, "STORAGE_DIR", str(tmp_path))
+        monkeypatch.setattr(routes_docs, "get_document_registry", lambda: registry)
+        return registry
+    
+    def upload(self, content: bytes, doc_id=None):
+        return asyncio.run(routes_docs.upload_text(file=make_upload(content), doc_id=doc_id))
+    
+    def test_same_content_returns_existing_document(self, queue, registry):
+        """A repeated upload is answered with the first doc_id and nothing is ingested"""
+        first = self.upload(b"Osmosis is the diffusion of water across a membrane.")
+        assert queue.count() == 1
+        
+        second = self.upload(b"Osmosis is the diffusion of water across a membrane.")
+        
+        assert second["doc_id"] == first["doc_id"]
+        assert second["duplicate_of"] == "notes.txt"
+        assert queue.count() == 1
+        assert registry.count() == 1
+        assert os.path.exists(registry.get(first["doc_id"])["file_path"])
+    
+    def test_changed_settings_reingest(self, monkeypatch, queue, registry):
+        """Content ingested with other chunking settings is ingested again"""
+        first = self.upload(b"Osmosis is the diffusion of water across a membrane.")
+        monkeypatch.setattr(settings, "chunk_size", 500)
+        
+        second = self.upload(b"Osmosis is the diffusion of water across a membrane.")
+        
+        assert second["doc_id"] != first["doc_id"]
+        assert queue.count() == 2
+    
+    def test_changed_vector_space_or_store_reingests(self, monkeypatch, queue, registry):
+        """Content whose vectors are in another embedding space or store is ingested again"""
+        monkeypatch.setattr(settings, "vector_store_backend", "qdrant")
+        self.upload(b"Osmosis is the diffusion of water across a membrane.")
+        monkeypatch.setattr(settings, "embedding_backend", "hashing")
+        self.upload(b"Osmosis is the diffusion of water across a membrane.")
+        monkeypatch.setattr(settings, "qdrant_collection", "studybuddy_docs_v2")
+        self.upload(b"Osmosis is the diffusion of water across a membrane.")
+        
+        assert queue.count() == 3
+        assert registry.count() == 3
+    
+    def test_failed_documents_are_not_reused(self, queue, registry):
+        """Only processing or completed documents are returned for duplicates"""
+        first = self.upload(b"Osmosis is the diffusion of water across a membrane.")
+        registry.mark_failed(first["doc_id"], "embedding error")
+        
+        second = self.upload(b"Osmosis is the diffusion of water across a membrane.")
+        
+        assert second["doc_id"] != first["doc_id"]
+        assert queue.count() == 2
@@ -0,0 +1,99 @@
+"""
+Unit tests for the in-process vector store
+"""
+import pytest
+import asyncio
+import numpy as np
+import sys
+import os
+
+# Add the app directory to Python path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.core.vector_store import LocalVectorStore
+
+def make_chunks(doc_id, count):
+    return [{"chunk_id": f"{doc_id}_chunk_{i}", "text": f"{doc_id} text {i}", "page": i} for i in range(count)]
+
+def unit(*values):
+    return np.asarray(values, dtype=np.float32)
+
+class TestLocalVectorStore:
+    """Test add, query, filter, delete and persistence"""
+    
+    def test_query_orders_by_cosine_and_filters_doc(self, tmp_path):
+        """Results are ranked by cosine similarity and respect the doc_id filter"""
+        store = LocalVectorStore(str(tmp_path / "index"), vector_size=3)
+        store.add_chunks_sync(make_chunks("a", 2), np.stack([unit(1, 0, 0), unit(1, 1, 0)]), "a")
+        store.add_chunks_sync(make_chunks("b", 1), np.stack([unit(2, 0.1, 0)]), "b")
+        
+        results = store.query_chunks_sync(unit(1, 0, 0), top_k=2)
+        assert [result["text"] for result in results] == ["a text 0", "b text 0"]
+        assert results[0]["score"] == pytest.approx(1.0)
+        
+        filtered = store.query_chunks_sync(unit(1, 0, 0), doc_id="a", top_k=5)
+        assert [result["text"] for result in filtered] == ["a text 0", "a text 1"]
+        assert store.query_chunks_sync(unit(0, 0, 1)) == []  # below the score threshold
+    
+    def test_upsert_delete_and_reload(self, tmp_path):
+        """Same chunk IDs overwrite, deletes free rows, and the index survives a restart"""
+        path = str(tmp_path / "index")
+        store = LocalVectorStore(path, vector_size=3)
+        store.add_chunks_sync(make_chunks("a", 2), np.stack([unit(1, 0, 0), unit(0, 1, 0)]), "a")
+        store.add_chunks_sync(make_chunks("a", 1), np.stack([unit(0, 0, 1)]), "a")
+        store.add_chunks_sync(make_chunks("b", 1), np.stack([unit(1, 0, 0)]), "b")
+        assert store.count() == 3
+        
+        asyncio.run(store.delete_document("b"))
+        assert store.count() == 2
+        
+        reopened = LocalVectorStore(path, vector_size=3)
+        assert reopened.count() == 2
+        assert reopened.query_chunks_sync(unit(0, 0, 1), top_k=1)[0]["chunk_id"] == "a_chunk_0"
+        assert set(asyncio.run(reopened.get_chunk_hashes("a"))) == set(store.get_chunk_hashes_sync("a"))
+    
+    def test_grows_past_initial_capacity(self, tmp_path):
+        """The memory-mapped matrix grows when more rows are added"""
+        store = LocalVectorStore(str(tmp_path / "index"), vector_size=4)
+        vectors = np.random.default_rng(0).standard_normal((3000, 4)).astype(np.float32)
+        store.add_chunks_sync(make_chunks("big", 3000), vectors, "big")
+        
+        best = store.query_chunks_sync(vectors[1234], top_k=1)[0]
+        assert best["chunk_id"] == "big_chunk_1234"
+        assert best["score"] == pytest.approx(1.0, abs=1e-5)
+    
+    def test_rejects_other_dimension(self, tmp_path):
+        """An index can't be reopened with a different vector size"""
+        path = str(tmp_path / "index")
+        LocalVectorStore(path, vector_size=3)
+        
+        with pytest.raises(ValueError):
+            LocalVectorStore(path, vector_size=4)
+    
+    def test_batch_query_matches_single_queries(self, tmp_path):
+        """One batched scan returns the same results as separate queries"""
+        store = LocalVectorStore(str(tmp_path / "index"), vector_size=8)
+        vectors = np.random.default_rng(1).standard_normal((50, 8)).astype(np.float32)
+        store.add_chunks_sync(make_chunks("a", 50), vectors, "a")
+        
+        batched = store.query_chunks_batch_sync(vectors[:3], top_k=4)
+        single = [store.query_chunks_sync(vector, top_k=4) for vector in vectors[:3]]
+        
+        assert [[chunk["id"] for chunk in results] for results in batched] == \
+            [[chunk["id"] for chunk in results] for results in single]
+        assert [chunk["score"] for chunk in batched[2]] == pytest.approx([chunk["score"] for chunk in single[2]])
+
+class TestReciprocalRankFusion:
+    """Test fusing ranked result lists"""
+    
+    def test_chunks_found_by_several_queries_rank_first(self):
+        """RRF rewards agreement between lists and keeps the best similarity"""
+        from app.core.vector_store import reciprocal_rank_fusion
+        a, b, c = ({"id": name, "score": score} for name, score in (("a", 0.9), ("b", 0.8), ("c", 0.7)))
+        
+        fused = reciprocal_rank_fusion([[a, b], [c, dict(b, score=0.95)], [b]], k=60)
+        
+        assert [chunk["id"] for chunk in fused] == ["b", "a", "c"]
+        assert fused[0]["score"] == 0.95
+        assert fused[0]["rrf_score"] == pytest.approx(1 / 61 + 2 / 62)
+        assert len(reciprocal_rank_fusion([[a, b], [c]], top_k=2)) == 2
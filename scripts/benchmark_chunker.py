@@ -0,0 +1,90 @@
+"""
+Microbenchmark for chunk_text throughput (MB/s)
+
+Compares the boundary-index chunker with the previous character-scanning
+implementation on synthetic study text of increasing size:
+
+    python scripts/benchmark_chunker.py
+    python scripts/benchmark_chunker.py --sizes 1 4 16 --chunk-size 1000 --repeat 5
+"""
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+# Add backend app to path
+sys.path.append(str(Path(__file__).parent.parent / "backend"))
+
+from app.agents.chunker import chunk_text
+
+WORDS = (
+    "energy cell membrane protein function structure light reaction carbon cycle "
+    "equation force mass velocity theorem proof integral derivative history empire "
+    "revolution economy market supply demand"
+).split()
+
+def legacy_chunk_text(text: str, chunk_size: int = 1000, chunk_overlap: int = 100):
+    """Previous implementation (first .!? in a 400-character Python scan)"""
+    if not text or len(text) <= chunk_size:
+        return [text] if text else []
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = start + chunk_size
+        if end < len(text):
+            sentence_end = -1
+            for i in range(max(0, end - 200), min(len(text), end + 200)):
+                if text[i] in '.!?':
+                    sentence_end = i + 1
+                    break
+            if sentence_end > start + chunk_size // 2:
+                end = sentence_end
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        start = end - chunk_overlap
+        if start >= len(text):
+            break
+    return chunks
+
+def make_text(megabytes: float, seed: int = 0) -> str:
+    """Synthetic text with sentences of varying length and paragraph breaks"""
+    rng = random.Random(seed)
+    target = int(megabytes * 1024 * 1024)
+    parts = []
+    size = 0
+    while size < target:
+        sentence = " ".join(rng.choice(WORDS) for _ in range(rng.randint(20, 60))).capitalize()
+        sentence += rng.choice([". ", ". ", "? ", "! ", ".\n\n"])
+        parts.append(sentence)
+        size += len(sentence)
+    return "".join(parts)[:target]
+
+def measure(function, text: str, chunk_size: int, chunk_overlap: int, repeat: int):
+    """Best-of-repeat seconds and chunk count"""
+    best = float("inf")
+    chunks = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        chunks = function(text, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        best = min(best, time.perf_counter() - started)
+    return best, len(chunks)
+
+def main():
+    parser = argparse.ArgumentParser(description="chunk_text throughput benchmark")
+    parser.add_argument("--sizes", type=float, nargs="+", default=[1, 4, 16], help="Input sizes in MB")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--chunk-overlap", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    
+    print(f"{'size MB':>8} {'impl':>8} {'chunks':>8} {'seconds':>9} {'MB/s':>8}")
+    for megabytes in args.sizes:
+        text = make_text(megabytes)
+        for name, function in (("legacy", legacy_chunk_text), ("indexed", chunk_text)):
+            seconds, count = measure(function, text, args.chunk_size, args.chunk_overlap, args.repeat)
+            print(f"{megabytes:>8.1f} {name:>8} {count:>8} {seconds:>9.4f} {megabytes / seconds:>8.1f}")
+
+if __name__ == "__main__":
+    main()
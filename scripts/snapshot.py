@@ -0,0 +1,55 @@
+"""
+Export or import a StudyBuddy snapshot (vectors, payloads and document registry)
+
+Runs against the stores configured for the backend (.env / environment), so
+a new node can be warmed from a snapshot without re-embedding anything:
+
+    python scripts/snapshot.py export /backups/studybuddy-2024-05-01
+    python scripts/snapshot.py import /backups/studybuddy-2024-05-01
+    python scripts/snapshot.py list
+
+With VECTOR_STORE=local stop the backend first; the local index is owned by
+a single process.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+
+def main():
+    parser = argparse.ArgumentParser(description="StudyBuddy snapshot export/import")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    
+    export_parser = subparsers.add_parser("export", help="Export the vector store and registry")
+    export_parser.add_argument("path", help="Snapshot directory to create")
+    
+    import_parser = subparsers.add_parser("import", help="Bulk load a snapshot")
+    import_parser.add_argument("path", help="Snapshot directory")
+    import_parser.add_argument("--force", action="store_true", help="Import into a non-empty store")
+    
+    list_parser = subparsers.add_parser("list", help="List snapshots")
+    list_parser.add_argument("directory", nargs="?", help="Directory to list (default: SNAPSHOT_DIR)")
+    
+    args = parser.parse_args()
+    path = getattr(args, "path", None) or getattr(args, "directory", None)
+    path = os.path.abspath(path) if path else None
+    
+    # Relative storage paths in the settings are relative to backend/
+    os.chdir(BACKEND_DIR)
+    sys.path.insert(0, str(BACKEND_DIR))
+    from app.services.snapshot_service import export_snapshot, import_snapshot, list_snapshots
+    
+    if args.command == "export":
+        result = asyncio.run(export_snapshot(path))
+    elif args.command == "import":
+        result = asyncio.run(import_snapshot(path, force=args.force))
+    else:
+        result = list_snapshots(path)
+    print(json.dumps(result, indent=2))
+
+if __name__ == "__main__":
+    main()